@@ -1,27 +1,56 @@
 import streamlit as st
-import mysql.connector
 import json
 import uuid
 import time
-import requests
-from PIL import Image
-import google.generativeai as genai
-import streamlit.components.v1 as components
-from datetime import datetime
-import bcrypt
+import math
+import hashlib
+from datetime import datetime, date, timedelta
+from collections import Counter
 import os
+import db_metrics
+import llm_metrics
+import profiling
+import parallel_io
+import storage
+import curriculum
+import content_pack
+import qa_cache
+import gemini_pool
+import pet_collection
+import warmup
+
+# Per-rerun timing spans (see profiling.py); cProfile is opt-in per admin session
+st.session_state.prof_last_run = st.session_state.get('prof_run')
+st.session_state.prof_run = profiling.start_run(
+    st.session_state.prof_last_run,
+    profile=st.session_state.get('profile_enabled', False) and st.session_state.get('authenticated', False))
 
 # =============================================================================
 # 0. MODEL CONFIGURATION
 # =============================================================================
+profiling.mark("0. MODEL CONFIGURATION")
 MODEL_CONFIG = {
     "FLASH": "gemini-2.0-flash",
     "ULTRA": "gemini-2.0-pro"
 }
 
+# Calls are spread over every configured API key (see gemini_pool.py); google.generativeai
+# is imported on the first LLM call, not at startup (slow import, cold starts)
+@st.cache_resource(show_spinner=False)
+def get_gemini_pool():
+    return gemini_pool.from_config(st.secrets)
+
+def get_model(name):
+    return get_gemini_pool().model(name)
+
+def llm_generate(model, contents, call_site, **kwargs):
+    """model.generate_content() with latency/token telemetry (see llm_metrics.py)"""
+    return llm_metrics.generate(model, contents, call_site, user_id=st.session_state.get('user_id'), **kwargs)
+
 # =============================================================================
 # 1. PAGE CONFIGURATION
 # =============================================================================
+profiling.mark("1. PAGE CONFIGURATION")
 st.set_page_config(
     page_title="Sorokin Portal",
     page_icon="🎓",
@@ -29,9 +58,18 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+# Attribute this rerun's queries to a fresh per-run aggregate (see db_metrics.py)
+if 'db_session_stats' not in st.session_state:
+    st.session_state.db_session_stats = db_metrics.QueryStats("session")
+st.session_state.db_last_run = st.session_state.get('db_run')
+st.session_state.db_run = db_metrics.start_run(st.session_state.db_session_stats,
+                                               f"rerun {st.session_state.get('rerun_seq', 0) + 1}",
+                                               st.session_state.db_last_run)
+
 # =============================================================================
 # 2. THEME CONFIGURATION
 # =============================================================================
+profiling.mark("2. THEME CONFIGURATION")
 THEMES = {
     "Auto": {"bg": "#1a2a3a", "accent": "#f1c40f", "text": "#ffffff"},  # Defaults to Dark Ocean
     "Dark Ocean": {"bg": "#1a2a3a", "accent": "#f1c40f", "text": "#ffffff"},
@@ -47,18 +85,44 @@ def get_theme():
 # =============================================================================
 # 3. VISITOR TRACKING
 # =============================================================================
-if 'visit_counted' not in st.session_state:
-    try:
-        requests.get("https://script.google.com/macros/s/AKfycbyY3GUNUMJGxIufUNkmnncdvMklbQdr6s_VDZvsJZj-BnTcEW-7-7pNlAN8EchosAdCNw/exec", timeout=1)
-        st.session_state.visit_counted = True
-    except: pass
+profiling.mark("3. VISITOR TRACKING")
+def count_visit():
+    import requests
+    requests.get("https://script.google.com/macros/s/AKfycbyY3GUNUMJGxIufUNkmnncdvMklbQdr6s_VDZvsJZj-BnTcEW-7-7pNlAN8EchosAdCNw/exec", timeout=1)
+
+# Fire-and-forget, so a slow tracker never delays the first paint
+if 'visit_counted' not in st.session_state and not st.query_params.get("warmup"):
+    parallel_io.submit(count_visit)
+    st.session_state.visit_counted = True
 
 # =============================================================================
 # 4. DYNAMIC CSS
 # =============================================================================
-def apply_css():
-    t = get_theme()
-    st.markdown(f"""<style>
+profiling.mark("4. DYNAMIC CSS")
+# st.html runs page scripts and st.iframe embeds HTML; Streamlit releases without st.iframe get
+# components.html, imported on first use (it is deprecated where st.iframe exists)
+def page_script(html):
+    """Run a <script> in the app page itself (no iframe, no height)"""
+    if hasattr(st, "iframe"):
+        st.html(html, unsafe_allow_javascript=True)
+    else:
+        import streamlit.components.v1 as components
+        components.html(html, height=0)
+
+def embed_html(html, height):
+    """Show HTML with its own scripts in an iframe `height` pixels tall"""
+    if hasattr(st, "iframe"):
+        st.iframe(html, height=height)
+    else:
+        import streamlit.components.v1 as components
+        components.html(html, height=height)
+
+# Served by Streamlit static file serving (server.enableStaticServing)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+STATIC_URL = "app/static"
+
+def theme_css(t):
+    return f"""
     .stApp {{ background-color: {t['bg']} !important; }}
     h1,h2,h3,h4,h5,h6,p,label,span,div,li {{ color: {t['text']} !important; }}
     div[data-baseweb="popover"] {{ background-color: #fff !important; border-radius: 12px !important; }}
@@ -73,195 +137,90 @@ def apply_css():
     .level-display {{ background: linear-gradient(135deg, {t['accent']}, #e74c3c); padding: 10px 20px; border-radius: 12px; text-align: center; }}
     .pomodoro-timer {{ font-size: 48px; font-weight: bold; text-align: center; padding: 20px; border-radius: 12px; border: 2px solid {t['accent']}; }}
     .beta-banner {{ background: linear-gradient(90deg, #9b59b6, #3498db); color: white; padding: 8px 15px; border-radius: 8px; text-align: center; font-weight: bold; }}
-</style>""", unsafe_allow_html=True)
+"""
+
+@st.cache_resource(show_spinner=False)
+def build_theme_assets():
+    """Write one content-hashed stylesheet per theme into static/themes (once per process)"""
+    urls = {}
+    try:
+        os.makedirs(os.path.join(STATIC_DIR, "themes"), exist_ok=True)
+        for name, t in THEMES.items():
+            css = theme_css(t)
+            slug = name.lower().replace(" ", "-")
+            fname = f"{slug}-{hashlib.sha1(css.encode()).hexdigest()[:10]}.css"
+            path = os.path.join(STATIC_DIR, "themes", fname)
+            if not os.path.exists(path):
+                with open(path, "w") as f: f.write(css)
+            urls[name] = f"{STATIC_URL}/themes/{fname}"
+    except OSError:
+        return {}
+    return urls
+
+@profiling.timed()
+def apply_css():
+    """Swap the theme stylesheet <link> in the page head; only emits when the theme changes"""
+    theme = st.session_state.get('theme', 'Auto')
+    if st.session_state.get('css_theme') == theme:
+        return
+    url = build_theme_assets().get(theme)
+    if not url:
+        # Read-only app dir: fall back to inlining the stylesheet on every rerun
+        st.markdown(f"<style>{theme_css(get_theme())}</style>", unsafe_allow_html=True)
+        return
+    page_script(f"""<script>
+const head = window.parent.document.head;
+let link = head.querySelector('#sorokin-theme');
+if (!link) {{
+    link = window.parent.document.createElement('link');
+    link.id = 'sorokin-theme';
+    link.rel = 'stylesheet';
+    head.appendChild(link);
+}}
+link.href = new URL('{url}', window.parent.location.href).href;
+</script>""")
+    st.session_state.css_theme = theme
 apply_css()
 
 # =============================================================================
 # 5. DATABASE CONNECTION
 # =============================================================================
-def get_db():
-    try:
-        ssl = {"ssl_verify_cert": True}
-        if os.path.exists("/etc/ssl/certs/ca-certificates.crt"):
-            ssl["ssl_ca"] = "/etc/ssl/certs/ca-certificates.crt"
-        return mysql.connector.connect(
-            host=st.secrets["DB_HOST"], port=4000,
-            user=st.secrets["DB_USER"], password=st.secrets["DB_PASSWORD"],
-            database=st.secrets["DB_NAME"], connection_timeout=10, **ssl
-        )
-    except Exception as e:
-        st.error(f"DB Error: {e}")
-        st.stop()
+profiling.mark("5. DATABASE CONNECTION")
+def _db_unavailable(e):
+    st.error(f"DB Error: {e}")
+    st.stop()
+
+@st.cache_resource(show_spinner=False)
+def get_storage():
+    """Repositories over the backend named by the DB_BACKEND secret (mysql or sqlite)"""
+    return storage.open_storage(st.secrets, wrap=db_metrics.instrument, on_connect_error=_db_unavailable)
 
+@st.cache_resource(show_spinner=False)
 def init_db():
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        
-        cur.execute("""CREATE TABLE IF NOT EXISTS Users (
-            id INT AUTO_INCREMENT PRIMARY KEY, username VARCHAR(255) UNIQUE NOT NULL,
-            hashed_password VARCHAR(255) NOT NULL, grade VARCHAR(50), subject VARCHAR(50) DEFAULT 'Gen',
-            flash_usage INT DEFAULT 0, pro_usage INT DEFAULT 0, user_id VARCHAR(255) UNIQUE NOT NULL,
-            session_id VARCHAR(255), last_active_date VARCHAR(20), ai_level VARCHAR(50) DEFAULT 'Grade-Level',
-            theme VARCHAR(50) DEFAULT 'Dark Ocean', total_xp INT DEFAULT 0, level INT DEFAULT 1
-        );""")
-        
-        cur.execute("""CREATE TABLE IF NOT EXISTS ChatLogs (
-            id INT AUTO_INCREMENT PRIMARY KEY, session_id VARCHAR(255) NOT NULL,
-            user_id VARCHAR(255) NOT NULL, title VARCHAR(255), messages JSON,
-            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );""")
-        
-        cur.execute("""CREATE TABLE IF NOT EXISTS UserBadges (
-            id INT AUTO_INCREMENT PRIMARY KEY, user_id VARCHAR(255) NOT NULL,
-            badge_id VARCHAR(50) NOT NULL, earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(user_id, badge_id)
-        );""")
-        
-        cur.execute("""CREATE TABLE IF NOT EXISTS UserLessonProgress (
-            id INT AUTO_INCREMENT PRIMARY KEY, user_id VARCHAR(255) NOT NULL,
-            lesson_key VARCHAR(100) NOT NULL, status VARCHAR(20) DEFAULT 'available',
-            completed_date TIMESTAMP NULL, quiz_score INT DEFAULT 0,
-            UNIQUE(user_id, lesson_key)
-        );""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS SeasonalEvents (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            event_name VARCHAR(100),
-            start_date DATE,
-            end_date DATE,
-            badge_id VARCHAR(50),
-            is_active BOOLEAN DEFAULT FALSE
-        );""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Pets (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            pet_id VARCHAR(50) UNIQUE NOT NULL,
-            name VARCHAR(100) NOT NULL,
-            emoji VARCHAR(10) NOT NULL,
-            rarity VARCHAR(20) NOT NULL,
-            xp_multiplier DECIMAL(4,3) NOT NULL,
-            is_limited BOOLEAN DEFAULT FALSE,
-            limited_until DATETIME NULL,
-            description TEXT
-        );""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS UserPets (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id VARCHAR(255) NOT NULL,
-            pet_id VARCHAR(50) NOT NULL,
-            acquired_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            is_equipped BOOLEAN DEFAULT FALSE,
-            equip_slot INT NULL,
-            INDEX idx_user_pets (user_id),
-            INDEX idx_equipped (user_id, is_equipped)
-        );""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS UserEggPurchases (
-            id INT AUTO_INCREMENT PRIMARY KEY,
-            user_id VARCHAR(255) NOT NULL,
-            egg_type VARCHAR(50) NOT NULL,
-            purchased_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            pet_received VARCHAR(50) NOT NULL,
-            INDEX idx_user_purchases (user_id)
-        );""")
-
-        # Add columns if missing
-        columns_to_add = [
-            ("theme", "VARCHAR(50) DEFAULT 'Auto'"),
-            ("total_xp", "INT DEFAULT 0"),
-            ("level", "INT DEFAULT 1"),
-            ("streak_count", "INT DEFAULT 0"),
-            ("last_study_date", "DATE"),
-            ("daily_goal", "INT DEFAULT 3"),
-            ("daily_lessons_completed", "INT DEFAULT 0"),
-            ("last_spin_date", "DATE"),
-            ("streak_freezes", "INT DEFAULT 0"),
-            ("pet_stage", "VARCHAR(20) DEFAULT 'egg'"),
-            ("pet_mood", "VARCHAR(20) DEFAULT 'neutral'"),
-            ("sounds_enabled", "BOOLEAN DEFAULT TRUE"),
-            ("pomodoros_completed", "INT DEFAULT 0")
-        ]
-        for col_name, col_def in columns_to_add:
-            try: cur.execute(f"ALTER TABLE Users ADD COLUMN {col_name} {col_def};")
-            except: pass
-        
-        conn.commit()
-        cur.close()
-        conn.close()
+    """Create/migrate the schema - once per server process, not on every rerun"""
+    get_storage().create_schema()
 init_db()
 
+PET_COLUMNS = pet_collection.PET_COLUMNS
+PET_CATALOG = pet_collection.PET_CATALOG
+PETS_BY_ID = pet_collection.PETS_BY_ID
+
+@st.cache_resource(show_spinner=False)
 def seed_pets():
     """Seed all pets into the database"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-
-        # Check if pets already seeded
-        cur.execute("SELECT COUNT(*) FROM Pets")
-        if cur.fetchone()[0] > 0:
-            cur.close()
-            conn.close()
-            return
-
-        pets_data = [
-            # Common Pets (1.05x)
-            ('whiskers', 'Whiskers', '🐱', 'Common', 1.050, False, None, 'A friendly cat companion'),
-            ('buddy', 'Buddy', '🐶', 'Common', 1.050, False, None, 'Loyal dog friend'),
-            ('nibbles', 'Nibbles', '🐹', 'Common', 1.050, False, None, 'Energetic hamster'),
-            ('hoppy', 'Hoppy', '🐰', 'Common', 1.050, False, None, 'Bouncy bunny'),
-            ('shelly', 'Shelly', '🐢', 'Common', 1.050, False, None, 'Wise turtle'),
-            ('bubbles', 'Bubbles', '🐟', 'Common', 1.050, False, None, 'Cheerful fish'),
-
-            # Uncommon Pets (1.10x)
-            ('ember', 'Ember', '🦊', 'Uncommon', 1.100, False, None, 'Clever fox with fiery spirit'),
-            ('hoot', 'Hoot', '🦉', 'Uncommon', 1.100, False, None, 'Wise night owl'),
-            ('scales', 'Scales', '🦎', 'Uncommon', 1.100, False, None, 'Agile lizard'),
-            ('bamboo', 'Bamboo', '🐼', 'Uncommon', 1.100, False, None, 'Peaceful panda'),
-            ('spike', 'Spike', '🦔', 'Uncommon', 1.100, False, None, 'Spiky hedgehog'),
-            ('eucaly', 'Eucaly', '🐨', 'Uncommon', 1.100, False, None, 'Sleepy koala'),
-
-            # Rare Pets (1.20x)
-            ('leo', 'Leo', '🦁', 'Rare', 1.200, False, None, 'Majestic lion'),
-            ('shadow', 'Shadow', '🐺', 'Rare', 1.200, False, None, 'Mysterious wolf'),
-            ('storm', 'Storm', '🦅', 'Rare', 1.200, False, None, 'Soaring eagle'),
-            ('wave', 'Wave', '🐬', 'Rare', 1.200, False, None, 'Playful dolphin'),
-            ('coral', 'Coral', '🦩', 'Rare', 1.200, False, None, 'Elegant flamingo'),
-            ('flutter', 'Flutter', '🦋', 'Rare', 1.200, False, None, 'Graceful butterfly'),
-
-            # Epic Pets (1.35x)
-            ('sparkle', 'Sparkle', '🦄', 'Epic', 1.350, False, None, 'Magical unicorn'),
-            ('blaze', 'Blaze', '🐉', 'Epic', 1.350, False, None, 'Fierce dragon'),
-            ('prism', 'Prism', '🦚', 'Epic', 1.350, False, None, 'Dazzling peacock'),
-            ('ink', 'Ink', '🐙', 'Epic', 1.350, False, None, 'Intelligent octopus'),
-            ('fang', 'Fang', '🦈', 'Epic', 1.350, False, None, 'Fearsome shark'),
-
-            # Legendary Pets (1.50x)
-            ('celeste', 'Celeste', '🌟', 'Legendary', 1.500, False, None, 'Celestial star spirit'),
-            ('phoenix', 'Phoenix', '🔥', 'Legendary', 1.500, False, None, 'Immortal fire bird'),
-            ('frost', 'Frost', '❄️', 'Legendary', 1.500, False, None, 'Eternal ice dragon'),
-            ('thunder', 'Thunder', '⚡', 'Legendary', 1.500, False, None, 'Storm beast'),
-            ('aurora', 'Aurora', '🌈', 'Legendary', 1.500, False, None, 'Rainbow serpent'),
-
-            # New Year Limited Pets
-            ('sparkler', 'Sparkler', '🎆', 'Rare', 1.200, True, '2025-01-05 00:00:00', 'New Year firework creature'),
-            ('confetti', 'Confetti', '🎊', 'Epic', 1.350, True, '2025-01-05 00:00:00', 'Party spirit'),
-            ('midnight', 'Midnight', '🎇', 'Legendary', 1.500, True, '2025-01-05 00:00:00', 'Clock guardian'),
-        ]
-
-        cur.executemany("""INSERT INTO Pets (pet_id, name, emoji, rarity, xp_multiplier, is_limited, limited_until, description)
-                          VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""", pets_data)
-        conn.commit()
-        cur.close()
-        conn.close()
+    get_storage().pets.seed_catalog(PET_CATALOG, PET_COLUMNS)
 
 seed_pets()
 
+@st.cache_data(show_spinner=False)
+def pet_catalog():
+    """The seeded Pets table - static, so read once per server process"""
+    return get_storage().pets.catalog()
+
 # =============================================================================
 # 6. XP & LEVELING SYSTEM
 # =============================================================================
+profiling.mark("6. XP & LEVELING SYSTEM")
 LEVEL_THRESHOLDS = [0, 100, 250, 500, 1000, 1750, 2750, 4000, 5500, 7500, 10000]
 LEVEL_NAMES = ["Novice", "Learner", "Student", "Scholar", "Adept", "Expert", "Master", "Sage", "Luminary", "Genius", "Transcendent"]
 
@@ -274,45 +233,37 @@ def get_level_info(xp):
     progress = int(((xp - curr_th) / max(1, next_th - curr_th)) * 100) if level < len(LEVEL_THRESHOLDS) else 100
     return {"level": level, "name": LEVEL_NAMES[min(level-1, len(LEVEL_NAMES)-1)], "xp": xp, "progress": progress, "needed": max(0, next_th - xp)}
 
+@profiling.timed()
 def award_xp(user_id, amount):
     # Apply pet XP multiplier
     multiplier = calculate_xp_multiplier(user_id)
     base_amount = amount
     amount = int(amount * multiplier)
 
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        old_level = st.session_state.get('level', 1)
-        cur.execute("UPDATE Users SET total_xp = total_xp + %s WHERE user_id = %s", (amount, user_id))
-        cur.execute("SELECT total_xp FROM Users WHERE user_id = %s", (user_id,))
-        new_xp = cur.fetchone()[0]
-        lvl = get_level_info(new_xp)['level']
-        cur.execute("UPDATE Users SET level = %s WHERE user_id = %s", (lvl, user_id))
-        conn.commit()
-        cur.close()
-        conn.close()
-        st.session_state.total_xp = new_xp
-        st.session_state.level = lvl
-
-        # Show multiplier bonus if applicable
-        if multiplier > 1.0:
-            bonus_text = f"+{base_amount} XP (×{multiplier:.2f} from pets = {amount} XP)"
-            st.info(bonus_text)
-
-        # Play appropriate sound and update pet on level up
-        if lvl > old_level:
-            play_sound("levelup")
-            update_pet_status(user_id, lvl)
-        else:
-            play_sound("xp")
-        return new_xp
-    return 0
+    old_level = st.session_state.get('level', 1)
+    # Earned XP also goes to the all-time and this week's leaderboard rows, in the same transaction
+    new_xp, lvl = get_storage().users.add_xp(user_id, amount, lambda xp: get_level_info(xp)['level'],
+                                             boards=('all', week_board()), username=st.session_state.get('username'),
+                                             grade=st.session_state.get('grade'))
+    st.session_state.total_xp = new_xp
+    st.session_state.level = lvl
+
+    # Show multiplier bonus if applicable
+    if multiplier > 1.0:
+        bonus_text = f"+{base_amount} XP (×{multiplier:.2f} from pets = {amount} XP)"
+        st.info(bonus_text)
+
+    # Play appropriate sound (pet stage follows level on read)
+    if lvl > old_level:
+        play_sound("levelup")
+    else:
+        play_sound("xp")
+    return new_xp
 
 # =============================================================================
 # 7. BADGES SYSTEM
 # =============================================================================
+profiling.mark("7. BADGES SYSTEM")
 BADGES = {
     "first_lesson": {"name": "First Steps", "icon": "🎯", "desc": "Complete first lesson", "xp": 50},
     "five_lessons": {"name": "Getting Started", "icon": "📚", "desc": "Complete 5 lessons", "xp": 100},
@@ -329,356 +280,181 @@ BADGES = {
 
 def award_badge(user_id, badge_id):
     if badge_id not in BADGES: return False
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT id FROM UserBadges WHERE user_id=%s AND badge_id=%s", (user_id, badge_id))
-        if cur.fetchone():
-            cur.close(); conn.close(); return False
-        cur.execute("INSERT INTO UserBadges (user_id, badge_id) VALUES (%s, %s)", (user_id, badge_id))
-        conn.commit()
-        cur.close()
-        conn.close()
-        play_sound("badge")
-        award_xp(user_id, BADGES[badge_id]['xp'])
-        if 'badges' not in st.session_state: st.session_state.badges = []
-        st.session_state.badges.append(badge_id)
-        return True
-    return False
-
-def get_badges(user_id):
-    conn = get_db()
-    badges = []
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT badge_id FROM UserBadges WHERE user_id = %s", (user_id,))
-        badges = [r[0] for r in cur.fetchall()]
-        cur.close()
-        conn.close()
-    return badges
+    if not get_storage().badges.award(user_id, badge_id):
+        return False
+    play_sound("badge")
+    award_xp(user_id, BADGES[badge_id]['xp'])
+    if 'badges' not in st.session_state: st.session_state.badges = []
+    st.session_state.badges.append(badge_id)
+    return True
 
 # =============================================================================
 # 7B. PET COLLECTION SYSTEM
 # =============================================================================
-def open_egg(egg_type):
-    """Roll for a random pet based on egg type probabilities"""
-    import random
-
-    probabilities = {
-        'common': {'Common': 70, 'Uncommon': 25, 'Rare': 5},
-        'premium': {'Common': 40, 'Uncommon': 40, 'Rare': 15, 'Epic': 5},
-        'legendary': {'Uncommon': 30, 'Rare': 45, 'Epic': 20, 'Legendary': 5},
-        'newyear': {'Rare': 50, 'Epic': 35, 'Legendary': 15}
-    }
+profiling.mark("7B. PET COLLECTION SYSTEM")
+EGG_COSTS = pet_collection.EGG_COSTS
+NEW_YEAR_EGG_END = datetime(2026, 1, 5, 23, 59, 59)
+open_eggs = pet_collection.open_eggs
 
-    probs = probabilities.get(egg_type, probabilities['common'])
-    roll = random.randint(1, 100)
-
-    cumulative = 0
-    selected_rarity = 'Common'
-    for rarity, chance in probs.items():
-        cumulative += chance
-        if roll <= cumulative:
-            selected_rarity = rarity
-            break
-
-    # Get all pets of the selected rarity
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-
-        if egg_type == 'newyear':
-            cur.execute("SELECT * FROM Pets WHERE rarity=%s AND is_limited=TRUE", (selected_rarity,))
-        else:
-            cur.execute("SELECT * FROM Pets WHERE rarity=%s AND is_limited=FALSE", (selected_rarity,))
+@profiling.timed()
+def buy_eggs(user_id, egg_type, count=1, idempotency_key=None, rng=None):
+    """Purchase and open `count` eggs in one transaction; returns (pets, error).
 
-        pets = cur.fetchall()
-        cur.close()
-        conn.close()
+    Retrying with the same idempotency_key returns the pets from the first
+    purchase instead of charging again.
+    """
+    cost = EGG_COSTS.get(egg_type, 50) * count
+    spend_key = idempotency_key or uuid.uuid4().hex
 
-        if pets:
-            return random.choice(pets)
-    return None
+    # Check if New Year egg is still available (4 days from Jan 1, 2026)
+    if egg_type == 'newyear' and datetime.now() >= NEW_YEAR_EGG_END:
+        return [], "This egg is no longer available!"
 
-def buy_egg(user_id, egg_type):
-    """Purchase an egg and return the received pet"""
-    egg_costs = {'common': 50, 'premium': 150, 'legendary': 500, 'newyear': 200}
-    cost = egg_costs.get(egg_type, 50)
+    pets = open_eggs(egg_type, count, rng)
+    hatched = Counter(p['pet_id'] for p in pets)
 
-    # Check if user has enough XP
-    if st.session_state.total_xp < cost:
-        return None, "Not enough XP!"
+    balance, pet_ids = get_storage().pets.buy(user_id, egg_type, hatched, [p['pet_id'] for p in pets], cost, spend_key)
+    if balance is None:
+        return [], "Not enough XP!"
+    st.session_state.total_xp = balance
+    # A replayed key returns the pets recorded by the first purchase
+    return [PETS_BY_ID[pet_id] for pet_id in pet_ids if pet_id in PETS_BY_ID], None
 
-    # Check if New Year egg is still available (4 days from Jan 1, 2026)
-    if egg_type == 'newyear':
-        from datetime import datetime
-        deadline = datetime(2026, 1, 5, 23, 59, 59)
-        if datetime.now() >= deadline:
-            return None, "This egg is no longer available!"
-
-    # Open egg to get pet
-    pet = open_egg(egg_type)
-    if not pet:
-        return None, "No pets available!"
-
-    # Deduct XP
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("UPDATE Users SET total_xp = total_xp - %s WHERE user_id=%s", (cost, user_id))
-
-        # Add pet to user's collection
-        cur.execute("INSERT INTO UserPets (user_id, pet_id) VALUES (%s, %s)", (user_id, pet['pet_id']))
-
-        # Record purchase
-        cur.execute("INSERT INTO UserEggPurchases (user_id, egg_type, pet_received) VALUES (%s, %s, %s)",
-                   (user_id, egg_type, pet['pet_id']))
-
-        conn.commit()
-        cur.close()
-        conn.close()
-
-        st.session_state.total_xp -= cost
-        return pet, None
-
-    return None, "Database error!"
-
-def get_user_pets(user_id):
-    """Get all pets owned by user"""
-    conn = get_db()
-    pets = []
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("""SELECT p.*, up.id as user_pet_id, up.is_equipped, up.equip_slot, up.acquired_date
-                      FROM UserPets up
-                      JOIN Pets p ON up.pet_id = p.pet_id
-                      WHERE up.user_id = %s
-                      ORDER BY p.rarity DESC, p.name""", (user_id,))
-        pets = cur.fetchall()
-        cur.close()
-        conn.close()
-    return pets
+def equipped_entries(rows):
+    """Catalog entries plus equip_slot for [(slot, pet_id)] rows"""
+    return [{**PETS_BY_ID[pet_id], 'equip_slot': slot} for slot, pet_id in rows if pet_id in PETS_BY_ID]
 
 def get_equipped_pets(user_id):
-    """Get currently equipped pets"""
-    conn = get_db()
-    pets = []
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("""SELECT p.*, up.equip_slot
-                      FROM UserPets up
-                      JOIN Pets p ON up.pet_id = p.pet_id
-                      WHERE up.user_id = %s AND up.is_equipped = TRUE
-                      ORDER BY up.equip_slot""", (user_id,))
-        pets = cur.fetchall()
-        cur.close()
-        conn.close()
-    return pets
-
-def equip_pet(user_id, pet_id, slot):
-    """Equip a pet to a specific slot (1-3)"""
-    if slot not in [1, 2, 3]:
-        return False
-
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
+    """Get currently equipped pets (catalog entries plus equip_slot), slot-ordered"""
+    return equipped_entries(get_storage().pets.equipped(user_id))
 
-        # Unequip any pet in that slot
-        cur.execute("UPDATE UserPets SET is_equipped=FALSE, equip_slot=NULL WHERE user_id=%s AND equip_slot=%s", (user_id, slot))
+def set_equipped_cache(pets):
+    """Replace the session's equipped set and recompute the XP multiplier from it"""
+    st.session_state.equipped_pets_cache = sorted(pets, key=lambda p: p['equip_slot'])
+    multiplier = 1.0
+    for pet in pets:
+        multiplier *= float(pet['xp_multiplier'])
+    st.session_state.xp_multiplier = multiplier
 
-        # Equip the new pet
-        cur.execute("UPDATE UserPets SET is_equipped=TRUE, equip_slot=%s WHERE user_id=%s AND pet_id=%s",
-                   (slot, user_id, pet_id))
+def _session_equipped(user_id):
+    """Slot -> pet map of the cached equipped set, or None if user_id isn't the cached user"""
+    if user_id != st.session_state.get('user_id') or 'equipped_pets_cache' not in st.session_state:
+        return None
+    return {p['equip_slot']: p for p in st.session_state.equipped_pets_cache}
 
-        conn.commit()
-        cur.close()
-        conn.close()
+def equip_pet(user_id, pet_id, slot):
+    """Equip a pet to a specific slot (1-3), replacing whatever was there"""
+    if slot not in [1, 2, 3] or pet_id not in PETS_BY_ID:
+        return False
+    get_storage().pets.equip(user_id, {slot: pet_id})
+    slots = _session_equipped(user_id)
+    if slots is not None:
+        slots[slot] = {**PETS_BY_ID[pet_id], 'equip_slot': slot}
+        set_equipped_cache(list(slots.values()))
+    return True
+
+def swap_pets(user_id, slot_a, slot_b):
+    """Exchange the pets in two slots (or move a pet into an empty slot)"""
+    slots = _session_equipped(user_id)
+    if slots is None:
+        slots = {p['equip_slot']: p for p in get_equipped_pets(user_id)}
+    a, b = slots.get(slot_a), slots.get(slot_b)
+    if a and b:
+        get_storage().pets.equip(user_id, {slot_a: b['pet_id'], slot_b: a['pet_id']})
+    elif a or b:
+        src_slot, dst_slot = (slot_a, slot_b) if a else (slot_b, slot_a)
+        get_storage().pets.move(user_id, src_slot, dst_slot)
+    else:
         return True
-    return False
+    if _session_equipped(user_id) is not None:
+        moved = {slot_a: b, slot_b: a}
+        set_equipped_cache([{**p, 'equip_slot': s} for s, p in {**slots, **moved}.items() if p])
+    return True
 
 def unequip_pet(user_id, slot):
     """Unequip pet from a slot"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("UPDATE UserPets SET is_equipped=FALSE, equip_slot=NULL WHERE user_id=%s AND equip_slot=%s",
-                   (user_id, slot))
-        conn.commit()
-        cur.close()
-        conn.close()
-        return True
-    return False
+    get_storage().pets.unequip(user_id, slot)
+    slots = _session_equipped(user_id)
+    if slots is not None:
+        slots.pop(slot, None)
+        set_equipped_cache(list(slots.values()))
+    return True
 
 def calculate_xp_multiplier(user_id):
-    """Calculate total XP multiplier from equipped pets"""
-    pets = get_equipped_pets(user_id)
+    """Calculate total XP multiplier from equipped pets (session cache for the signed-in user)"""
+    if user_id == st.session_state.get('user_id') and 'xp_multiplier' in st.session_state:
+        return st.session_state.xp_multiplier
     multiplier = 1.0
-    for pet in pets:
+    for pet in get_equipped_pets(user_id):
         multiplier *= float(pet['xp_multiplier'])
     return multiplier
 
+# =============================================================================
+# 7C. LEADERBOARD
+# =============================================================================
+profiling.mark("7C. LEADERBOARD")
+# Rankings live in Leaderboard, one row per (board, user): board 'all' holds lifetime earned
+# XP and 'YYYY-Www' boards hold XP earned in that ISO week. award_xp bumps both rows in the
+# same transaction (UsersRepo.add_xp), so rendering never sorts Users. Top-N pages are index walks on
+# (board, grade, xp) / (board, xp); ranks sum per-bucket user counts (LeaderboardRepo). Both are cached
+# briefly and shared across sessions. daily_rollover.py deletes old weekly boards.
+LEADERBOARD_SIZE = 10
+LEADERBOARD_TTL = 60
+
+MD_PUNCTUATION = frozenset(r"""!"#$%&'()*+,-./:;<=>?@[\]^_`{|}~""")
+
+def md_escape(text):
+    """User text made inert for st.markdown: one line, every ASCII punctuation mark backslash-escaped"""
+    return "".join(f"\\{c}" if c in MD_PUNCTUATION else c for c in " ".join(str(text).split()))
+
+def week_board(day=None):
+    year, week, _ = (day or datetime.now().date()).isocalendar()
+    return f"{year}-W{week:02d}"
+
+@st.cache_data(ttl=LEADERBOARD_TTL, show_spinner=False)
+def leaderboard_top(board, grade=None, limit=LEADERBOARD_SIZE):
+    """Top-N rows of a board, optionally within one grade"""
+    return get_storage().leaderboard.top(board, grade, limit)
+
+@st.cache_data(ttl=LEADERBOARD_TTL, show_spinner=False)
+def leaderboard_rank(board, user_id, grade=None, version=None):
+    """(rank, xp) of a user on a board, or (None, 0) if they have no XP there.
+
+    `version` only busts the cache, e.g. the caller's current total_xp.
+    """
+    return get_storage().leaderboard.rank(board, user_id, grade)
+
+@profiling.timed()
+def render_leaderboard():
+    c1, c2 = st.columns(2)
+    with c1:
+        period = st.radio("Period", ["This Week", "All Time"], horizontal=True, key="lb_period")
+    with c2:
+        scope = st.radio("Scope", ["Global", f"{st.session_state.grade} Grade"], horizontal=True, key="lb_scope")
+    board = week_board() if period == "This Week" else 'all'
+    grade = st.session_state.grade if scope != "Global" else None
+
+    rows = leaderboard_top(board, grade)
+    if not rows:
+        st.info("No XP earned yet - complete a lesson to get on the board!")
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    for i, row in enumerate(rows, 1):
+        me = row['user_id'] == st.session_state.user_id
+        name = md_escape(row['username'])
+        name = f"**{name} (you)**" if me else name
+        st.markdown(f"{medals.get(i, f'#{i}')} {name} · {md_escape(row['grade'])} — {row['xp']} XP")
+
+    rank, xp = leaderboard_rank(board, st.session_state.user_id, grade, st.session_state.total_xp)
+    if rank:
+        st.caption(f"Your rank: #{rank} with {xp} XP")
+    else:
+        st.caption("You're not on this board yet.")
+
 # =============================================================================
 # 8. COURSE DATA
 # =============================================================================
-COURSE_SYLLABI = {
-    "Algebra I": [
-        {"title": "1. Variables & Expressions", "desc": "Understanding symbols, evaluating expressions."},
-        {"title": "2. Linear Equations", "desc": "Solving for X, multi-step equations."},
-        {"title": "3. Inequalities", "desc": "Graphing inequalities, compound inequalities."},
-        {"title": "4. Functions", "desc": "Domain, range, function notation."},
-        {"title": "5. Slope & Intercepts", "desc": "y=mx+b, graphing lines."},
-        {"title": "6. Systems of Equations", "desc": "Substitution, elimination."},
-        {"title": "7. Exponents", "desc": "Laws of exponents, scientific notation."},
-        {"title": "8. Polynomials", "desc": "Adding, subtracting, multiplying."},
-        {"title": "9. Factoring", "desc": "GCF, difference of squares."},
-        {"title": "10. Quadratics", "desc": "Quadratic formula, parabolas."},
-        {"title": "11. Statistics", "desc": "Mean, median, mode."},
-        {"title": "12. Final Review", "desc": "Comprehensive review."}
-    ],
-    "Geometry": [
-        {"title": "1. Points & Lines", "desc": "Foundations of geometry."},
-        {"title": "2. Proofs", "desc": "Two-column proofs."},
-        {"title": "3. Parallel Lines", "desc": "Transversals, angle pairs."},
-        {"title": "4. Triangles", "desc": "SSS, SAS, ASA postulates."},
-        {"title": "5. Triangle Properties", "desc": "Bisectors, medians."},
-        {"title": "6. Polygons", "desc": "Interior angles, parallelograms."},
-        {"title": "7. Similarity", "desc": "Ratios, similar triangles."},
-        {"title": "8. Right Triangles", "desc": "Pythagorean theorem."},
-        {"title": "9. Circles", "desc": "Tangents, arcs, chords."},
-        {"title": "10. Area", "desc": "Area of polygons."},
-        {"title": "11. Volume", "desc": "Prisms, cylinders, spheres."},
-        {"title": "12. Transformations", "desc": "Reflections, rotations."},
-        {"title": "13. Circle Equations", "desc": "Equation of a circle."},
-        {"title": "14. Final Review", "desc": "Comprehensive review."}
-    ],
-    "Algebra II": [
-        {"title": "1. Linear Review", "desc": "Absolute value, piecewise."},
-        {"title": "2. Quadratics", "desc": "Completing the square."},
-        {"title": "3. Complex Numbers", "desc": "Imaginary numbers."},
-        {"title": "4. Polynomials", "desc": "Synthetic division."},
-        {"title": "5. Radicals", "desc": "Rational exponents."},
-        {"title": "6. Exponentials", "desc": "Growth and decay."},
-        {"title": "7. Logarithms", "desc": "Log properties."},
-        {"title": "8. Rational Functions", "desc": "Asymptotes."},
-        {"title": "9. Sequences", "desc": "Arithmetic, geometric."},
-        {"title": "10. Conics", "desc": "Ellipses, hyperbolas."},
-        {"title": "11. Probability", "desc": "Combinations, permutations."},
-        {"title": "12. Trig Ratios", "desc": "SOH CAH TOA."},
-        {"title": "13. Trig Graphs", "desc": "Sine, cosine waves."},
-        {"title": "14. Identities", "desc": "Trig identities."},
-        {"title": "15. Final Review", "desc": "Comprehensive review."}
-    ],
-    "Pre-Calculus": [
-        {"title": "1. Functions", "desc": "Parent functions."},
-        {"title": "2. Polynomials", "desc": "Zeros, end behavior."},
-        {"title": "3. Exponentials", "desc": "Logistic models."},
-        {"title": "4. Trig Functions", "desc": "Unit circle."},
-        {"title": "5. Trig Equations", "desc": "Solving trig equations."},
-        {"title": "6. Law of Sines/Cosines", "desc": "Triangle applications."},
-        {"title": "7. Matrices", "desc": "Operations, inverses."},
-        {"title": "8. Conics", "desc": "Rotated conics."},
-        {"title": "9. Sequences", "desc": "Series, induction."},
-        {"title": "10. Limits", "desc": "Intro to limits."},
-        {"title": "11. Derivatives Intro", "desc": "Rates of change."},
-        {"title": "12. Vectors", "desc": "Dot product."},
-        {"title": "13. Polar Coords", "desc": "Polar graphing."},
-        {"title": "14. Parametrics", "desc": "Parametric equations."},
-        {"title": "15. 3D Space", "desc": "3D coordinates."},
-        {"title": "16. Final Review", "desc": "Calculus prep."}
-    ],
-    "Calculus I": [
-        {"title": "1. Limits", "desc": "Limit laws, continuity."},
-        {"title": "2. Continuity", "desc": "IVT, discontinuities."},
-        {"title": "3. Derivatives", "desc": "Definition as limit."},
-        {"title": "4. Diff Rules", "desc": "Power, product, quotient."},
-        {"title": "5. Chain Rule", "desc": "Composite functions."},
-        {"title": "6. Implicit Diff", "desc": "Implicit differentiation."},
-        {"title": "7. Applications", "desc": "Linear approximation."},
-        {"title": "8. Optimization", "desc": "Max/min problems."},
-        {"title": "9. Related Rates", "desc": "Rate problems."},
-        {"title": "10. Antiderivatives", "desc": "Indefinite integrals."},
-        {"title": "11. Riemann Sums", "desc": "Area estimation."},
-        {"title": "12. Definite Integrals", "desc": "Area accumulation."},
-        {"title": "13. FTC", "desc": "Fundamental theorem."},
-        {"title": "14. Substitution", "desc": "u-substitution."},
-        {"title": "15. Area", "desc": "Area between curves."},
-        {"title": "16. Volume", "desc": "Disk/washer methods."},
-        {"title": "17. Diff Equations", "desc": "Separation of variables."},
-        {"title": "18. Final Review", "desc": "Comprehensive review."}
-    ],
-    "Biology": [
-        {"title": "1. Scientific Method", "desc": "Characteristics of life."},
-        {"title": "2. Chemistry of Life", "desc": "Macromolecules."},
-        {"title": "3. Cells", "desc": "Prokaryotes, eukaryotes."},
-        {"title": "4. Photosynthesis", "desc": "Light reactions, Calvin cycle."},
-        {"title": "5. Respiration", "desc": "Glycolysis, Krebs, ETC."},
-        {"title": "6. Mitosis", "desc": "Cell cycle."},
-        {"title": "7. Meiosis", "desc": "Genetic variation."},
-        {"title": "8. Genetics", "desc": "Punnett squares."},
-        {"title": "9. DNA", "desc": "Replication, transcription."},
-        {"title": "10. Evolution", "desc": "Natural selection."},
-        {"title": "11. Ecology", "desc": "Ecosystems, food webs."},
-        {"title": "12. Classification", "desc": "Taxonomy."},
-        {"title": "13. Human Systems", "desc": "Organ systems."},
-        {"title": "14. Final Review", "desc": "Comprehensive review."}
-    ],
-    "Chemistry": [
-        {"title": "1. Matter", "desc": "States, changes."},
-        {"title": "2. Atoms", "desc": "Subatomic particles."},
-        {"title": "3. Periodic Table", "desc": "Trends."},
-        {"title": "4. Bonding", "desc": "Ionic, covalent."},
-        {"title": "5. Nomenclature", "desc": "Naming compounds."},
-        {"title": "6. The Mole", "desc": "Avogadro's number."},
-        {"title": "7. Reactions", "desc": "Balancing equations."},
-        {"title": "8. Stoichiometry", "desc": "Limiting reactants."},
-        {"title": "9. States of Matter", "desc": "IMF, phase diagrams."},
-        {"title": "10. Gases", "desc": "Ideal gas law."},
-        {"title": "11. Solutions", "desc": "Molarity, solubility."},
-        {"title": "12. Thermochemistry", "desc": "Enthalpy, entropy."},
-        {"title": "13. Kinetics", "desc": "Rate laws."},
-        {"title": "14. Acids/Bases", "desc": "pH, titrations."},
-        {"title": "15. Redox", "desc": "Oxidation-reduction."},
-        {"title": "16. Nuclear", "desc": "Radioactive decay."}
-    ],
-    "Physics": [
-        {"title": "1. Kinematics 1D", "desc": "Velocity, acceleration."},
-        {"title": "2. Vectors", "desc": "Components, addition."},
-        {"title": "3. Kinematics 2D", "desc": "Projectile motion."},
-        {"title": "4. Newton's Laws", "desc": "F=ma."},
-        {"title": "5. Friction", "desc": "Static, kinetic."},
-        {"title": "6. Work & Energy", "desc": "KE, PE, conservation."},
-        {"title": "7. Momentum", "desc": "Impulse, collisions."},
-        {"title": "8. Circular Motion", "desc": "Centripetal force."},
-        {"title": "9. Rotation", "desc": "Torque."},
-        {"title": "10. Equilibrium", "desc": "Statics."},
-        {"title": "11. Fluids", "desc": "Buoyancy, Bernoulli."},
-        {"title": "12. Thermodynamics", "desc": "Heat, laws."},
-        {"title": "13. Waves", "desc": "Frequency, wavelength."},
-        {"title": "14. Sound", "desc": "Resonance."},
-        {"title": "15. Light", "desc": "Optics."}
-    ],
-    "Intro to Python": [
-        {"title": "1. Variables", "desc": "Strings, integers, floats."},
-        {"title": "2. Data Types", "desc": "Type casting."},
-        {"title": "3. Conditionals", "desc": "If/else, booleans."},
-        {"title": "4. Loops", "desc": "For, while loops."},
-        {"title": "5. Functions", "desc": "Def, return."},
-        {"title": "6. Lists", "desc": "Indexing, slicing."},
-        {"title": "7. Dictionaries", "desc": "Key-value pairs."},
-        {"title": "8. File I/O", "desc": "Reading, writing files."},
-        {"title": "9. Libraries", "desc": "Importing modules."},
-        {"title": "10. Final Project", "desc": "Build something!"}
-    ]
-}
+profiling.mark("8. COURSE DATA")
+COURSE_SYLLABI = curriculum.COURSE_SYLLABI
 
 COURSE_ID_MAP = {
     "algebra1": "Algebra I", "geometry": "Geometry", "algebra2": "Algebra II",
@@ -691,151 +467,151 @@ COURSE_CATEGORIES = {
     "🧬 Science": ["Biology", "Chemistry", "Physics"],
     "💻 CS": ["Intro to Python"]
 }
+
+# Course index - built once at import so reruns never rescan the catalog
+COURSE_NAME_TO_ID = {name: cid for cid, name in COURSE_ID_MAP.items()}
+COURSE_CATEGORY = {course: cat for cat, courses in COURSE_CATEGORIES.items() for course in courses}
+
+# Progress is {course_id: completed_mask}; bit (n-1) set = lesson n completed
+def is_lesson_done(progress, cid, num):
+    return bool(progress.get(cid, 0) >> (num - 1) & 1)
+
+def course_done_count(progress, cid):
+    return progress.get(cid, 0).bit_count()
+
+def total_done_count(progress):
+    return sum(mask.bit_count() for mask in progress.values())
 # =============================================================================
 # 9. CONSTELLATION VISUAL
 # =============================================================================
-def render_constellation(grade, progress):
-    t = get_theme()
-    completed = len([k for k,v in progress.items() if v == 'completed'])
-    pct = int((completed / 130) * 100)
-
-    # Build progress data for each course
-    course_progress = {}
-    course_map = {
-        "Algebra I": "algebra1", "Geometry": "geometry", "Algebra II": "algebra2",
-        "Pre-Calc": "precalc", "Calc I": "calc1", "Biology": "biology",
-        "Chemistry": "chemistry", "Physics": "physics", "Python": "python"
-    }
-    for display_name, course_id in course_map.items():
-        total_lessons = len(COURSE_SYLLABI.get(COURSE_ID_MAP.get(course_id, ""), []))
-        completed_count = sum(1 for i in range(1, total_lessons+1) if progress.get(f"{course_id}_L{i}") == 'completed')
-        course_progress[display_name] = {
-            "completed": completed_count,
-            "total": total_lessons,
-            "is_complete": completed_count == total_lessons and total_lessons > 0
-        }
-
-    progress_json = json.dumps(course_progress)
+profiling.mark("9. CONSTELLATION VISUAL")
+TOTAL_LESSONS = sum(len(s) for s in COURSE_SYLLABI.values())
 
-    html = f'''
-    <!DOCTYPE html><html><head>
-    <script src="https://d3js.org/d3.v7.min.js"></script>
-    <style>
-        *{{margin:0;padding:0;box-sizing:border-box;}}
-        body{{background:{t['bg']};overflow:hidden;font-family:sans-serif;}}
-        #c{{width:100vw;height:100vh;}}
-        .legend{{position:fixed;top:10px;left:10px;background:rgba(0,0,0,0.8);border-radius:8px;padding:10px;color:white;font-size:11px;}}
-        .stats{{position:fixed;bottom:10px;left:10px;background:rgba(0,0,0,0.8);border-radius:8px;padding:10px;color:white;}}
-        .stats h4{{color:{t['accent']};}}
-        @keyframes pulse {{
-            0%, 100% {{ opacity: 1; r: 22; }}
-            50% {{ opacity: 0.7; r: 24; }}
-        }}
-        .completed-node {{
-            filter: drop-shadow(0 0 8px currentColor);
-            animation: pulse 2s ease-in-out infinite;
-        }}
-    </style></head><body>
-    <div id="c"></div>
-    <div class="legend">
-        <div>🟡 You</div><div>🔵 Math</div><div>🟢 Science</div><div>🟣 CS</div>
-        <div style="margin-top:5px">⭐ Complete</div><div>🔒 Incomplete</div>
-    </div>
-    <div class="stats"><h4>🎓 {grade}</h4><div>{pct}% • {completed}/130</div></div>
-    <button id="resetBtn" style="position:fixed;top:10px;right:10px;background:{t['accent']};color:#1a2a3a;border:none;padding:8px 16px;border-radius:8px;cursor:pointer;font-weight:bold;">🔄 Reset View</button>
-    <script>
-        const w=innerWidth,h=innerHeight;
-        const svg=d3.select("#c").append("svg").attr("width",w).attr("height",h);
-        const g=svg.append("g");
-        const progress={progress_json};
-        const zoom=d3.zoom()
-            .scaleExtent([0.5,2])
-            .translateExtent([[-w,-h],[w*2,h*2]])
-            .on("zoom",e=>g.attr("transform",e.transform));
-        svg.call(zoom);
-        const initialTransform=d3.zoomIdentity.translate(w/2,h/2).scale(0.7);
-        svg.call(zoom.transform,initialTransform);
-        document.getElementById('resetBtn').onclick=()=>svg.transition().duration(750).call(zoom.transform,initialTransform);
-        g.append("circle").attr("cx",0).attr("cy",0).attr("r",50).attr("fill","{t['accent']}");
-        g.append("text").attr("x",0).attr("y",5).attr("text-anchor","middle").attr("fill","#1a2a3a").attr("font-weight","bold").text("{grade}");
-        g.append("text").attr("x",0).attr("y",-60).attr("text-anchor","middle").attr("fill","{t['accent']}").text("🎓 YOU");
-        const subjs=[
-            {{n:"Math",c:"#3498db",a:-Math.PI/2,courses:["Algebra I","Geometry","Algebra II","Pre-Calc","Calc I"]}},
-            {{n:"Science",c:"#27ae60",a:Math.PI*5/6,courses:["Biology","Chemistry","Physics"]}},
-            {{n:"CS",c:"#9b59b6",a:Math.PI/6,courses:["Python"]}}
-        ];
-        subjs.forEach(s=>{{
-            const sx=Math.cos(s.a)*140,sy=Math.sin(s.a)*140;
-            g.append("line").attr("x1",0).attr("y1",0).attr("x2",sx).attr("y2",sy).attr("stroke","rgba(255,255,255,0.3)");
-            g.append("circle").attr("cx",sx).attr("cy",sy).attr("r",35).attr("fill",s.c);
-            g.append("text").attr("x",sx).attr("y",sy-45).attr("text-anchor","middle").attr("fill","#fff").attr("font-size","12px").text(s.n);
-            const span=Math.PI*0.8;
-            s.courses.forEach((c,i)=>{{
-                const ca=s.a-span/2+(span/s.courses.length)*(i+0.5);
-                const cx=sx+Math.cos(ca)*100,cy=sy+Math.sin(ca)*100;
-                const p=progress[c]||{{completed:0,total:1,is_complete:false}};
-                const isComplete=p.is_complete||p.completed>0;
-                const opacity=isComplete?1:0.3;
-                g.append("line").attr("x1",sx).attr("y1",sy).attr("x2",cx).attr("y2",cy).attr("stroke","rgba(255,255,255,0.2)");
-                const node=g.append("circle")
-                    .attr("cx",cx).attr("cy",cy).attr("r",22)
-                    .attr("fill",s.c).attr("opacity",opacity)
-                    .attr("class",p.is_complete?"completed-node":"");
-                if(p.is_complete){{
-                    node.attr("filter","drop-shadow(0 0 8px "+s.c+")");
-                    setInterval(()=>{{
-                        node.transition().duration(1000).attr("r",24).attr("opacity",0.7)
-                            .transition().duration(1000).attr("r",22).attr("opacity",1);
-                    }},2000);
-                }}
-                g.append("text").attr("x",cx).attr("y",cy-30).attr("text-anchor","middle")
-                    .attr("fill","#fff").attr("font-size","9px").attr("opacity",opacity).text(c);
-                g.append("text").attr("x",cx).attr("y",cy+5).attr("text-anchor","middle")
-                    .attr("fill","#fff").attr("font-size","8px").text(p.completed+"/"+p.total);
-            }});
-        }});
-    </script></body></html>'''
-    components.html(html, height=350, scrolling=False)
+CONSTELLATION_SUBJECTS = {
+    "🧮 Math": {"name": "Math", "color": "#3498db", "angle": -math.pi/2},
+    "🧬 Science": {"name": "Science", "color": "#27ae60", "angle": math.pi*5/6},
+    "💻 CS": {"name": "CS", "color": "#9b59b6", "angle": math.pi/6},
+}
+CONSTELLATION_LABELS = {"Pre-Calculus": "Pre-Calc", "Calculus I": "Calc I", "Intro to Python": "Python"}
+
+def build_constellation_layout():
+    """Compute constellation node positions once at import (server-side, no d3)"""
+    span = math.pi * 0.8
+    layout = []
+    for cat, courses in COURSE_CATEGORIES.items():
+        subj = CONSTELLATION_SUBJECTS[cat]
+        sx, sy = math.cos(subj['angle'])*140, math.sin(subj['angle'])*140
+        nodes = []
+        for i, course in enumerate(courses):
+            ca = subj['angle'] - span/2 + (span/len(courses))*(i+0.5)
+            nodes.append({
+                "cid": COURSE_NAME_TO_ID[course], "label": CONSTELLATION_LABELS.get(course, course),
+                "x": round(sx + math.cos(ca)*100, 1), "y": round(sy + math.sin(ca)*100, 1),
+                "total": len(COURSE_SYLLABI.get(course, []))
+            })
+        layout.append({"name": subj['name'], "color": subj['color'], "x": round(sx, 1), "y": round(sy, 1), "courses": nodes})
+    return layout
+
+CONSTELLATION_LAYOUT = build_constellation_layout()
+
+def constellation_fingerprint(progress):
+    """Per-course completed counts in layout order - the only progress data the visual depends on"""
+    return tuple(course_done_count(progress, n['cid']) for s in CONSTELLATION_LAYOUT for n in s['courses'])
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def constellation_svg(theme_name, grade, fingerprint):
+    """Render the constellation as static SVG markup, memoized by (theme, grade, progress fingerprint)"""
+    t = THEMES.get(theme_name, THEMES['Auto'])
+    completed = sum(fingerprint)
+    pct = int((completed / max(1, TOTAL_LESSONS)) * 100)
+    counts = iter(fingerprint)
+
+    svg = [
+        f'<circle cx="0" cy="0" r="50" fill="{t["accent"]}"/>',
+        f'<text x="0" y="5" text-anchor="middle" fill="#1a2a3a" font-weight="bold">{grade}</text>',
+        f'<text x="0" y="-60" text-anchor="middle" fill="{t["accent"]}">🎓 YOU</text>',
+    ]
+    for s in CONSTELLATION_LAYOUT:
+        sx, sy, c = s['x'], s['y'], s['color']
+        svg.append(f'<line x1="0" y1="0" x2="{sx}" y2="{sy}" stroke="rgba(255,255,255,0.3)"/>')
+        svg.append(f'<circle cx="{sx}" cy="{sy}" r="35" fill="{c}"/>')
+        svg.append(f'<text x="{sx}" y="{sy-45}" text-anchor="middle" fill="#fff" font-size="12">{s["name"]}</text>')
+        for n in s['courses']:
+            done = next(counts)
+            is_complete = done == n['total'] and n['total'] > 0
+            opacity = 1 if done > 0 else 0.3
+            cx, cy = n['x'], n['y']
+            node_cls = f' class="completed-node" style="color:{c}"' if is_complete else ''
+            svg.append(f'<line x1="{sx}" y1="{sy}" x2="{cx}" y2="{cy}" stroke="rgba(255,255,255,0.2)"/>')
+            svg.append(f'<circle cx="{cx}" cy="{cy}" r="22" fill="{c}" opacity="{opacity}"{node_cls}/>')
+            svg.append(f'<text x="{cx}" y="{cy-30}" text-anchor="middle" fill="#fff" font-size="9" opacity="{opacity}">{n["label"]}</text>')
+            svg.append(f'<text x="{cx}" y="{cy+5}" text-anchor="middle" fill="#fff" font-size="8">{done}/{n["total"]}</text>')
+
+    # Single line of markup: st.markdown would treat indented/blank lines as code blocks
+    return (
+        '<style>'
+        '.constellation{position:relative;height:350px;border-radius:12px;overflow:hidden;font-family:sans-serif;}'
+        '.constellation .legend{position:absolute;top:10px;left:10px;background:rgba(0,0,0,0.8);border-radius:8px;padding:10px;font-size:11px;}'
+        '.constellation .stats{position:absolute;bottom:10px;left:10px;background:rgba(0,0,0,0.8);border-radius:8px;padding:10px;}'
+        '@keyframes cpulse{0%,100%{opacity:1;}50%{opacity:0.7;}}'
+        '.constellation .completed-node{filter:drop-shadow(0 0 8px currentColor);animation:cpulse 2s ease-in-out infinite;}'
+        '</style>'
+        f'<div class="constellation" style="background:{t["bg"]}">'
+        f'<svg viewBox="-330 -300 660 600" width="100%" height="100%" preserveAspectRatio="xMidYMid meet">{"".join(svg)}</svg>'
+        '<div class="legend"><div>🟡 You</div><div>🔵 Math</div><div>🟢 Science</div><div>🟣 CS</div>'
+        '<div style="margin-top:5px">⭐ Complete</div><div>🔒 Incomplete</div></div>'
+        f'<div class="stats"><h4 style="color:{t["accent"]} !important">🎓 {grade}</h4><div>{pct}% • {completed}/{TOTAL_LESSONS}</div></div>'
+        '</div>'
+    )
+
+@profiling.timed()
+def render_constellation(grade, progress):
+    fingerprint = constellation_fingerprint(progress)
+    st.markdown(constellation_svg(st.session_state.get('theme', 'Auto'), grade, fingerprint), unsafe_allow_html=True)
 
+@profiling.timed()
 def render_lesson_buttons(progress, prefix="m"):
+    """Course list per category; lesson buttons are only built for the one expanded course"""
+    open_key = f"{prefix}_open_course"
     tabs = st.tabs(list(COURSE_CATEGORIES.keys()))
     for tab, (cat, courses) in zip(tabs, COURSE_CATEGORIES.items()):
         with tab:
             for course in courses:
-                cid = None
-                for k,v in COURSE_ID_MAP.items():
-                    if v == course: cid = k; break
-                syllabus = COURSE_SYLLABI.get(course, [])
-                done = sum(1 for i in range(1, len(syllabus)+1) if progress.get(f"{cid}_L{i}") == 'completed')
-                with st.expander(f"📚 {course} ({done}/{len(syllabus)})", expanded=False):
-                    for row in range(0, len(syllabus), 4):
-                        cols = st.columns(4)
-                        for i, col in enumerate(cols):
-                            idx = row + i
-                            if idx >= len(syllabus): break
-                            info = syllabus[idx]
-                            num = idx + 1
-                            key = f"{cid}_L{num}"
-                            is_done = progress.get(key) == 'completed'
-                            with col:
-                                lbl = f"✅ L{num}" if is_done else f"▶ L{num}"
-                                if st.button(lbl, key=f"{prefix}_{cid}_{num}", type="secondary" if is_done else "primary", use_container_width=True, help=info['title']):
-                                    st.session_state.show_modal = True
-                                    st.session_state.lesson_data = {'course': course, 'cid': cid, 'num': num, 'title': info['title'], 'desc': info['desc']}
-                                    st.rerun()
+                cid = COURSE_NAME_TO_ID[course]
+                is_open = st.session_state.get(open_key) == cid
+                done = course_done_count(progress, cid)
+                lbl = f"{'▾' if is_open else '▸'} 📚 {course} ({done}/{len(COURSE_SYLLABI[course])})"
+                if st.button(lbl, key=f"{prefix}_course_{cid}", use_container_width=True):
+                    st.session_state[open_key] = None if is_open else cid
+                    st.rerun()
+                if is_open:
+                    render_lesson_grid(course, cid, progress, prefix)
+
+def render_lesson_grid(course, cid, progress, prefix):
+    syllabus = COURSE_SYLLABI[course]
+    for row in range(0, len(syllabus), 4):
+        cols = st.columns(4)
+        for i, col in enumerate(cols):
+            idx = row + i
+            if idx >= len(syllabus): break
+            info = syllabus[idx]
+            num = idx + 1
+            is_done = is_lesson_done(progress, cid, num)
+            with col:
+                lbl = f"✅ L{num}" if is_done else f"▶ L{num}"
+                if st.button(lbl, key=f"{prefix}_{cid}_{num}", type="secondary" if is_done else "primary", use_container_width=True, help=info['title']):
+                    st.session_state.show_modal = True
+                    st.session_state.lesson_data = {'course': course, 'cid': cid, 'num': num, 'title': info['title'], 'desc': info['desc']}
+                    st.rerun()
 # =============================================================================
 # 10. QUIZ SYSTEM
 # =============================================================================
+profiling.mark("10. QUIZ SYSTEM")
 def generate_quiz(course, title, desc):
-    prompt = f"""Generate 5 multiple choice questions for: {course} - {title} ({desc})
-Return ONLY JSON: {{"questions":[{{"q":"question","opts":["A)...","B)...","C)...","D)..."],"ans":0,"why":"explanation"}}]}}"""
     try:
-        genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-        model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
-        resp = model.generate_content(prompt)
-        txt = resp.text.strip()
-        if txt.startswith("```"): txt = txt.split("```")[1].replace("json","").strip()
-        return json.loads(txt)
+        model = get_model(MODEL_CONFIG["FLASH"])
+        resp = llm_generate(model, curriculum.quiz_prompt(course, title, desc), "generate_quiz")
+        return curriculum.parse_json(resp.text)
     except: return None
 
 def render_quiz(quiz, lesson_key, user_id):
@@ -867,6 +643,7 @@ def render_quiz(quiz, lesson_key, user_id):
 # =============================================================================
 # 11. POMODORO TIMER
 # =============================================================================
+profiling.mark("11. POMODORO TIMER")
 def render_pomodoro():
     st.markdown("### 🍅 Pomodoro Timer")
     if 'pomo_active' not in st.session_state: st.session_state.pomo_active = False
@@ -888,15 +665,7 @@ def render_pomodoro():
             st.session_state.pomo_count += 1
 
             # Save lifetime pomodoro count to database
-            conn = get_db()
-            if conn:
-                cur = conn.cursor()
-                cur.execute(f"USE {st.secrets['DB_NAME']};")
-                cur.execute("UPDATE Users SET pomodoros_completed = pomodoros_completed + 1 WHERE user_id=%s",
-                           (st.session_state.user_id,))
-                conn.commit()
-                cur.close()
-                conn.close()
+            get_storage().users.add_pomodoro(st.session_state.user_id)
 
             st.balloons()
             play_sound("xp")
@@ -931,7 +700,7 @@ def render_pomodoro():
                 }}, 1000);
             </script>
             '''
-            components.html(timer_html, height=120)
+            embed_html(timer_html, 120)
             st.progress(1 - remain/(dur*60))
 
             if st.button("⏹️ Stop"):
@@ -948,6 +717,7 @@ def render_pomodoro():
 # =============================================================================
 # 12. LEARNING MODE
 # =============================================================================
+profiling.mark("12. LEARNING MODE")
 def render_learning():
     ld = st.session_state.lesson_data
     if not ld:
@@ -963,14 +733,26 @@ def render_learning():
     with c3:
         if st.button("❌ Exit"):
             st.session_state.learning = False
+            st.session_state.lesson_sections = []
+            st.session_state.lesson_quiz = None
             st.session_state.lesson_msgs = []
             st.session_state.section = 1
             st.rerun()
     
-    for m in st.session_state.lesson_msgs:
-        with st.chat_message(m["role"]): st.markdown(m["content"])
+    if not st.session_state.lesson_sections: teach_lesson()
+    if st.session_state.lesson_sections:
+        sec = st.session_state.lesson_sections[st.session_state.section - 1]
+        with st.chat_message("assistant"): st.markdown(f"## Section {st.session_state.section}: {sec['title']}\n\n{sec['content']}")
     
-    if not st.session_state.lesson_msgs: teach_lesson()
+    for i, m in enumerate(st.session_state.lesson_msgs):
+        with st.chat_message(m["role"]):
+            st.markdown(m["content"])
+            if m.get("qa_id") and not m.get("rated"):
+                f1, f2, _ = st.columns([1,1,10])
+                with f1:
+                    if st.button("👍", key=f"qa_up_{i}"): qa_feedback(m, True); st.rerun()
+                with f2:
+                    if st.button("👎", key=f"qa_down_{i}"): qa_feedback(m, False); st.rerun()
     
     if st.session_state.get('show_quiz') and st.session_state.section >= 5:
         if st.session_state.get('quiz_data'):
@@ -983,80 +765,100 @@ def render_learning():
         if st.button("🚀 Ask", type="primary") and q: ask_q(q)
     with c2:
         if st.button("⬅ Prev", disabled=st.session_state.section<=1):
-            st.session_state.section -= 1; continue_lesson()
+            st.session_state.section -= 1; st.rerun()
     with c3:
         if st.button("Next ➡", disabled=st.session_state.section>=5):
-            st.session_state.section += 1; continue_lesson()
+            st.session_state.section += 1; st.rerun()
     with c4:
         if st.button("✓ Done", type="primary" if st.session_state.section>=5 else "secondary"):
             mark_done()
 
+LESSON_CACHE_TTL = 24 * 3600
+
+# One structured call per lesson; it depends only on the lesson, grade and difficulty, so students
+# share it (warmup pre-fills it). Failures raise and are not cached. _user_id and _on_miss are left
+# out of the cache key: the generating call is attributed to, and charged by _on_miss to, the student
+# whose request missed the cache.
+@st.cache_data(ttl=LESSON_CACHE_TTL, max_entries=2000, show_spinner=False)
+def lesson_sections(course, title, desc, grade, difficulty, _user_id=None, _on_miss=None):
+    if _on_miss: _on_miss()
+    resp = llm_metrics.generate(get_model(MODEL_CONFIG["FLASH"]), curriculum.lesson_prompt(course, title, desc, grade, difficulty),
+                                "lesson_sections", user_id=_user_id, generation_config=curriculum.JSON_OUTPUT)
+    return curriculum.parse_sections(resp.text)
+
+@st.cache_resource(show_spinner=False)
+def get_content_pack():
+    """The compiled curriculum (see content_pack.py); None when there is no pack"""
+    return content_pack.open_pack(st.secrets.get("CONTENT_PACK_DIR", content_pack.DEFAULT_DIR))
+
+def compiled_lesson(course, num, grade, difficulty):
+    """{"sections", "quiz"} from the content pack, or None to generate the lesson live"""
+    pack = get_content_pack()
+    if pack is None: return None
+    return pack.get(course, num, grade, difficulty, COURSE_SYLLABI[course][num - 1])
+
 def teach_lesson():
     ld = st.session_state.lesson_data
-    st.session_state.flash_usage += 1
-    update_usage()
-    
-    diff_txt = {"Simple":"Explain like they're 10.","Standard":"Grade-appropriate.","Advanced":"Deep technical detail."}
-    prompt = f"""Teach {ld['course']} - {ld['title']} to a {st.session_state.grade} student.
-Topic: {ld['desc']}. Difficulty: {st.session_state.difficulty}. {diff_txt.get(st.session_state.difficulty,'')}
-1. Welcome 2. Core concept with examples 3. Practice problem. Use emojis!"""
-    
+    # A compiled lesson is a local read: no API call, so no Flash credit
+    compiled = compiled_lesson(ld['course'], ld['num'], st.session_state.grade, st.session_state.difficulty)
+    if compiled:
+        st.session_state.lesson_sections = compiled['sections']
+        st.session_state.lesson_quiz = compiled.get('quiz')
+        llm_metrics.record_cache_hit("lesson_sections", "content_pack", st.session_state.user_id)
+        return
+
+    # A lesson another student already generated comes from the shared cache: only a miss costs a credit
+    def charge():
+        st.session_state.flash_usage += 1
+        update_usage()
+
     try:
-        genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-        model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
         with st.spinner("🧠 Loading..."):
-            resp = model.generate_content(prompt)
-            st.session_state.lesson_msgs.append({"role":"assistant","content":resp.text})
+            st.session_state.lesson_sections = lesson_sections(ld['course'], ld['title'], ld['desc'],
+                                                               st.session_state.grade, st.session_state.difficulty,
+                                                               _user_id=st.session_state.user_id, _on_miss=charge)
         st.rerun()
     except Exception as e: st.error(str(e))
 
-def continue_lesson():
+def ask_q(q):
     ld = st.session_state.lesson_data
-    st.session_state.flash_usage += 1
-    update_usage()
-    
-    prompt = f"""Continue {ld['course']} - {ld['title']}. Section {st.session_state.section}/5.
-Sections: 1-Intro, 2-Examples, 3-Practice, 4-Common mistakes, 5-Summary. Difficulty: {st.session_state.difficulty}"""
+    st.session_state.lesson_msgs.append({"role":"user","content":q})
     
-    try:
-        genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-        model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
-        with st.spinner(f"📖 Section {st.session_state.section}..."):
-            resp = model.generate_content(prompt)
-            st.session_state.lesson_msgs.append({"role":"assistant","content":f"## Section {st.session_state.section}\n\n{resp.text}"})
+    # Students in a lesson keep asking the same things: serve a near-duplicate's answer (no credit)
+    index = qa_cache.for_lesson(ld['cid'], ld['num'])
+    start = time.perf_counter()
+    hit = index.lookup(q)
+    if hit:
+        llm_metrics.record_cache_hit("ask_q", MODEL_CONFIG["FLASH"], st.session_state.user_id,
+                                     (time.perf_counter() - start) * 1000)
+        st.session_state.lesson_msgs.append({"role":"assistant","content":hit.answer,"qa_id":hit.id})
         st.rerun()
-    except Exception as e: st.error(str(e))
-
-def ask_q(q):
-    ld = st.session_state.lesson_data
+    
     st.session_state.flash_usage += 1
     update_usage()
-    st.session_state.lesson_msgs.append({"role":"user","content":q})
-    
     prompt = f"""Student learning {ld['course']} - {ld['title']} asked: {q}. Help them!"""
     try:
-        genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-        model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
+        model = get_model(MODEL_CONFIG["FLASH"])
         with st.spinner("🤔..."):
-            resp = model.generate_content(prompt)
-            st.session_state.lesson_msgs.append({"role":"assistant","content":resp.text})
+            resp = llm_generate(model, prompt, "ask_q", cache="miss")
+            entry = index.add(q, resp.text)
+            st.session_state.lesson_msgs.append({"role":"assistant","content":resp.text,"qa_id":entry and entry.id})
         st.rerun()
     except Exception as e: st.error(str(e))
 
-def mark_done():
+def qa_feedback(m, helpful):
+    """Thumbs up/down on a lesson answer; a thumbs-down evicts it from the shared Q&A cache"""
     ld = st.session_state.lesson_data
-    key = f"{ld['cid']}_L{ld['num']}"
+    qa_cache.for_lesson(ld['cid'], ld['num']).feedback(m['qa_id'], helpful)
+    m['rated'] = True
 
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("INSERT INTO UserLessonProgress (user_id,lesson_key,status,completed_date) VALUES (%s,%s,'completed',NOW()) ON DUPLICATE KEY UPDATE status='completed',completed_date=NOW()", (st.session_state.user_id, key))
-        conn.commit()
-        cur.close()
-        conn.close()
+@profiling.timed()
+def mark_done():
+    ld = st.session_state.lesson_data
+    bit = 1 << (ld['num'] - 1)
 
-    st.session_state.progress[key] = 'completed'
+    get_storage().progress.complete(st.session_state.user_id, ld['cid'], bit)
+    st.session_state.progress[ld['cid']] = st.session_state.progress.get(ld['cid'], 0) | bit
 
     # Update streak and daily goals
     update_streak(st.session_state.user_id)
@@ -1064,17 +866,13 @@ def mark_done():
 
     award_xp(st.session_state.user_id, 50)
 
-    done = len([k for k,v in st.session_state.progress.items() if v=='completed'])
+    done = total_done_count(st.session_state.progress)
     award_badge(st.session_state.user_id, "first_lesson")
     if done >= 5: award_badge(st.session_state.user_id, "five_lessons")
     if done >= 10: award_badge(st.session_state.user_id, "ten_lessons")
 
-    if ld['course'] in ['Algebra I','Geometry','Algebra II','Pre-Calculus','Calculus I']:
-        award_badge(st.session_state.user_id, "math_explorer")
-    elif ld['course'] in ['Biology','Chemistry','Physics']:
-        award_badge(st.session_state.user_id, "science_explorer")
-    elif ld['course'] == 'Intro to Python':
-        award_badge(st.session_state.user_id, "code_explorer")
+    explorer = {"🧮 Math": "math_explorer", "🧬 Science": "science_explorer", "💻 CS": "code_explorer"}.get(COURSE_CATEGORY.get(ld['course']))
+    if explorer: award_badge(st.session_state.user_id, explorer)
 
     hr = datetime.now().hour
     if hr >= 22 or hr < 5: award_badge(st.session_state.user_id, "night_owl")
@@ -1084,209 +882,199 @@ def mark_done():
 
     if st.session_state.section >= 5:
         with st.spinner("Generating quiz..."):
-            st.session_state.quiz_data = generate_quiz(ld['course'], ld['title'], ld['desc'])
+            st.session_state.quiz_data = st.session_state.lesson_quiz or generate_quiz(ld['course'], ld['title'], ld['desc'])
             st.session_state.show_quiz = True
         st.rerun()
 
 def update_usage():
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("UPDATE Users SET flash_usage=%s, pro_usage=%s WHERE user_id=%s",
-                   (st.session_state.flash_usage, st.session_state.pro_usage, st.session_state.user_id))
-        conn.commit()
-        cur.close()
-        conn.close()
+    get_storage().usage.save(st.session_state.user_id, st.session_state.flash_usage, st.session_state.pro_usage)
 # =============================================================================
 # 13. SESSION STATE
 # =============================================================================
+profiling.mark("13. SESSION STATE")
 defaults = {
     'authenticated': False, 'user_id': None, 'grade': '9th', 'flash_usage': 0, 'pro_usage': 0,
     'messages': [], 'session_id': None, 'theme': 'Auto', 'total_xp': 0, 'level': 1,
     'badges': [], 'progress': {}, 'beta_mode': False, 'learning': False, 'lesson_data': None,
-    'difficulty': 'Standard', 'section': 1, 'lesson_msgs': [], 'show_modal': False,
+    'difficulty': 'Standard', 'section': 1, 'lesson_sections': [], 'lesson_quiz': None, 'lesson_msgs': [], 'show_modal': False,
     'show_quiz': False, 'quiz_data': None, 'pomo_count': 0, 'sounds_enabled': True,
-    'streak_count': 0, 'daily_lessons_completed': 0, 'daily_goal': 3, 'pet_stage': 'egg', 'pet_mood': 'neutral'
+    'streak_count': 0, 'daily_lessons_completed': 0, 'daily_goal': 3, 'last_study_date': None
 }
 for k,v in defaults.items():
     if k not in st.session_state: st.session_state[k] = v
 
-GRADES = ["9th","10th","11th","12th","College"]
-DIFFICULTIES = ["Simple","Standard","Advanced"]
-
-def load_user(uid):
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT lesson_key, status FROM UserLessonProgress WHERE user_id=%s", (uid,))
-        st.session_state.progress = {r['lesson_key']:r['status'] for r in cur.fetchall()}
-        st.session_state.badges = get_badges(uid)
-
-        # Load streak, daily goal, and pet data
-        cur.execute("SELECT streak_count, daily_lessons_completed, daily_goal, pet_stage, pet_mood FROM Users WHERE user_id=%s", (uid,))
-        user_data = cur.fetchone()
-        if user_data:
-            st.session_state.streak_count = user_data.get('streak_count', 0) or 0
-            st.session_state.daily_lessons_completed = user_data.get('daily_lessons_completed', 0) or 0
-            st.session_state.daily_goal = user_data.get('daily_goal', 3) or 3
-            st.session_state.pet_stage = user_data.get('pet_stage', 'egg') or 'egg'
-            st.session_state.pet_mood = user_data.get('pet_mood', 'neutral') or 'neutral'
-
-        cur.close()
-        conn.close()
+GRADES = curriculum.GRADES
+DIFFICULTIES = curriculum.DIFFICULTIES
+
+@profiling.timed()
+def load_user(uid, user):
+    """Load a signed-in user's session snapshot; `user` is their Users row from login.
+
+    The snapshot reads run concurrently; do the login's writes before calling this.
+    """
+    st.session_state.streak_count = user.get('streak_count', 0) or 0
+    st.session_state.last_study_date = to_date(user.get('last_study_date'))
+    st.session_state.daily_lessons_completed = user.get('daily_lessons_completed', 0) or 0
+    st.session_state.daily_goal = user.get('daily_goal', 3) or 3
+    st.session_state.username = user.get('username')
+    st.session_state.active_date = user.get('last_active_date')
+
+    store = get_storage()
+    progress, badges, equipped = parallel_io.gather(
+        lambda: store.progress.masks(uid), lambda: store.badges.list(uid), lambda: store.pets.equipped(uid))
+    st.session_state.progress = progress
+    st.session_state.badges = badges
+    set_equipped_cache(equipped_entries(equipped))
 
 # =============================================================================
 # 13A. SOUND EFFECTS
 # =============================================================================
+profiling.mark("13A. SOUND EFFECTS")
+SOUND_PRIORITY = {"levelup": 4, "badge": 3, "quiz": 2, "xp": 1}
+
 def play_sound(sound_type):
-    """Play sound effect if enabled"""
+    """Queue a sound effect; finish_rerun() plays a rerun's events through one player element"""
     if not st.session_state.get('sounds_enabled', True):
         return
-
-    # Using data URIs for simple beep sounds
-    sounds = {
-        "xp": "data:audio/wav;base64,UklGRnoGAABXQVZFZm10IBAAAAABAAEAQB8AAEAfAAABAAgAZGF0YQoGAACBhYqFbF1fdJivrJBhNjVgodDbq2EcBj+a2/LDciUFLIHO8tiJNwgZaLvt559NEAxQp+PwtmMcBjiR1/LMeSwFJHfH8N2QQAoUXrTp66hVFApGn+DyvmwhBSuBzvLaijcIGGa67OehUBELTKXh8LZkHAU6ktbzyn4qBSl+zPDajzsIFmO96+mjUxEKSKHe8bhkHwU4kdXzzHsrBCh7yO/fiD0IFl++7OqkVBEJSaPf8rhlHwU6k9bywHwqBCd5xvDdizwIFl296+mkUxELSKPd8LdlHwU3kdTzzHorBCd5yO/eiz0HFV3A7OmjUREMSKLd8LdlHwU3kdTyzHktBSd4yPDdiz0HFl3A7OqkURIOSKLd8LdlHwU2kNXzy3ktBSd4x/DdizsJFl286+mkUhEMSKPd8bhmHgU3kdXyy3ktBSd5yPDbiT0HFl+/7OqkUhELSKHe8LhlHwU3kdXzzHotBCh6yPDdiz0HFF2+7OqkUxEKR6Lf8bdlHwU4k9TyynotBCd5x/DdizwIFl++7OqkUhELR6Hf8bdlHgU4k9TzynwsBCh5x/DdizwHFl696+mlUhELRqLf8rZmHgU4ktXzynwsBCh5yPDciz0HFl696+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl++6+mlURELRqHf8bZmHgU4k9TyynwrBSh5x/DdizwHFl286+mlUxELRqHf8bdlHgU4ktTzynwrBSh5yPDciz0HFl696+mlUhELRqHf8bdlHgU4k9XyyXwsBCh5yO/diz0HFV696+mlUhELR6Hf8rZmHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8Q==",
-        "levelup": "data:audio/wav;base64,UklGRnoGAABXQVZFZm10IBAAAAABAAEAQB8AAEAfAAABAAgAZGF0YQoGAACBhYqFbF1fdJivrJBhNjVgodDbq2EcBj+a2/LDciUFLIHO8tiJNwgZaLvt559NEAxQp+PwtmMcBjiR1/LMeSwFJHfH8N2QQAoUXrTp66hVFApGn+DyvmwhBSuBzvLaijcIGGa67OehUBELTKXh8LZkHAU6ktbzyn4qBSl+zPDajzsIFmO96+mjUxEKSKHe8bhkHwU4kdXzzHsrBCh7yO/fiD0IFl++7OqkVBEJSaPf8rhlHwU6k9bywHwqBCd5xvDdizwIFl296+mkUxELSKPd8LdlHwU3kdTzzHorBCd5yO/eiz0HFV3A7OmjUREMSKLd8LdlHwU3kdTyzHktBSd4yPDdiz0HFl3A7OqkURIOSKLd8LdlHwU2kNXzy3ktBSd4x/DdizsJFl286+mkUhEMSKPd8bhmHgU3kdXyy3ktBSd5yPDbiT0HFl+/7OqkUhELSKHe8LhlHwU3kdXzzHotBCh6yPDdiz0HFF2+7OqkUxEKR6Lf8bdlHwU4k9TyynotBCd5x/DdizwIFl++7OqkUhELR6Hf8bdlHgU4k9TzynwsBCh5x/DdizwHFl696+mlUhELRqLf8rZmHgU4ktXzynwsBCh5yPDciz0HFl696+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl++6+mlURELRqHf8bZmHgU4k9TyynwrBSh5x/DdizwHFl286+mlUxELRqHf8bdlHgU4ktTzynwrBSh5yPDciz0HFl696+mlUhELRqHf8bdlHgU4k9XyyXwsBCh5yO/diz0HFV696+mlUhELR6Hf8rZmHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8Q==",
-        "badge": "data:audio/wav;base64,UklGRnoGAABXQVZFZm10IBAAAAABAAEAQB8AAEAfAAABAAgAZGF0YQoGAACBhYqFbF1fdJivrJBhNjVgodDbq2EcBj+a2/LDciUFLIHO8tiJNwgZaLvt559NEAxQp+PwtmMcBjiR1/LMeSwFJHfH8N2QQAoUXrTp66hVFApGn+DyvmwhBSuBzvLaijcIGGa67OehUBELTKXh8LZkHAU6ktbzyn4qBSl+zPDajzsIFmO96+mjUxEKSKHe8bhkHwU4kdXzzHsrBCh7yO/fiD0IFl++7OqkVBEJSaPf8rhlHwU6k9bywHwqBCd5xvDdizwIFl296+mkUxELSKPd8LdlHwU3kdTzzHorBCd5yO/eiz0HFV3A7OmjUREMSKLd8LdlHwU3kdTyzHktBSd4yPDdiz0HFl3A7OqkURIOSKLd8LdlHwU2kNXzy3ktBSd4x/DdizsJFl286+mkUhEMSKPd8bhmHgU3kdXyy3ktBSd5yPDbiT0HFl+/7OqkUhELSKHe8LhlHwU3kdXzzHotBCh6yPDdiz0HFF2+7OqkUxEKR6Lf8bdlHwU4k9TyynotBCd5x/DdizwIFl++7OqkUhELR6Hf8bdlHgU4k9TzynwsBCh5x/DdizwHFl696+mlUhELRqLf8rZmHgU4ktXzynwsBCh5yPDciz0HFl696+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl++6+mlURELRqHf8bZmHgU4k9TyynwrBSh5x/DdizwHFl286+mlUxELRqHf8bdlHgU4ktTzynwrBSh5yPDciz0HFl696+mlUhELRqHf8bdlHgU4k9XyyXwsBCh5yO/diz0HFV696+mlUhELR6Hf8rZmHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8Q==",
-        "quiz": "data:audio/wav;base64,UklGRnoGAABXQVZFZm10IBAAAAABAAEAQB8AAEAfAAABAAgAZGF0YQoGAACBhYqFbF1fdJivrJBhNjVgodDbq2EcBj+a2/LDciUFLIHO8tiJNwgZaLvt559NEAxQp+PwtmMcBjiR1/LMeSwFJHfH8N2QQAoUXrTp66hVFApGn+DyvmwhBSuBzvLaijcIGGa67OehUBELTKXh8LZkHAU6ktbzyn4qBSl+zPDajzsIFmO96+mjUxEKSKHe8bhkHwU4kdXzzHsrBCh7yO/fiD0IFl++7OqkVBEJSaPf8rhlHwU6k9bywHwqBCd5xvDdizwIFl296+mkUxELSKPd8LdlHwU3kdTzzHorBCd5yO/eiz0HFV3A7OmjUREMSKLd8LdlHwU3kdTyzHktBSd4yPDdiz0HFl3A7OqkURIOSKLd8LdlHwU2kNXzy3ktBSd4x/DdizsJFl286+mkUhEMSKPd8bhmHgU3kdXyy3ktBSd5yPDbiT0HFl+/7OqkUhELSKHe8LhlHwU3kdXzzHotBCh6yPDdiz0HFF2+7OqkUxEKR6Lf8bdlHwU4k9TyynotBCd5x/DdizwIFl++7OqkUhELR6Hf8bdlHgU4k9TzynwsBCh5x/DdizwHFl696+mlUhELRqLf8rZmHgU4ktXzynwsBCh5yPDciz0HFl696+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl++6+mlURELRqHf8bZmHgU4k9TyynwrBSh5x/DdizwHFl286+mlUxELRqHf8bdlHgU4ktTzynwrBSh5yPDciz0HFl696+mlUhELRqHf8bdlHgU4k9XyyXwsBCh5yO/diz0HFV696+mlUhELR6Hf8rZmHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8rZlHgU4ktXzynwrBSh5yPDciz0HFl+96+mlUhELRqHf8Q=="
-    }
-
-    sound_html = f'<audio autoplay><source src="{sounds.get(sound_type, sounds["xp"])}" type="audio/wav"></audio>'
-    components.html(sound_html, height=0)
+    st.session_state.sound_queue.append({
+        "id": uuid.uuid4().hex[:8],
+        "type": sound_type if sound_type in SOUND_PRIORITY else "xp"
+    })
+
+@profiling.timed()
+def render_sound_player():
+    """Render the queued sounds into the sound slot, once, at the end of a rerun.
+
+    A rerun cut short by st.rerun() never gets here, so its events wait in the
+    queue for the next rerun that finishes; the player remembers played event
+    ids in the browser so nothing repeats.
+    """
+    queue = st.session_state.sound_queue
+    st.session_state.sound_queue = []
+    if not queue:
+        return
+    events = json.dumps([[e['id'], e['type'], SOUND_PRIORITY[e['type']]] for e in queue])
+    player_html = f"""<script>
+const seen = window.parent.sessionStorage;
+const fresh = {events}.filter(e => !seen.getItem('snd_' + e[0]));
+if (fresh.length) {{
+    fresh.forEach(e => seen.setItem('snd_' + e[0], '1'));
+    const top = fresh.reduce((a, b) => b[2] > a[2] ? b : a);
+    const src = new URL('{STATIC_URL}/sounds/' + top[1] + '.wav', window.parent.location.href).href;
+    new Audio(src).play().catch(() => {{}});
+}}
+</script>"""
+    with SOUND_SLOT:
+        page_script(player_html)
+
+st.session_state.rerun_seq = st.session_state.get('rerun_seq', 0) + 1
+if 'sound_queue' not in st.session_state: st.session_state.sound_queue = []
+SOUND_SLOT = st.empty()
+
+def finish_rerun():
+    """Flush the rerun's sounds and close its profiling run (call before st.stop())"""
+    render_sound_player()
+    profiling.end_run()
 
 # =============================================================================
 # 13B. STREAK & DAILY GOALS
 # =============================================================================
+profiling.mark("13B. STREAK & DAILY GOALS")
+# Daily counters (flash/pro usage and lessons toward the goal) belong to the day stored in
+# last_active_date. daily_rollover.py zeroes every stale row in one statement on a schedule;
+# UsageRepo.roll_day is the lazy per-user fallback, run once at login or on the first
+# rerun after midnight - never per request.
+def today_str():
+    return datetime.now().strftime("%Y-%m-%d")
+
+def ensure_daily_rollover():
+    """Reset the session's daily counters when a signed-in session crosses midnight"""
+    today = today_str()
+    if st.session_state.get('active_date') == today:
+        return
+    get_storage().usage.roll_day(st.session_state.user_id, today)
+    st.session_state.update({'flash_usage': 0, 'pro_usage': 0, 'daily_lessons_completed': 0, 'active_date': today})
+
+@profiling.timed()
 def update_streak(user_id):
-    """Update user's study streak"""
-    from datetime import datetime, timedelta
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT streak_count, last_study_date FROM Users WHERE user_id=%s", (user_id,))
-        row = cur.fetchone()
-
-        if row:
-            today = datetime.now().date()
-            last_date = datetime.strptime(row['last_study_date'], "%Y-%m-%d").date() if row.get('last_study_date') else None
-            current_streak = row.get('streak_count', 0) or 0
-
-            if last_date:
-                days_diff = (today - last_date).days
-                if days_diff == 0:
-                    # Already studied today
-                    pass
-                elif days_diff == 1:
-                    # Consecutive day - increment streak
-                    current_streak += 1
-                    cur.execute("UPDATE Users SET streak_count=%s, last_study_date=%s WHERE user_id=%s",
-                               (current_streak, today.strftime("%Y-%m-%d"), user_id))
-
-                    # Award milestone bonuses
-                    if current_streak == 7:
-                        award_xp(user_id, 100)
-                        st.success("🔥 7 Day Streak! +100 Bonus XP!")
-                    elif current_streak == 14:
-                        award_xp(user_id, 200)
-                        st.success("🔥 14 Day Streak! +200 Bonus XP!")
-                    elif current_streak == 30:
-                        award_xp(user_id, 500)
-                        st.success("🔥 30 Day Streak! +500 Bonus XP!")
-                else:
-                    # Streak broken - reset
-                    current_streak = 1
-                    cur.execute("UPDATE Users SET streak_count=1, last_study_date=%s WHERE user_id=%s",
-                               (today.strftime("%Y-%m-%d"), user_id))
-            else:
-                # First time studying
-                current_streak = 1
-                cur.execute("UPDATE Users SET streak_count=1, last_study_date=%s WHERE user_id=%s",
-                           (today.strftime("%Y-%m-%d"), user_id))
+    """Record today's study - the only streak write, skipped when already studied today"""
+    today = datetime.now().date()
+    last = to_date(st.session_state.get('last_study_date'))
+    if last == today:
+        return
+    yesterday = today - timedelta(days=1)
+    current_streak = (st.session_state.streak_count or 0) + 1 if last == yesterday else 1
 
-            conn.commit()
-            st.session_state.streak_count = current_streak
-        cur.close()
-        conn.close()
+    written = get_storage().users.record_study(user_id, today, yesterday)
+    st.session_state.last_study_date = today
+    if not written:
+        # Already recorded today from another session
+        return
+    st.session_state.streak_count = current_streak
+
+    # Award milestone bonuses
+    if current_streak == 7:
+        award_xp(user_id, 100)
+        st.success("🔥 7 Day Streak! +100 Bonus XP!")
+    elif current_streak == 14:
+        award_xp(user_id, 200)
+        st.success("🔥 14 Day Streak! +200 Bonus XP!")
+    elif current_streak == 30:
+        award_xp(user_id, 500)
+        st.success("🔥 30 Day Streak! +500 Bonus XP!")
 
 def increment_daily_lessons(user_id):
-    """Increment daily lesson count and check goal"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT daily_lessons_completed, daily_goal FROM Users WHERE user_id=%s", (user_id,))
-        row = cur.fetchone()
-
-        if row:
-            completed = (row.get('daily_lessons_completed', 0) or 0) + 1
-            goal = row.get('daily_goal', 3) or 3
+    """Count a lesson toward today's goal - the day is already current, so no read is needed"""
+    completed = st.session_state.get('daily_lessons_completed', 0) + 1
+    goal = st.session_state.get('daily_goal', 3)
+    get_storage().usage.add_daily_lesson(user_id)
+    st.session_state.daily_lessons_completed = completed
 
-            cur.execute("UPDATE Users SET daily_lessons_completed=%s WHERE user_id=%s", (completed, user_id))
-            conn.commit()
-
-            st.session_state.daily_lessons_completed = completed
-            st.session_state.daily_goal = goal
-
-            # Award bonus when goal is met
-            if completed == goal:
-                award_xp(user_id, 50)
-                st.success(f"🎯 Daily Goal Achieved! Completed {goal} lessons! +50 Bonus XP!")
-
-        cur.close()
-        conn.close()
+    # Award bonus when goal is met
+    if completed == goal:
+        award_xp(user_id, 50)
+        st.success(f"🎯 Daily Goal Achieved! Completed {goal} lessons! +50 Bonus XP!")
 
 # =============================================================================
 # 13B2. STUDY PET SYSTEM
 # =============================================================================
-def update_pet_status(user_id, current_level):
-    """Update pet evolution based on level and activity"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("SELECT pet_stage, last_study_date FROM Users WHERE user_id=%s", (user_id,))
-        row = cur.fetchone()
-
-        if row:
-            current_stage = row.get('pet_stage', 'egg')
-            last_date = row.get('last_study_date')
-
-            # Determine pet stage based on level
-            new_stage = 'egg'
-            if current_level >= 10:
-                new_stage = 'adult'
-            elif current_level >= 6:
-                new_stage = 'teen'
-            elif current_level >= 3:
-                new_stage = 'baby'
-
-            # Determine mood based on recent activity
-            today = datetime.now().date()
-            if last_date:
-                last_study = datetime.strptime(last_date, "%Y-%m-%d").date()
-                days_since = (today - last_study).days
-                mood = 'happy' if days_since == 0 else ('neutral' if days_since == 1 else 'sad')
-            else:
-                mood = 'neutral'
-
-            # Update if changed
-            if new_stage != current_stage or mood != row.get('pet_mood', 'neutral'):
-                cur.execute("UPDATE Users SET pet_stage=%s, pet_mood=%s WHERE user_id=%s",
-                           (new_stage, mood, user_id))
-                conn.commit()
-                st.session_state.pet_stage = new_stage
-                st.session_state.pet_mood = mood
-
-        cur.close()
-        conn.close()
+profiling.mark("13B2. STUDY PET SYSTEM")
+# Streak validity, pet stage and pet mood are pure functions of the user snapshot
+# (streak_count, last_study_date, level), so they're derived on read, never stored.
+def to_date(value):
+    """DATE columns come back as date objects; older snapshots may hold 'YYYY-MM-DD' strings"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.strptime(str(value)[:10], "%Y-%m-%d").date()
+
+def days_since_study(last_study_date, today=None):
+    last = to_date(last_study_date)
+    return None if last is None else ((today or datetime.now().date()) - last).days
+
+def effective_streak(streak_count, last_study_date, today=None):
+    """A stored streak only counts if the last study day was today or yesterday"""
+    days = days_since_study(last_study_date, today)
+    return (streak_count or 0) if days is not None and days <= 1 else 0
+
+def pet_stage_for(level):
+    if level >= 10: return 'adult'
+    if level >= 6: return 'teen'
+    if level >= 3: return 'baby'
+    return 'egg'
+
+def pet_mood_for(last_study_date, today=None):
+    days = days_since_study(last_study_date, today)
+    if days is None: return 'neutral'
+    return 'happy' if days == 0 else ('neutral' if days == 1 else 'sad')
 
 def get_pet_display():
     """Return emoji and text for current pet state"""
-    stage = st.session_state.get('pet_stage', 'egg')
-    mood = st.session_state.get('pet_mood', 'neutral')
+    stage = pet_stage_for(st.session_state.get('level', 1))
+    mood = pet_mood_for(st.session_state.get('last_study_date'))
 
     pets = {
         'egg': {'emoji': '🥚', 'name': 'Mysterious Egg'},
@@ -1307,14 +1095,14 @@ def get_pet_display():
 # =============================================================================
 # 13C. AUTO CHAT TITLES
 # =============================================================================
+profiling.mark("13C. AUTO CHAT TITLES")
 def generate_chat_title(first_message):
     """Generate a concise chat title from the first message"""
     # Try AI summary first
     try:
-        genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-        model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
+        model = get_model(MODEL_CONFIG["FLASH"])
         prompt = f"Generate a concise 3-5 word title for a chat that starts with: '{first_message[:100]}'. Return ONLY the title, nothing else."
-        resp = model.generate_content(prompt)
+        resp = llm_generate(model, prompt, "generate_chat_title")
         title = resp.text.strip().replace('"', '').replace("'", "")[:50]
         return title if title else first_message[:30]
     except:
@@ -1323,39 +1111,172 @@ def generate_chat_title(first_message):
 
 def update_chat_title(session_id, title):
     """Update the title of a chat session"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        cur.execute("UPDATE ChatLogs SET title=%s WHERE session_id=%s", (title, session_id))
-        conn.commit()
-        cur.close()
-        conn.close()
+    get_storage().chats.set_title(session_id, title, user_id=st.session_state.get('user_id'))
 
 # =============================================================================
 # 13D. CHAT MANAGEMENT
 # =============================================================================
+profiling.mark("13D. CHAT MANAGEMENT")
 def delete_empty_chats(user_id, current_session_id=None):
     """Delete all empty chats (title='New' and empty messages) for a user"""
-    conn = get_db()
-    if conn:
-        cur = conn.cursor()
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
-        # Delete chats with title 'New' and empty or null messages
-        if current_session_id:
-            cur.execute("""DELETE FROM ChatLogs WHERE user_id=%s AND title='New'
-                        AND (messages='[]' OR messages IS NULL OR messages='')
-                        AND session_id=%s""", (user_id, current_session_id))
-        else:
-            cur.execute("""DELETE FROM ChatLogs WHERE user_id=%s AND title='New'
-                        AND (messages='[]' OR messages IS NULL OR messages='')""", (user_id,))
-        conn.commit()
-        cur.close()
-        conn.close()
+    get_storage().chats.delete_empty(user_id, current_session_id)
+
+# =============================================================================
+# 13E. ADMIN DIAGNOSTICS
+# =============================================================================
+profiling.mark("13E. ADMIN DIAGNOSTICS")
+def is_admin():
+    """Signed-in users listed in the ADMIN_USERS secret"""
+    return bool(st.session_state.get('authenticated')) and st.session_state.get('username') in st.secrets.get("ADMIN_USERS", [])
+
+def render_db_diagnostics():
+    """Query counts per rerun and session, heaviest statements and the slow-query log"""
+    last = st.session_state.get('db_last_run')
+    session = st.session_state.db_session_stats
+    c1, c2, c3 = st.columns(3)
+    c1.metric("Queries last rerun", last.count if last else 0,
+              help=f"Budget: {db_metrics.RERUN_QUERY_BUDGET}")
+    c2.metric("DB time last rerun", f"{last.total_ms if last else 0:.0f} ms")
+    c3.metric("Queries this session", session.count)
+    if last and last.count > db_metrics.RERUN_QUERY_BUDGET:
+        st.warning(f"Last rerun exceeded the query budget ({last.count} > {db_metrics.RERUN_QUERY_BUDGET})")
+
+    scope = st.radio("Scope", ["Last rerun", "Session", "Process"], horizontal=True, key="diag_db_scope")
+    stats = {"Last rerun": last, "Session": session, "Process": db_metrics.REGISTRY}[scope]
+    if stats and stats.count:
+        st.dataframe([{
+            "query": fp, "count": e['count'], "total ms": round(e['total_ms'], 1), "max ms": round(e['max_ms'], 1),
+            "rows": e['rows'], "callers": ", ".join(f"{k}×{v}" for k, v in e['callers'].items())
+        } for fp, e in stats.top()], use_container_width=True)
+
+    store = get_storage()
+    if store.backend.has_replica:
+        routed = store.read_stats
+        st.caption(f"Routed reads: {routed['replica']} replica · {routed['sticky']} primary (after own write) · "
+                   f"{routed['fallback']} primary (replica lagging or down)")
+    st.caption(f"Connections: {store.pool_stats['opened']} opened · {store.pool_stats['reused']} reused from the pool "
+               f"(keeps up to {store.pool_size} idle)")
+
+    if db_metrics.SLOW_LOG:
+        st.markdown(f"**Slow queries (≥ {db_metrics.SLOW_QUERY_MS} ms)**")
+        st.dataframe(list(db_metrics.SLOW_LOG)[::-1], use_container_width=True)
+
+    c1, c2 = st.columns(2)
+    c1.download_button("⬇️ JSON", db_metrics.to_json(*(s for s in (last, session, db_metrics.REGISTRY) if s)),
+                       file_name="db_metrics.json", mime="application/json", use_container_width=True)
+    c2.download_button("⬇️ Prometheus", db_metrics.to_prometheus(),
+                       file_name="db_metrics.prom", mime="text/plain", use_container_width=True)
+
+def render_profiling_diagnostics():
+    """Rolling p50/p95 per section and function span, the last rerun's breakdown and optional cProfile output"""
+    # Mirrored into plain session state so the setting survives reruns that never render this panel
+    st.session_state.profile_enabled = st.toggle(
+        "cProfile my reruns", value=st.session_state.get('profile_enabled', False),
+        help="Profiles every rerun of this session with cProfile - several times slower while on. "
+             "One rerun in the server is profiled at a time, and on Python 3.12+ its profile includes other sessions' work")
+    last = st.session_state.get('prof_last_run')
+    if last and last.spans:
+        status = "interrupted by st.rerun()/st.stop()" if last.interrupted else f"{last.total_ms:.0f} ms"
+        st.markdown(f"**Last rerun** ({status})")
+        st.dataframe([{"span": name, "ms": round(ms, 1)} for name, ms in last.spans], use_container_width=True)
+    rows = profiling.report()
+    if rows:
+        st.markdown("**Rolling per span**")
+        st.dataframe([{k: round(v, 1) if isinstance(v, float) else v for k, v in row.items()} for row in rows],
+                     use_container_width=True)
+    if last and last.profile_error:
+        st.caption(f"cProfile skipped for the last rerun: {last.profile_error}")
+    if last and last.profile_text:
+        st.markdown("**cProfile (last rerun, by cumulative time)**")
+        st.code(last.profile_text, language=None)
+
+def render_llm_diagnostics():
+    """Rolling latency/TTFT percentiles and token use per call site, plus the per-user daily rollup"""
+    summary = llm_metrics.summary()
+    if not summary:
+        st.caption("No model calls recorded since the server started.")
+        return
+    st.dataframe([{
+        "call site": site, "calls": s['calls'], "models": ", ".join(s['models']),
+        "p50 ms": s['latency_ms']['p50'] and round(s['latency_ms']['p50']),
+        "p95 ms": s['latency_ms']['p95'] and round(s['latency_ms']['p95']),
+        "p50 TTFT ms": s['ttft_ms']['p50'] and round(s['ttft_ms']['p50']),
+        "prompt tok": s['prompt_tokens'], "response tok": s['response_tokens'],
+        "cost $": s['cost_usd'], "cache hits": f"{s['cache_hit_rate']:.0%}",
+        "errors": ", ".join(f"{k}×{v}" for k, v in s['errors'].items())
+    } for site, s in summary.items()], use_container_width=True)
+    st.markdown("**API keys**")
+    st.dataframe([{
+        "key": k['key'], "weight": k['weight'], "calls": k['calls'], "errors": k['errors'], "throttles": k['throttles'],
+        **{f"{m} last min": f"{u['last_minute']}/{u['rpm'] or '∞'}" + (f" (parked {u['parked_s']}s)" if u['parked_s'] else "")
+           for m, u in k['models'].items()}
+    } for k in get_gemini_pool().report()], use_container_width=True)
+    qa = qa_cache.stats()
+    st.caption(f"Lesson Q&A cache: {qa['hits']}/{qa['lookups']} questions answered from cache, "
+               f"{qa['entries']} answers over {qa['lessons']} lessons, {qa['evicted']} evicted by feedback")
+    st.markdown("**Per user per day**")
+    st.dataframe(llm_metrics.rollup()[:200], use_container_width=True)
+    st.download_button("⬇️ JSON", llm_metrics.to_json(), file_name="llm_metrics.json",
+                       mime="application/json", use_container_width=True)
+
+# =============================================================================
+# 13F. PRE-TRAFFIC WARM-UP
+# =============================================================================
+profiling.mark("13F. PRE-TRAFFIC WARM-UP")
+WARMUP_LESSONS = int(st.secrets.get("WARMUP_LESSONS", 12))
+WARMUP_WINDOW_DAYS = 7
+
+def popular_lessons(limit, days=WARMUP_WINDOW_DAYS):
+    """[(course, lesson number, grade)] most students are about to start, from recent progress"""
+    since = (datetime.now() - timedelta(days=days)).strftime("%Y-%m-%d")
+    counts = Counter()
+    for row in get_storage().progress.recent(since):
+        course = COURSE_ID_MAP.get(row['course_id'])
+        # A student's next lesson in a course is the lowest one not yet completed
+        mask = int(row['completed_mask'])
+        num = (~mask & (mask + 1)).bit_length()
+        if course and num <= len(COURSE_SYLLABI[course]):
+            counts[(course, num, row['grade'] or defaults['grade'])] += 1
+    return [key for key, _ in counts.most_common(limit)]
+
+def prefill_lessons():
+    # Difficulty isn't recorded, so warm the modal's default
+    difficulty = DIFFICULTIES[1]
+    lessons = [COURSE_SYLLABI[course][num - 1] | {'course': course, 'grade': grade}
+               for course, num, grade in popular_lessons(WARMUP_LESSONS)
+               if compiled_lesson(course, num, grade, difficulty) is None]
+    parallel_io.gather(*[lambda l=l: lesson_sections(l['course'], l['title'], l['desc'], l['grade'], difficulty)
+                         for l in lessons])
+
+def prefill_connections():
+    # Open the pool's connections (primary and replica) so the first students skip connect + TLS
+    get_storage().prefill()
+
+WARMUP_STEPS = [
+    ("database", prefill_connections, True),
+    ("catalogs", lambda: (pet_catalog(), build_theme_assets(), get_content_pack()), True),
+    ("llm", lambda: get_gemini_pool().warm(), True),
+    ("lessons", prefill_lessons, False),
+]
+
+# Idempotent: the first script run in this process starts it, later runs return at once
+warmup.start(WARMUP_STEPS)
+if st.query_params.get("warmup"):
+    st.stop()
 
 # =============================================================================
 # 14. AUTH PAGE
 # =============================================================================
+profiling.mark("14. AUTH PAGE")
+# bcrypt loads on the first sign-in or registration, not at startup
+def check_password(password, hashed):
+    import bcrypt
+    return bcrypt.checkpw(password.encode(), hashed.encode())
+
+def hash_password(password):
+    import bcrypt
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt()).decode()
+
 if not st.session_state.authenticated:
     c1,c2,c3 = st.columns([1,6,1])
     with c2:
@@ -1407,33 +1328,26 @@ if not st.session_state.authenticated:
                 elif not eu_confirm_login:
                     st.error("⛔ This service is not available in the European Union.")
                 else:
-                    conn = get_db()
-                    if conn:
-                        cur = conn.cursor(dictionary=True)
-                        cur.execute(f"USE {st.secrets['DB_NAME']};")
-                        cur.execute("SELECT * FROM Users WHERE username=%s", (u,))
-                        user = cur.fetchone()
-                        if user and bcrypt.checkpw(p.encode(), user['hashed_password'].encode()):
-                            today = datetime.now().strftime("%Y-%m-%d")
+                    store = get_storage()
+                    user = store.users.by_username(u)
+                    if user and check_password(p, user['hashed_password']):
+                        uid, today, sid = user['user_id'], today_str(), f"S_{uuid.uuid4().hex[:4]}"
+                        # Both writes touch the user's row: one transaction, in order, before the concurrent reads
+                        with store.transaction(user_id=uid) as cur:
+                            store.chats.start(uid, sid, cur)
                             if user['last_active_date'] != today:
-                                cur.execute("UPDATE Users SET flash_usage=0,pro_usage=0,last_active_date=%s WHERE user_id=%s", (today,user['user_id']))
-                                conn.commit()
-                                user['flash_usage'] = user['pro_usage'] = 0
-                            sid = f"S_{uuid.uuid4().hex[:4]}"
-                            st.session_state.update({
-                                'authenticated': True, 'user_id': user['user_id'], 'grade': user['grade'],
-                                'session_id': sid, 'flash_usage': user['flash_usage'], 'pro_usage': user['pro_usage'],
-                                'total_xp': user.get('total_xp',0) or 0, 'level': user.get('level',1) or 1,
-                                'theme': user.get('theme','Auto') or 'Auto', 'beta_mode': False
-                            })
-                            cur.execute("UPDATE Users SET session_id=%s WHERE user_id=%s", (sid,user['user_id']))
-                            cur.execute("INSERT INTO ChatLogs (session_id,user_id,title,messages) VALUES (%s,%s,'New','[]')", (sid,user['user_id']))
-                            conn.commit()
-                            load_user(user['user_id'])
-                            st.rerun()
-                        else: st.error("Invalid credentials")
-                        cur.close()
-                        conn.close()
+                                store.usage.roll_day(uid, today, cur)
+                        if user['last_active_date'] != today:
+                            user.update({'flash_usage': 0, 'pro_usage': 0, 'daily_lessons_completed': 0, 'last_active_date': today})
+                        st.session_state.update({
+                            'authenticated': True, 'user_id': user['user_id'], 'grade': user['grade'],
+                            'session_id': sid, 'flash_usage': user['flash_usage'], 'pro_usage': user['pro_usage'],
+                            'total_xp': user.get('total_xp',0) or 0, 'level': user.get('level',1) or 1,
+                            'theme': user.get('theme','Auto') or 'Auto', 'beta_mode': False
+                        })
+                        load_user(uid, user)
+                        st.rerun()
+                    else: st.error("Invalid credentials")
         
         with t2:
             nu = st.text_input("Username", key="ru")
@@ -1463,19 +1377,11 @@ if not st.session_state.authenticated:
                 elif not eu_confirm_reg:
                     st.error("⛔ This service is not available in the European Union.")
                 else:
-                    conn = get_db()
-                    if conn:
-                        cur = conn.cursor()
-                        cur.execute(f"USE {st.secrets['DB_NAME']};")
-                        try:
-                            h = bcrypt.hashpw(np.encode(), bcrypt.gensalt()).decode()
-                            uid, sid = f"U_{uuid.uuid4().hex[:4]}", f"S_{uuid.uuid4().hex[:4]}"
-                            cur.execute("INSERT INTO Users (username,hashed_password,grade,user_id,session_id,last_active_date,total_xp,level,theme) VALUES (%s,%s,%s,%s,%s,%s,0,1,'Auto')", (nu,h,ng,uid,sid,datetime.now().strftime("%Y-%m-%d")))
-                            conn.commit()
-                            st.success("Created! Log in now.")
-                        except: st.error("Username taken")
-                        cur.close()
-                        conn.close()
+                    h = hash_password(np)
+                    uid, sid = f"U_{uuid.uuid4().hex[:4]}", f"S_{uuid.uuid4().hex[:4]}"
+                    if get_storage().users.create(nu, h, ng, uid, sid, today_str()):
+                        st.success("Created! Log in now.")
+                    else: st.error("Username taken")
         
         with t3:
             st.markdown("### Plans\n| Feature | Free | Pro |\n|---|---|---|\n| Flash | 100/day | ∞ |\n| Ultra | 5/day | 50/day |")
@@ -1509,33 +1415,31 @@ if not st.session_state.authenticated:
                 elif not eu_confirm_beta:
                     st.error("⛔ This service is not available in the European Union.")
                 else:
-                    conn = get_db()
-                    if conn:
-                        cur = conn.cursor(dictionary=True)
-                        cur.execute(f"USE {st.secrets['DB_NAME']};")
-                        cur.execute("SELECT * FROM Users WHERE username=%s", (bu,))
-                        user = cur.fetchone()
-                        if user and bcrypt.checkpw(bp.encode(), user['hashed_password'].encode()):
-                            today = datetime.now().strftime("%Y-%m-%d")
-                            if user['last_active_date'] != today:
-                                cur.execute("UPDATE Users SET flash_usage=0,pro_usage=0,last_active_date=%s WHERE user_id=%s", (today,user['user_id']))
-                                conn.commit()
-                                user['flash_usage'] = user['pro_usage'] = 0
-                            st.session_state.update({
-                                'authenticated': True, 'beta_mode': True, 'user_id': user['user_id'],
-                                'grade': user['grade'], 'flash_usage': user['flash_usage'], 'pro_usage': user['pro_usage'],
-                                'total_xp': user.get('total_xp',0) or 0, 'level': user.get('level',1) or 1,
-                                'theme': user.get('theme','Auto') or 'Auto'
-                            })
-                            load_user(user['user_id'])
-                            st.rerun()
-                        else: st.error("Invalid credentials")
-                        cur.close()
-                        conn.close()
+                    store = get_storage()
+                    user = store.users.by_username(bu)
+                    if user and check_password(bp, user['hashed_password']):
+                        uid, today = user['user_id'], today_str()
+                        if user['last_active_date'] != today:
+                            store.usage.roll_day(uid, today)
+                            user.update({'flash_usage': 0, 'pro_usage': 0, 'daily_lessons_completed': 0, 'last_active_date': today})
+                        st.session_state.update({
+                            'authenticated': True, 'beta_mode': True, 'user_id': user['user_id'],
+                            'grade': user['grade'], 'flash_usage': user['flash_usage'], 'pro_usage': user['pro_usage'],
+                            'total_xp': user.get('total_xp',0) or 0, 'level': user.get('level',1) or 1,
+                            'theme': user.get('theme','Auto') or 'Auto'
+                        })
+                        load_user(uid, user)
+                        st.rerun()
+                    else: st.error("Invalid credentials")
+    finish_rerun()
     st.stop()
+
+ensure_daily_rollover()
+
 # =============================================================================
 # 15. LESSON MODAL
 # =============================================================================
+profiling.mark("15. LESSON MODAL")
 if st.session_state.show_modal and st.session_state.lesson_data:
     ld = st.session_state.lesson_data
     t = get_theme()
@@ -1546,7 +1450,7 @@ if st.session_state.show_modal and st.session_state.lesson_data:
         if st.button("Back"): st.session_state.show_modal = False; st.rerun()
         st.stop()
     
-    st.markdown(f'<div style="background:rgba(0,0,0,0.8);padding:30px;border-radius:16px;border:2px solid {t["accent"]};max-width:500px;margin:50px auto"><h2 style="color:{t["accent"]}">📚 {ld["title"]}</h2><p style="color:#aaa">{ld["course"]}</p><p>{ld["desc"]}</p><p style="color:#888;font-size:12px">⚡ Uses 1 Flash credit ({f_rem} left)</p></div>', unsafe_allow_html=True)
+    st.markdown(f'<div style="background:rgba(0,0,0,0.8);padding:30px;border-radius:16px;border:2px solid {t["accent"]};max-width:500px;margin:50px auto"><h2 style="color:{t["accent"]}">📚 {ld["title"]}</h2><p style="color:#aaa">{ld["course"]}</p><p>{ld["desc"]}</p><p style="color:#888;font-size:12px">⚡ Uses 1 Flash credit, none if the lesson is already cached ({f_rem} left)</p></div>', unsafe_allow_html=True)
     
     diff = st.radio("Difficulty:", DIFFICULTIES, index=1, horizontal=True)
     c1,c2 = st.columns(2)
@@ -1556,6 +1460,8 @@ if st.session_state.show_modal and st.session_state.lesson_data:
             st.session_state.learning = True
             st.session_state.show_modal = False
             st.session_state.section = 1
+            st.session_state.lesson_sections = []
+            st.session_state.lesson_quiz = None
             st.session_state.lesson_msgs = []
             st.session_state.show_quiz = False
             st.rerun()
@@ -1564,18 +1470,22 @@ if st.session_state.show_modal and st.session_state.lesson_data:
             st.session_state.show_modal = False
             st.session_state.lesson_data = None
             st.rerun()
+    finish_rerun()
     st.stop()
 
 # =============================================================================
 # 16. LEARNING MODE
 # =============================================================================
+profiling.mark("16. LEARNING MODE")
 if st.session_state.learning:
     render_learning()
+    finish_rerun()
     st.stop()
 
 # =============================================================================
 # 17. BETA MODE
 # =============================================================================
+profiling.mark("17. BETA MODE")
 if st.session_state.beta_mode:
     st.markdown('<div class="beta-banner">🧪 BETA MODE</div>', unsafe_allow_html=True)
     
@@ -1589,14 +1499,7 @@ if st.session_state.beta_mode:
         new_theme = st.selectbox("🎨", list(THEMES.keys()), index=list(THEMES.keys()).index(st.session_state.theme))
         if new_theme != st.session_state.theme:
             st.session_state.theme = new_theme
-            conn = get_db()
-            if conn:
-                cur = conn.cursor()
-                cur.execute(f"USE {st.secrets['DB_NAME']};")
-                cur.execute("UPDATE Users SET theme=%s WHERE user_id=%s", (new_theme, st.session_state.user_id))
-                conn.commit()
-                cur.close()
-                conn.close()
+            get_storage().users.update_settings(st.session_state.user_id, theme=new_theme)
             st.rerun()
     
     st.caption(f"⚡ Flash: {100-st.session_state.flash_usage}/100 | 🧠 Ultra: {5-st.session_state.pro_usage}/5")
@@ -1633,10 +1536,9 @@ if st.session_state.beta_mode:
             st.session_state.flash_usage += 1
             update_usage()
             try:
-                genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
-                model = genai.GenerativeModel(MODEL_CONFIG["FLASH"])
+                model = get_model(MODEL_CONFIG["FLASH"])
                 with st.spinner("..."):
-                    resp = model.generate_content(msg)
+                    resp = llm_generate(model, msg, "beta_chat")
                     st.session_state.messages.append({"role":"assistant","content":resp.text})
                 st.rerun()
             except Exception as e: st.error(str(e))
@@ -1646,17 +1548,20 @@ if st.session_state.beta_mode:
         st.session_state.beta_mode = False
         st.session_state.authenticated = False
         st.rerun()
+    finish_rerun()
     st.stop()
 # =============================================================================
 # 18. MAIN APP (WITH CONSTELLATION)
 # =============================================================================
+profiling.mark("18. MAIN APP (WITH CONSTELLATION)")
 lvl = get_level_info(st.session_state.total_xp)
 c1,c2,c3 = st.columns([2,1,1])
 with c1: st.info(f"🎓 {st.session_state.grade} Student | Sorokin AI")
 with c2: st.markdown(f"⭐ Lv.{lvl['level']} | {st.session_state.total_xp} XP")
 with c3:
-    if st.session_state.streak_count > 0:
-        st.markdown(f"🔥 {st.session_state.streak_count} day streak!")
+    streak = effective_streak(st.session_state.streak_count, st.session_state.last_study_date)
+    if streak > 0:
+        st.markdown(f"🔥 {streak} day streak!")
     else:
         st.markdown("🔥 Start your streak!")
 
@@ -1681,7 +1586,7 @@ st.caption(f"⚡ Flash: {100-st.session_state.flash_usage}/100 | 🧠 Ultra: {5-
 
 # Corner Pet Display - Fixed bottom-right (cached to avoid DB calls on every render)
 if 'equipped_pets_cache' not in st.session_state:
-    st.session_state.equipped_pets_cache = get_equipped_pets(st.session_state.user_id)
+    set_equipped_cache(get_equipped_pets(st.session_state.user_id))
 
 equipped_pets_corner = st.session_state.equipped_pets_cache
 if equipped_pets_corner:
@@ -1740,13 +1645,13 @@ if equipped_pets_corner:
     </style>
     """
 
-    components.html(corner_display_html, height=0)
+    st.html(corner_display_html)
 
-tabs = st.tabs(["🌌 Learn", "💬 Chat", "🥚 Pets", "📂 History", "⚙️ Settings"])
+tabs = st.tabs(["🌌 Learn", "💬 Chat", "🥚 Pets", "🏆 Leaderboard", "📂 History", "⚙️ Settings"])
 
 with tabs[0]:
     st.markdown("### 🌌 Learning Constellation")
-    st.caption("Click any lesson to start! Each uses 1 Flash credit.")
+    st.caption("Click any lesson to start! Each uses at most 1 Flash credit.")
     render_constellation(st.session_state.grade, st.session_state.progress)
     st.markdown("### 📖 Select a Lesson")
     render_lesson_buttons(st.session_state.progress, "main")
@@ -1785,7 +1690,6 @@ with tabs[1]:
             update_usage()
 
             try:
-                genai.configure(api_key=st.secrets['GEMINI_API_KEY'])
                 model_name = MODEL_CONFIG["FLASH"] if chat_model == "Flash" else MODEL_CONFIG["ULTRA"]
 
                 # Build prompt with subject context
@@ -1802,18 +1706,19 @@ with tabs[1]:
 
                 # Handle image if uploaded
                 if uploaded_image:
+                    from PIL import Image
                     image = Image.open(uploaded_image)
-                    model = genai.GenerativeModel(model_name)
+                    model = get_model(model_name)
                     with st.chat_message("assistant"):
                         with st.spinner("Analyzing image..."):
-                            resp = model.generate_content([full_prompt, image])
+                            resp = llm_generate(model, [full_prompt, image], "chat_image")
                             st.markdown(resp.text)
                             st.session_state.messages.append({"role":"assistant","content":resp.text})
                 else:
-                    model = genai.GenerativeModel(model_name)
+                    model = get_model(model_name)
                     with st.chat_message("assistant"):
                         with st.spinner("Thinking..."):
-                            resp = model.generate_content(full_prompt)
+                            resp = llm_generate(model, full_prompt, "chat")
                             st.markdown(resp.text)
                             st.session_state.messages.append({"role":"assistant","content":resp.text})
 
@@ -1831,23 +1736,15 @@ with tabs[2]:
 
     # Cache user data to avoid repeated DB calls (refresh only when needed)
     if 'pets_tab_data' not in st.session_state or st.session_state.get('refresh_pets_data', False):
-        conn = get_db()
-        if conn:
-            cur = conn.cursor(dictionary=True)
-            cur.execute(f"USE {st.secrets['DB_NAME']};")
-
-            # Load all data in one go
-            cur.execute("SELECT total_xp FROM Users WHERE user_id=%s", (st.session_state.user_id,))
-            user_xp_data = cur.fetchone()
-
-            st.session_state.pets_tab_data = {
-                'user_xp': user_xp_data['total_xp'] if user_xp_data else 0,
-                'user_pets': get_user_pets(st.session_state.user_id),
-                'last_updated': datetime.now()
-            }
-            st.session_state.refresh_pets_data = False
-            cur.close()
-            conn.close()
+        store, uid = get_storage(), st.session_state.user_id
+        # Balance and collection are independent reads
+        user_xp, user_pets = parallel_io.gather(lambda: store.users.total_xp(uid), lambda: store.pets.owned(uid))
+        st.session_state.pets_tab_data = {
+            'user_xp': user_xp,
+            'user_pets': user_pets,
+            'last_updated': datetime.now()
+        }
+        st.session_state.refresh_pets_data = False
 
     # Use cached data
     if 'pets_tab_data' in st.session_state:
@@ -1874,12 +1771,14 @@ with tabs[2]:
                     st.caption(f"{pet['rarity']} • {pet['xp_multiplier']}x")
                     if st.button(f"Unequip", key=f"unequip_{slot}"):
                         unequip_pet(st.session_state.user_id, slot)
-                        st.session_state.equipped_pets_cache = get_equipped_pets(st.session_state.user_id)
-                        st.session_state.refresh_pets_data = True
                         st.rerun()
                 else:
                     st.markdown(f"<div style='text-align:center;font-size:48px;opacity:0.3;'>📦</div>", unsafe_allow_html=True)
                     st.caption(f"Slot {slot} Empty")
+                if slot < 3 and equipped_pets:
+                    if st.button(f"⇄ Swap with {slot+1}", key=f"swap_{slot}"):
+                        swap_pets(st.session_state.user_id, slot, slot + 1)
+                        st.rerun()
 
         st.markdown("---")
 
@@ -1888,14 +1787,17 @@ with tabs[2]:
         st.caption(f"💰 Your XP: **{user_xp}**")
 
         # Define eggs (New Year egg LIVE NOW - Expires in 4 days!)
-        NEW_YEAR_EGG_END = datetime(2026, 1, 5, 23, 59, 59)
         eggs = [
-            {'type': 'common', 'name': 'Common Egg', 'emoji': '🥚', 'cost': 50, 'desc': 'Common 70% | Uncommon 25% | Rare 5%'},
-            {'type': 'premium', 'name': 'Premium Egg', 'emoji': '🪺', 'cost': 150, 'desc': 'Common 40% | Uncommon 40% | Rare 15% | Epic 5%'},
-            {'type': 'legendary', 'name': 'Legendary Egg', 'emoji': '🌟', 'cost': 500, 'desc': 'Uncommon 30% | Rare 45% | Epic 20% | Legendary 5%'},
-            {'type': 'newyear', 'name': 'New Year Egg', 'emoji': '🎆', 'cost': 200, 'desc': '⭐ Limited Edition! Rare 50% | Epic 35% | Legendary 15%', 'deadline': NEW_YEAR_EGG_END}
+            {'type': 'common', 'name': 'Common Egg', 'emoji': '🥚', 'cost': EGG_COSTS['common'], 'desc': 'Common 70% | Uncommon 25% | Rare 5%'},
+            {'type': 'premium', 'name': 'Premium Egg', 'emoji': '🪺', 'cost': EGG_COSTS['premium'], 'desc': 'Common 40% | Uncommon 40% | Rare 15% | Epic 5%'},
+            {'type': 'legendary', 'name': 'Legendary Egg', 'emoji': '🌟', 'cost': EGG_COSTS['legendary'], 'desc': 'Uncommon 30% | Rare 45% | Epic 20% | Legendary 5%'},
+            {'type': 'newyear', 'name': 'New Year Egg', 'emoji': '🎆', 'cost': EGG_COSTS['newyear'], 'desc': '⭐ Limited Edition! Rare 50% | Epic 35% | Legendary 15%', 'deadline': NEW_YEAR_EGG_END}
         ]
 
+        # Idempotency nonce for this shop render: repeat clicks reuse it, a completed purchase renews it
+        if 'shop_nonce' not in st.session_state:
+            st.session_state.shop_nonce = uuid.uuid4().hex[:16]
+
         egg_cols = st.columns(4)
         for idx, egg in enumerate(eggs):
             with egg_cols[idx]:
@@ -1923,7 +1825,7 @@ with tabs[2]:
                         is_available = False
                         st.error("🔴 Too Late!")
 
-                # Buy button
+                # Buy buttons (single egg and 10-pack)
                 can_afford = user_xp >= egg['cost']
                 if not is_available:
                     st.button(f"❌ Unavailable", key=f"buy_{egg['type']}", disabled=True, use_container_width=True)
@@ -1931,63 +1833,57 @@ with tabs[2]:
                     st.button(f"🔒 Need {egg['cost']-user_xp} more XP", key=f"buy_{egg['type']}", disabled=True, use_container_width=True)
                 else:
                     if st.button(f"🛒 Buy ({egg['cost']} XP)", key=f"buy_{egg['type']}", use_container_width=True):
-                        # Buy the egg immediately (no separate rerun needed)
-                        st.session_state.opening_egg = egg['type']
+                        st.session_state.opening_egg = (egg['type'], 1)
+                    if user_xp >= egg['cost'] * 10:
+                        if st.button(f"🎁 Open 10 ({egg['cost']*10} XP)", key=f"buy10_{egg['type']}", use_container_width=True):
+                            st.session_state.opening_egg = (egg['type'], 10)
 
-        # Egg opening animation (simplified for performance)
+        # Buy every egg in one transaction, then reveal all hatched pets in one animation
         if 'opening_egg' in st.session_state:
-            egg_type = st.session_state.opening_egg
-            egg_info = next((e for e in eggs if e['type'] == egg_type), None)
-
-            if egg_info:
-                # Buy the egg and get the pet
-                pet_result, error = buy_egg(st.session_state.user_id, egg_type)
-
-                if pet_result:
-                    # pet_result already contains all pet details from buy_egg()
-                    new_pet = pet_result
-
-                    # Animation overlay
-                    rarity_colors = {
-                        'Common': '#9CA3AF',
-                        'Uncommon': '#10B981',
-                        'Rare': '#3B82F6',
-                        'Epic': '#A855F7',
-                        'Legendary': '#F59E0B'
-                    }
-                    color = rarity_colors.get(new_pet['rarity'], '#9CA3AF')
-
-                    # Simplified fast animation (2 seconds total)
-                    animation_html = f"""
-                    <div style='position:fixed;top:0;left:0;width:100%;height:100%;background:rgba(0,0,0,0.9);z-index:9999;display:flex;align-items:center;justify-content:center;flex-direction:column;'>
-                        <div style='font-size:150px;animation:shake 0.3s 3;'>{egg_info['emoji']}</div>
-                        <div style='font-size:180px;margin-top:20px;animation:pop 0.5s 0.4s forwards;opacity:0;'>{new_pet['emoji']}</div>
-                        <div style='color:{color};font-size:28px;font-weight:bold;margin-top:15px;animation:fadeIn 0.3s 0.9s forwards;opacity:0;'>{new_pet['name']}</div>
-                        <div style='color:white;font-size:18px;margin-top:8px;animation:fadeIn 0.3s 1.2s forwards;opacity:0;'>{new_pet['rarity']} • {new_pet['xp_multiplier']}x XP</div>
-                    </div>
-                    <style>
-                        @keyframes shake {{ 0%,100% {{ transform:rotate(0deg); }} 33% {{ transform:rotate(-10deg); }} 66% {{ transform:rotate(10deg); }} }}
-                        @keyframes pop {{ 0% {{ opacity:0; transform:scale(0.3); }} 50% {{ transform:scale(1.1); }} 100% {{ opacity:1; transform:scale(1); }} }}
-                        @keyframes fadeIn {{ to {{ opacity:1; }} }}
-                    </style>
-                    <script>
-                        setTimeout(() => {{ window.parent.postMessage('close', '*'); }}, 2000);
-                    </script>
-                    """
-
-                    components.html(animation_html, height=600)
-
-                    # Clear the flag and refresh all caches
-                    del st.session_state.opening_egg
-                    st.session_state.equipped_pets_cache = get_equipped_pets(st.session_state.user_id)
-                    st.session_state.refresh_pets_data = True  # Refresh pets tab data
-                    st.session_state.total_xp = user_xp - egg_info['cost']  # Update XP in session
-                    play_sound("levelup")
-                    st.rerun()
-                else:
-                    st.error(f"Failed to open egg: {error}")
-                    del st.session_state.opening_egg
-                    st.rerun()
+            egg_type, count = st.session_state.pop('opening_egg')
+            new_pets, error = buy_eggs(st.session_state.user_id, egg_type, count,
+                                       idempotency_key=f"{st.session_state.shop_nonce}:{egg_type}:{count}")
+            if new_pets:
+                st.session_state.egg_reveal = {'egg': egg_type, 'pets': new_pets}
+                st.session_state.refresh_pets_data = True  # Refresh pets tab data
+                play_sound("levelup")
+                st.rerun()
+            else:
+                st.error(f"Failed to open egg: {error}")
+
+        if 'egg_reveal' in st.session_state:
+            reveal = st.session_state.pop('egg_reveal')
+            del st.session_state.shop_nonce
+            egg_info = next((e for e in eggs if e['type'] == reveal['egg']), eggs[0])
+            rarity_colors = {
+                'Common': '#9CA3AF',
+                'Uncommon': '#10B981',
+                'Rare': '#3B82F6',
+                'Epic': '#A855F7',
+                'Legendary': '#F59E0B'
+            }
+            solo = len(reveal['pets']) == 1
+            pets_html = "".join(
+                f"""<div style='margin:8px;text-align:center;animation:pop 0.5s {0.4 + i*0.1:.1f}s forwards;opacity:0;'>
+                    <div style='font-size:{180 if solo else 56}px;'>{p['emoji']}</div>
+                    <div style='color:{rarity_colors.get(p['rarity'], '#9CA3AF')};font-size:{28 if solo else 13}px;font-weight:bold;'>{p['name']}</div>
+                    <div style='color:white;font-size:{18 if solo else 11}px;'>{p['rarity']} • {p['xp_multiplier']}x XP</div>
+                </div>"""
+                for i, p in enumerate(reveal['pets'])
+            )
+
+            # Simplified fast animation (2 seconds total)
+            animation_html = f"""
+            <div style='position:fixed;top:0;left:0;width:100%;height:100%;background:rgba(0,0,0,0.9);z-index:9999;display:flex;align-items:center;justify-content:center;flex-direction:column;'>
+                <div style='font-size:{150 if solo else 90}px;animation:shake 0.3s 3;'>{egg_info['emoji']}</div>
+                <div style='display:flex;flex-wrap:wrap;justify-content:center;max-width:640px;margin-top:20px;'>{pets_html}</div>
+            </div>
+            <style>
+                @keyframes shake {{ 0%,100% {{ transform:rotate(0deg); }} 33% {{ transform:rotate(-10deg); }} 66% {{ transform:rotate(10deg); }} }}
+                @keyframes pop {{ 0% {{ opacity:0; transform:scale(0.3); }} 50% {{ transform:scale(1.1); }} 100% {{ opacity:1; transform:scale(1); }} }}
+            </style>
+            """
+            embed_html(animation_html, 600)
 
         st.markdown("---")
 
@@ -2016,9 +1912,9 @@ with tabs[2]:
             elif sort_by == "Name":
                 filtered_pets = sorted(filtered_pets, key=lambda x: x['name'])
             elif sort_by == "Recently Acquired":
-                filtered_pets = sorted(filtered_pets, key=lambda x: x['acquired_date'], reverse=True)
+                filtered_pets = sorted(filtered_pets, key=lambda x: x['last_acquired'], reverse=True)
 
-            st.caption(f"Showing {len(filtered_pets)} of {len(user_pets)} pets")
+            st.caption(f"Showing {len(filtered_pets)} of {len(user_pets)} pets ({sum(p['quantity'] for p in user_pets)} hatched)")
 
             # Display pets in grid
             rarity_colors = {
@@ -2037,7 +1933,8 @@ with tabs[2]:
                         pet = filtered_pets[i + j]
                         with cols[j]:
                             border_color = rarity_colors.get(pet['rarity'], '#9CA3AF')
-                            is_equipped = pet['is_equipped']
+                            equipped_slot = next((p['equip_slot'] for p in equipped_pets if p['pet_id'] == pet['pet_id']), None)
+                            is_equipped = equipped_slot is not None
 
                             # Pet card
                             card_html = f"""
@@ -2045,7 +1942,7 @@ with tabs[2]:
                                 <div style='font-size:56px;'>{pet['emoji']}</div>
                                 <div style='font-weight:bold;margin-top:8px;'>{pet['name']}</div>
                                 <div style='color:{border_color};font-size:12px;'>{pet['rarity']}</div>
-                                <div style='font-size:14px;margin-top:4px;'>{pet['xp_multiplier']}x XP</div>
+                                <div style='font-size:14px;margin-top:4px;'>{pet['xp_multiplier']}x XP{f" • ×{pet['quantity']}" if pet['quantity'] > 1 else ''}</div>
                                 {'<div style="color:#10B981;font-size:12px;margin-top:4px;">✓ Equipped</div>' if is_equipped else ''}
                             </div>
                             """
@@ -2053,21 +1950,17 @@ with tabs[2]:
 
                             # Equip/Unequip button
                             if is_equipped:
-                                if st.button("Unequip", key=f"coll_unequip_{pet['user_pet_id']}", use_container_width=True):
-                                    unequip_pet(st.session_state.user_id, pet['equip_slot'])
-                                    st.session_state.equipped_pets_cache = get_equipped_pets(st.session_state.user_id)
-                                    st.session_state.refresh_pets_data = True
+                                if st.button("Unequip", key=f"coll_unequip_{pet['pet_id']}", use_container_width=True):
+                                    unequip_pet(st.session_state.user_id, equipped_slot)
                                     st.rerun()
                             else:
                                 # Find first available slot
-                                occupied_slots = [p['equip_slot'] for p in equipped_pets if p['equip_slot']]
+                                occupied_slots = [p['equip_slot'] for p in equipped_pets]
                                 available_slot = next((s for s in [1, 2, 3] if s not in occupied_slots), None)
 
                                 if available_slot:
-                                    if st.button(f"Equip to Slot {available_slot}", key=f"coll_equip_{pet['user_pet_id']}", use_container_width=True):
+                                    if st.button(f"Equip to Slot {available_slot}", key=f"coll_equip_{pet['pet_id']}", use_container_width=True):
                                         equip_pet(st.session_state.user_id, pet['pet_id'], available_slot)
-                                        st.session_state.equipped_pets_cache = get_equipped_pets(st.session_state.user_id)
-                                        st.session_state.refresh_pets_data = True
                                         st.rerun()
                                 else:
                                     st.caption("All slots full")
@@ -2077,23 +1970,12 @@ with tabs[2]:
         # Section 4: Pet Library / Pokedex (Lazy-loaded for performance)
         st.markdown("#### 📚 Pet Library")
 
-        # Cache all pets data (only load once)
-        if 'all_pets_cache' not in st.session_state:
-            conn_lib = get_db()
-            if conn_lib:
-                cur_lib = conn_lib.cursor(dictionary=True)
-                cur_lib.execute(f"USE {st.secrets['DB_NAME']};")
-                cur_lib.execute("SELECT * FROM Pets ORDER BY FIELD(rarity, 'Common', 'Uncommon', 'Rare', 'Epic', 'Legendary'), name")
-                st.session_state.all_pets_cache = cur_lib.fetchall()
-                cur_lib.close()
-                conn_lib.close()
-
-        all_pets = st.session_state.all_pets_cache
+        all_pets = pet_catalog()
         owned_pet_ids = set([p['pet_id'] for p in user_pets])
 
         # Calculate collection progress
         total_pets = len([p for p in all_pets if not p['is_limited']])
-        owned_count = len([p for p in user_pets if p['pet_id'] in owned_pet_ids])
+        owned_count = len([p for p in user_pets if not p['is_limited']])
         progress_pct = int((owned_count / total_pets) * 100) if total_pets > 0 else 0
 
         st.markdown(f"**Collection Progress: {owned_count}/{total_pets} pets ({progress_pct}%)**")
@@ -2176,6 +2058,10 @@ with tabs[2]:
                         st.markdown(card_html, unsafe_allow_html=True)
 
 with tabs[3]:
+    st.markdown("### 🏆 Leaderboard")
+    render_leaderboard()
+
+with tabs[4]:
     st.markdown("### 📂 Chat History")
 
     # Show current chat messages if any
@@ -2188,68 +2074,45 @@ with tabs[3]:
             if len(st.session_state.messages) > 5:
                 st.caption(f"... and {len(st.session_state.messages) - 5} more messages")
 
-    conn = get_db()
-    if conn:
-        cur = conn.cursor(dictionary=True)
-        cur.execute(f"USE {st.secrets['DB_NAME']};")
+    if st.button("➕ New Chat", type="primary"):
+        store, uid, old_sid = get_storage(), st.session_state.user_id, st.session_state.get('session_id')
+        sid = f"S_{uuid.uuid4().hex[:4]}"
+        # Delete current chat if it's empty, and start the new one, in one transaction
+        with store.transaction(user_id=uid) as cur:
+            if len(st.session_state.messages) == 0 and old_sid:
+                store.chats.delete_empty(uid, old_sid, cur)
+            store.chats.start(uid, sid, cur)
+        st.session_state.session_id = sid
+        st.session_state.messages = []
+        st.success("✅ New chat created! Go to Chat tab to start.")
+        st.rerun()
 
-        if st.button("➕ New Chat", type="primary"):
-            # Delete current chat if it's empty
+    for row in get_storage().chats.recent(st.session_state.user_id):
+        is_current = row['session_id'] == st.session_state.get('session_id')
+        btn_label = f"{'📌' if is_current else '📄'} {row['title'][:30]}"
+        if st.button(btn_label, key=f"h_{row['session_id']}", use_container_width=True, type="secondary" if is_current else "primary"):
+            # Delete current chat if it's empty before switching
             if len(st.session_state.messages) == 0 and st.session_state.get('session_id'):
                 delete_empty_chats(st.session_state.user_id, st.session_state.session_id)
 
-            sid = f"S_{uuid.uuid4().hex[:4]}"
-            st.session_state.session_id = sid
-            st.session_state.messages = []
-            cur.execute("UPDATE Users SET session_id=%s WHERE user_id=%s", (sid, st.session_state.user_id))
-            cur.execute("INSERT INTO ChatLogs (session_id,user_id,title,messages) VALUES (%s,%s,'New','[]')", (sid, st.session_state.user_id))
-            conn.commit()
-            st.success("✅ New chat created! Go to Chat tab to start.")
+            st.session_state.session_id = row['session_id']
+            st.session_state.messages = json.loads(row['messages']) if row['messages'] else []
+            st.success(f"✅ Loaded chat: {row['title'][:30]} - Go to Chat tab to continue")
             st.rerun()
 
-        cur.execute("SELECT * FROM ChatLogs WHERE user_id=%s ORDER BY timestamp DESC LIMIT 20", (st.session_state.user_id,))
-        for row in cur.fetchall():
-            is_current = row['session_id'] == st.session_state.get('session_id')
-            btn_label = f"{'📌' if is_current else '📄'} {row['title'][:30]}"
-            if st.button(btn_label, key=f"h_{row['session_id']}", use_container_width=True, type="secondary" if is_current else "primary"):
-                # Delete current chat if it's empty before switching
-                if len(st.session_state.messages) == 0 and st.session_state.get('session_id'):
-                    delete_empty_chats(st.session_state.user_id, st.session_state.session_id)
-
-                st.session_state.session_id = row['session_id']
-                st.session_state.messages = json.loads(row['messages']) if row['messages'] else []
-                st.success(f"✅ Loaded chat: {row['title'][:30]} - Go to Chat tab to continue")
-                st.rerun()
-        cur.close()
-        conn.close()
-
-with tabs[4]:
+with tabs[5]:
     st.markdown("### ⚙️ Settings")
     
     new_grade = st.selectbox("Grade Level", GRADES, index=GRADES.index(st.session_state.grade))
     if new_grade != st.session_state.grade:
         st.session_state.grade = new_grade
-        conn = get_db()
-        if conn:
-            cur = conn.cursor()
-            cur.execute(f"USE {st.secrets['DB_NAME']};")
-            cur.execute("UPDATE Users SET grade=%s WHERE user_id=%s", (new_grade, st.session_state.user_id))
-            conn.commit()
-            cur.close()
-            conn.close()
+        get_storage().users.update_settings(st.session_state.user_id, grade=new_grade)
         st.rerun()
     
     new_theme = st.selectbox("Theme", list(THEMES.keys()), index=list(THEMES.keys()).index(st.session_state.theme))
     if new_theme != st.session_state.theme:
         st.session_state.theme = new_theme
-        conn = get_db()
-        if conn:
-            cur = conn.cursor()
-            cur.execute(f"USE {st.secrets['DB_NAME']};")
-            cur.execute("UPDATE Users SET theme=%s WHERE user_id=%s", (new_theme, st.session_state.user_id))
-            conn.commit()
-            cur.close()
-            conn.close()
+        get_storage().users.update_settings(st.session_state.user_id, theme=new_theme)
         st.rerun()
     
     st.markdown("---")
@@ -2262,14 +2125,7 @@ with tabs[4]:
     new_goal = st.slider("🎯 Daily Lesson Goal", min_value=1, max_value=10, value=st.session_state.get('daily_goal', 3))
     if new_goal != st.session_state.daily_goal:
         st.session_state.daily_goal = new_goal
-        conn = get_db()
-        if conn:
-            cur = conn.cursor()
-            cur.execute(f"USE {st.secrets['DB_NAME']};")
-            cur.execute("UPDATE Users SET daily_goal=%s WHERE user_id=%s", (new_goal, st.session_state.user_id))
-            conn.commit()
-            cur.close()
-            conn.close()
+        get_storage().users.update_settings(st.session_state.user_id, daily_goal=new_goal)
         st.rerun()
 
     st.markdown("---")
@@ -2277,7 +2133,15 @@ with tabs[4]:
     st.markdown(f"- Level: {lvl['level']} ({lvl['name']})")
     st.markdown(f"- Total XP: {st.session_state.total_xp}")
     st.markdown(f"- Badges: {len(st.session_state.badges)}/{len(BADGES)}")
-    st.markdown(f"- Lessons Done: {len([k for k,v in st.session_state.progress.items() if v=='completed'])}")
+    st.markdown(f"- Lessons Done: {total_done_count(st.session_state.progress)}")
+
+    if is_admin():
+        st.markdown("---")
+        with st.expander("🛠️ Diagnostics"):
+            diag_db, diag_llm, diag_prof = st.tabs(["Database", "LLM", "Profiling"])
+            with diag_db: render_db_diagnostics()
+            with diag_llm: render_llm_diagnostics()
+            with diag_prof: render_profiling_diagnostics()
 
     st.markdown("---")
     if st.button("🚪 Log Out", use_container_width=True):
@@ -2285,4 +2149,7 @@ with tabs[4]:
         if len(st.session_state.messages) == 0 and st.session_state.get('session_id'):
             delete_empty_chats(st.session_state.user_id, st.session_state.session_id)
         st.session_state.authenticated = False
+        st.session_state.profile_enabled = False
         st.rerun()
+
+finish_rerun()
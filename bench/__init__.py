@@ -0,0 +1 @@
+"""Offline benchmarks for Sorokin AI: a fake Gemini backend and scripted app journeys."""
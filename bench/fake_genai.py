@@ -0,0 +1,122 @@
+"""Stand-in for google.generativeai with configurable latency and token rates.
+
+install() registers this module as google.generativeai, so app.py's lazy
+`import google.generativeai` (on the first LLM call) picks it up and no network is used.
+Responses stream like the real client: the first chunk arrives after TTFT_MS,
+and the remaining tokens arrive at TOKENS_PER_S. Prompts asking for quiz JSON
+get a valid five-question quiz, and lesson prompts get five JSON sections.
+"""
+import json
+import sys
+import time
+import types
+
+TTFT_MS = 150.0
+TOKENS_PER_S = 400.0
+RESPONSE_TOKENS = 250
+CHUNK_TOKENS = 25
+
+CALLS = []
+
+
+def install(ttft_ms=None, tokens_per_s=None, response_tokens=None):
+    """Replace google.generativeai in sys.modules with this module"""
+    global TTFT_MS, TOKENS_PER_S, RESPONSE_TOKENS
+    if ttft_ms is not None:
+        TTFT_MS = ttft_ms
+    if tokens_per_s is not None:
+        TOKENS_PER_S = tokens_per_s
+    if response_tokens is not None:
+        RESPONSE_TOKENS = response_tokens
+    module = sys.modules[__name__]
+    try:
+        import google     # the real namespace package, so google.protobuf (streamlit) still imports
+    except ImportError:
+        google = sys.modules["google"] = types.ModuleType("google")
+        google.__path__ = []
+    google.generativeai = module
+    sys.modules["google.generativeai"] = module
+    return module
+
+
+def configure(api_key=None, **kwargs):
+    pass
+
+
+QUIZ = {"questions": [
+    {"q": f"Benchmark question {i + 1}?", "opts": ["A) one", "B) two", "C) three", "D) four"], "ans": i % 4,
+     "why": "Because the benchmark says so."}
+    for i in range(5)
+]}
+
+
+def _prompt_text(contents):
+    if isinstance(contents, (list, tuple)):
+        return " ".join(c for c in contents if isinstance(c, str))
+    return str(contents)
+
+
+def _lesson(n_sections=5):
+    words = max(RESPONSE_TOKENS // n_sections, 1)
+    return json.dumps({"sections": [{"title": f"Section {i + 1}", "content": " ".join(f"word{j % 50}" for j in range(words))}
+                                     for i in range(n_sections)]})
+
+
+def _reply(prompt):
+    if '"sections"' in prompt:
+        return _lesson()
+    if "Return ONLY JSON" in prompt:
+        return json.dumps(QUIZ)
+    if "title for a chat" in prompt:
+        return "Benchmark Chat Title"
+    return " ".join(f"word{i % 50}" for i in range(RESPONSE_TOKENS))
+
+
+class _Usage:
+    def __init__(self, prompt_tokens, response_tokens):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = response_tokens
+        self.total_token_count = prompt_tokens + response_tokens
+
+
+class _Chunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    """Iterating yields chunks with the configured pacing; .text is the whole reply"""
+
+    def __init__(self, prompt, text, stream):
+        words = text.split(" ")
+        self._chunks = [" ".join(words[i:i + CHUNK_TOKENS]) for i in range(0, len(words), CHUNK_TOKENS)]
+        self.text = text
+        self.usage_metadata = _Usage(len(prompt.split()), len(words))
+        self._consumed = False
+        if not stream:
+            self._pace_all()
+
+    def _pace_all(self):
+        for _ in self:
+            pass
+
+    def __iter__(self):
+        if self._consumed:
+            yield from (_Chunk(c) for c in self._chunks)
+            return
+        time.sleep(TTFT_MS / 1000)
+        for i, chunk in enumerate(self._chunks):
+            if i:
+                time.sleep(CHUNK_TOKENS / TOKENS_PER_S)
+            yield _Chunk(chunk)
+        self._consumed = True
+
+
+class GenerativeModel:
+    def __init__(self, model_name, **kwargs):
+        self.model_name = f"models/{model_name}"
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = _prompt_text(contents)
+        CALLS.append((self.model_name, prompt[:80]))
+        return FakeResponse(prompt, _reply(prompt), stream)
@@ -0,0 +1,215 @@
+"""Drive app.py headlessly with streamlit.testing AppTest against local backends.
+
+The database is any MySQL-compatible server reachable without TLS, e.g. a
+local MySQL container or a TiDB playground. Configure it with the BENCH_DB_HOST,
+BENCH_DB_PORT, BENCH_DB_USER, BENCH_DB_PASSWORD and BENCH_DB_NAME environment
+variables; the database is created if it is missing. BENCH_DB_BACKEND=sqlite
+uses the embedded backend instead, in the file at BENCH_SQLITE_PATH, and needs
+no server at all. Gemini is replaced by bench.fake_genai, so no network is needed.
+
+A student journey is a list of (step name, function) pairs. Each step acts on
+one AppTest session like a user clicking through the app, and measure() records
+its wall time, DB queries, new connections and LLM calls.
+"""
+import os
+import tempfile
+import time
+import uuid
+
+import storage
+from bench import fake_genai
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+PASSWORD = "bench-password"
+START_XP = 5000
+
+
+class StepError(RuntimeError):
+    pass
+
+
+def bench_secrets():
+    if os.environ.get("BENCH_DB_BACKEND") == "sqlite":
+        return {
+            "DB_BACKEND": "sqlite",
+            "SQLITE_PATH": os.environ.get("BENCH_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "sorokin_bench.db")),
+            "GEMINI_API_KEY": "offline",
+        }
+    return {
+        "DB_HOST": os.environ.get("BENCH_DB_HOST", "127.0.0.1"),
+        "DB_PORT": int(os.environ.get("BENCH_DB_PORT", 3306)),
+        "DB_USER": os.environ.get("BENCH_DB_USER", "root"),
+        "DB_PASSWORD": os.environ.get("BENCH_DB_PASSWORD", ""),
+        "DB_NAME": os.environ.get("BENCH_DB_NAME", "sorokin_bench"),
+        "DB_SSL": False,
+        "GEMINI_API_KEY": "offline",
+    }
+
+
+def connect(secrets, database=True):
+    """Raw connection to the bench MySQL server (for CREATE DATABASE and server status)"""
+    import mysql.connector
+    return mysql.connector.connect(
+        host=secrets["DB_HOST"], port=secrets["DB_PORT"], user=secrets["DB_USER"],
+        password=secrets["DB_PASSWORD"], database=secrets["DB_NAME"] if database else None,
+    )
+
+
+def prepare(secrets, ttft_ms=None, tokens_per_s=None, response_tokens=None, fake_llm=True):
+    """Install the fake LLM (unless fake_llm is False) and make sure the bench database exists"""
+    if fake_llm:
+        fake_genai.install(ttft_ms, tokens_per_s, response_tokens)
+    if secrets.get("DB_BACKEND") == "sqlite":
+        return
+    conn = connect(secrets, database=False)
+    cur = conn.cursor()
+    cur.execute(f"CREATE DATABASE IF NOT EXISTS {secrets['DB_NAME']}")
+    cur.close()
+    conn.close()
+
+
+def new_app(secrets, timeout=120):
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    for key, value in secrets.items():
+        at.secrets[key] = value
+    return at
+
+
+def check(at, step):
+    if at.exception:
+        raise StepError(f"{step}: {at.exception[0].value}")
+    return at
+
+
+def click(at, step, key=None, label=None, prefix=None):
+    """Click the first button matching key, label or key prefix and rerun"""
+    for button in at.button:
+        if (key and button.key == key) or (label and button.label == label) or \
+                (prefix and button.key and button.key.startswith(prefix)):
+            button.click()
+            return check(at.run(), step)
+    raise StepError(f"{step}: no button {key or label or prefix + '*'}")
+
+
+def seed_xp(secrets, username, xp=START_XP):
+    """Give a bench user enough XP for the shop steps"""
+    storage.open_storage(secrets).execute("UPDATE Users SET total_xp=%s WHERE username=%s", (xp, username))
+
+
+def register(at, secrets, username):
+    """Create a user through the Register tab (setup, not measured)"""
+    check(at.run(), "register")
+    at.text_input(key="ru").input(username)
+    at.text_input(key="rp").input(PASSWORD)
+    for key in ("age_check_register", "ai_check_register", "eu_check_register"):
+        at.checkbox(key=key).check()
+    click(at, "register", label="Register")
+    seed_xp(secrets, username)
+
+
+# Journey steps ---------------------------------------------------------------
+
+def step_login(at, username):
+    at.text_input(key="lu").input(username)
+    at.text_input(key="lp").input(PASSWORD)
+    for key in ("age_check_login", "ai_check_login", "eu_check_login"):
+        at.checkbox(key=key).check()
+    click(at, "login", label="Log In")
+    if not at.session_state["authenticated"]:
+        raise StepError("login: not authenticated")
+
+
+def step_start_lesson(at, username):
+    click(at, "start_lesson", prefix="main_course_")
+    cid = at.session_state["main_open_course"]
+    click(at, "start_lesson", prefix=f"main_{cid}_")
+    click(at, "start_lesson", label="▶ START")
+
+
+def step_next_sections(at, username):
+    for _ in range(4):
+        click(at, "next_sections", label="Next ➡")
+
+
+def step_done_quiz(at, username):
+    click(at, "done_quiz", label="✓ Done")
+    click(at, "done_quiz", label="Submit")
+    click(at, "done_quiz", label="❌ Exit")
+
+
+def step_chat_message(at, username):
+    at.chat_input[0].set_value("How does photosynthesis work?")
+    check(at.run(), "chat_message")
+
+
+def step_buy_egg(at, username):
+    click(at, "buy_egg", key="buy_common")
+
+
+def step_equip(at, username):
+    click(at, "equip", prefix="coll_equip_")
+
+
+def step_history(at, username):
+    click(at, "history", prefix="h_")
+
+
+JOURNEY = [
+    ("login", step_login),
+    ("start_lesson", step_start_lesson),
+    ("next_sections", step_next_sections),
+    ("done_quiz", step_done_quiz),
+    ("chat_message", step_chat_message),
+    ("buy_egg", step_buy_egg),
+    ("equip", step_equip),
+    ("history", step_history),
+]
+
+
+# Measurement -----------------------------------------------------------------
+
+def _counters():
+    import db_metrics
+    import llm_metrics
+    calls = tokens = 0
+    for day in llm_metrics.rollup():
+        calls += day["calls"]
+        tokens += day["prompt_tokens"] + day["response_tokens"]
+    return (db_metrics.REGISTRY.count, db_metrics.REGISTRY.total_ms, calls, tokens,
+            db_metrics.connection_stats()["opened"])
+
+
+def measure(fn, *args):
+    """Run fn(*args) and return {wall_ms, queries, db_ms, connections, llm_calls, llm_tokens, error}.
+
+    Counters are process-wide, so concurrent callers (bench.load) read wall time only.
+    """
+    before = _counters()
+    start = time.perf_counter()
+    error = None
+    try:
+        fn(*args)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    wall_ms = (time.perf_counter() - start) * 1000
+    after = _counters()
+    return {
+        "wall_ms": wall_ms, "queries": after[0] - before[0], "db_ms": after[1] - before[1],
+        "connections": after[4] - before[4], "llm_calls": after[2] - before[2], "llm_tokens": after[3] - before[3],
+        "error": error,
+    }
+
+
+def run_journey(secrets, steps=JOURNEY, username=None):
+    """Register a fresh user, then run and measure each step on one session: [(step, metrics)]"""
+    username = username or f"bench_{uuid.uuid4().hex[:8]}"
+    at = new_app(secrets)
+    register(at, secrets, username)
+    results = []
+    for name, fn in steps:
+        metrics = measure(fn, at, username)
+        results.append((name, metrics))
+        if metrics["error"]:
+            break
+    return results
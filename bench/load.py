@@ -0,0 +1,201 @@
+"""Concurrent-classroom load test: N simulated students hitting the app at the bell.
+
+    python -m bench.load --students 30 --ramp-s 5
+    python -m bench.load --students 120 --mode processes --workers 4
+
+Each student registers (setup, not measured) and then runs one scripted journey
+built from the app's real flows, picked by --mix. Lesson journeys cover the
+one-call lesson, section navigation and mark_done+quiz; chat journeys send
+messages; shop journeys buy an egg and equip it. Students are AppTest sessions.
+- threads mode runs them in one process, like one server replica.
+- processes mode splits them over worker processes, like several replicas.
+
+The LLM is bench.fake_genai and the database is the local server from
+bench.harness. Scripting the Streamlit websocket protocol of a live server is
+out of scope: AppTest executes the same script, session state and caches.
+
+The report covers throughput, per-step latency percentiles, error rates, and
+DB connection high-water marks. Connection peaks are measured client-side from
+db_metrics, and server-side by sampling Threads_connected where the server
+supports it (not on the embedded SQLite backend).
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from bench import harness
+
+JOURNEYS = {
+    "lesson": ["login", "start_lesson", "next_sections", "done_quiz"],
+    "chat": ["login", "chat_message", "chat_message", "chat_message"],
+    "shop": ["login", "buy_egg", "equip", "history"],
+}
+STEPS = dict(harness.JOURNEY)
+
+
+def parse_mix(text):
+    """'lesson=6,chat=3,shop=1' -> {'lesson': 6, 'chat': 3, 'shop': 1}"""
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in JOURNEYS:
+            raise argparse.ArgumentTypeError(f"unknown journey {name!r} (choose from {', '.join(JOURNEYS)})")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+def student(secrets, journey, start_at):
+    """One simulated student: register, wait for their arrival time, run the journey; returns step records"""
+    username = f"load_{uuid.uuid4().hex[:8]}"
+    at = harness.new_app(secrets)
+    try:
+        harness.register(at, secrets, username)
+    except Exception as e:
+        return [{"journey": journey, "step": "register", "wall_ms": 0.0, "error": f"{type(e).__name__}: {e}",
+                 "end": time.time()}]
+    time.sleep(max(0.0, start_at - time.time()))
+    records = []
+    for name in JOURNEYS[journey]:
+        start = time.perf_counter()
+        error = None
+        try:
+            STEPS[name](at, username)
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+        records.append({"journey": journey, "step": name, "wall_ms": (time.perf_counter() - start) * 1000,
+                        "error": error, "end": time.time()})
+        if error:
+            break
+    return records
+
+
+def run_threads(secrets, plan, threads):
+    """Run students on a thread pool in this process; returns (records, client connection peak)"""
+    import db_metrics
+    db_metrics.connection_stats(reset_peak=True)
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        futures = [pool.submit(student, secrets, journey, start_at) for journey, start_at in plan]
+        records = [r for f in futures for r in f.result()]
+    return records, db_metrics.connection_stats()["peak"]
+
+
+def _worker(secrets, plan, threads, llm_config):
+    harness.prepare(secrets, *llm_config)
+    return run_threads(secrets, plan, threads)
+
+
+def run_processes(secrets, plan, workers, threads, llm_config):
+    """Split students over worker processes; the connection peak is the sum of per-process peaks"""
+    shards = [plan[i::workers] for i in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_worker, [secrets] * workers, shards, [threads] * workers, [llm_config] * workers))
+    return [r for records, _ in results for r in records], sum(peak for _, peak in results)
+
+
+class ServerConnectionSampler(threading.Thread):
+    """Polls the server's Threads_connected; max stays None if the server doesn't report it"""
+
+    def __init__(self, secrets, interval=0.2):
+        super().__init__(daemon=True)
+        self.secrets, self.interval = secrets, interval
+        self.max = None
+        self._halt = threading.Event()
+
+    def run(self):
+        try:
+            conn = harness.connect(self.secrets)
+            cur = conn.cursor()
+            while not self._halt.is_set():
+                cur.execute("SHOW GLOBAL STATUS LIKE 'Threads_connected'")
+                row = cur.fetchone()
+                if row is None:
+                    return
+                self.max = max(self.max or 0, int(row[1]) - 1)  # minus the sampler itself
+                self._halt.wait(self.interval)
+            cur.close()
+            conn.close()
+        except Exception:
+            return
+
+    def stop(self):
+        self._halt.set()
+        self.join(timeout=2)
+
+
+def percentile(sorted_values, pct):
+    idx = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def report(records, elapsed_s, client_peak, server_peak):
+    steps = [r for r in records if r["step"] != "register"]
+    failed = [r for r in records if r["error"]]
+    print(f"students' steps: {len(steps)} in {elapsed_s:.1f}s -> {len(steps) / elapsed_s:.2f} steps/s")
+    journeys_done = sum(1 for r in steps if r["step"] == JOURNEYS[r["journey"]][-1] and not r["error"])
+    print(f"completed journeys: {journeys_done} ({journeys_done / elapsed_s:.2f}/s)")
+    print(f"errors: {len(failed)} ({len(failed) / max(1, len(records)):.1%})")
+    print(f"DB connections peak: client {client_peak}, server "
+          f"{server_peak if server_peak is not None else 'n/a'}")
+    print(f"\n{'step':<16}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}{'err%':>7}")
+    by_step = {}
+    for r in records:
+        by_step.setdefault(r["step"], []).append(r)
+    for name, rows in by_step.items():
+        ok = sorted(r["wall_ms"] for r in rows if not r["error"])
+        err = sum(1 for r in rows if r["error"]) / len(rows)
+        if ok:
+            print(f"{name:<16}{len(rows):>6}{percentile(ok, 50):>10.0f}{percentile(ok, 95):>10.0f}"
+                  f"{percentile(ok, 99):>10.0f}{ok[-1]:>10.0f}{err:>7.1%}")
+        else:
+            print(f"{name:<16}{len(rows):>6}{'-':>10}{'-':>10}{'-':>10}{'-':>10}{err:>7.1%}")
+    for error in sorted({r["error"] for r in failed})[:10]:
+        print(f"  error: {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=30)
+    parser.add_argument("--ramp-s", type=float, default=5.0, help="arrivals spread uniformly over this window")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("lesson=6,chat=3,shop=1"))
+    parser.add_argument("--mode", choices=["threads", "processes"], default="threads")
+    parser.add_argument("--workers", type=int, default=4, help="processes in processes mode")
+    parser.add_argument("--threads", type=int, default=0, help="concurrent students per process (default: all)")
+    parser.add_argument("--llm-ttft-ms", type=float, default=150)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=400)
+    parser.add_argument("--llm-response-tokens", type=int, default=250)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    rng = random.Random(args.seed)
+    secrets = harness.bench_secrets()
+    llm_config = (args.llm_ttft_ms, args.llm_tokens_per_s, args.llm_response_tokens)
+    harness.prepare(secrets, *llm_config)
+    # Warm the schema and caches once so the first student doesn't pay for init_db
+    harness.run_journey(secrets, steps=[("login", harness.step_login)])
+
+    # Registration happens before the bell; arrivals are spread over the ramp after it
+    names, weights = zip(*args.mix.items())
+    bell = time.time() + 2.0 + args.students * 0.05
+    plan = [(rng.choices(names, weights)[0], bell + rng.uniform(0, args.ramp_s)) for _ in range(args.students)]
+
+    sampler = ServerConnectionSampler(secrets)
+    sampler.start()
+    if args.mode == "threads":
+        records, client_peak = run_threads(secrets, plan, args.threads or args.students)
+    else:
+        per_process = args.threads or -(-args.students // args.workers)
+        records, client_peak = run_processes(secrets, plan, args.workers, per_process, llm_config)
+    sampler.stop()
+
+    steps = [r for r in records if r["step"] != "register"]
+    elapsed = max((r["end"] for r in steps), default=bell) - bell
+    report(records, max(elapsed, 1e-9), client_peak, sampler.max)
+    return 1 if not steps else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,112 @@
+"""Offline benchmark: run the student journey and compare against a baseline.
+
+    python -m bench.run                                  # 3 journeys, print per-step medians
+    python -m bench.run --write-baseline --journeys 9    # record bench/baseline.json
+    python -m bench.run --check                          # exit 1 on regressions vs the baseline
+
+A step regresses when it issues more queries, opens more connections or makes
+more LLM calls than the baseline. These counts are deterministic, so any
+increase is flagged. Wall time is printed but varies by a third or more between
+runs on a shared machine. It is only gated when --tolerance is given, e.g.
+--tolerance 1.0 flags a step that takes twice the baseline's time.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+
+from bench import harness
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+COUNT_FIELDS = ("queries", "connections", "llm_calls")
+
+
+def summarize(journeys):
+    """{step: medians over the journeys that reached it}"""
+    by_step = {}
+    for journey in journeys:
+        for name, metrics in journey:
+            by_step.setdefault(name, []).append(metrics)
+    summary = {}
+    for name, _ in harness.JOURNEY:
+        runs = by_step.get(name, [])
+        ok = [m for m in runs if not m["error"]]
+        if not ok:
+            summary[name] = {"errors": len(runs), "error": runs[0]["error"] if runs else "not reached"}
+            continue
+        summary[name] = {field: statistics.median(m[field] for m in ok)
+                         for field in ("wall_ms", "queries", "db_ms", "connections", "llm_calls", "llm_tokens")}
+        summary[name]["errors"] = len(runs) - len(ok)
+    return summary
+
+
+def regressions(summary, baseline, tolerance):
+    found = []
+    for name, base in baseline.items():
+        cur = summary.get(name)
+        if cur is None or "wall_ms" not in cur:
+            found.append(f"{name}: failed ({cur.get('error') if cur else 'missing'})")
+            continue
+        for field in COUNT_FIELDS:
+            if field in base and cur[field] > base[field]:
+                found.append(f"{name}: {field} {base[field]:g} -> {cur[field]:g}")
+        if tolerance is not None and cur["wall_ms"] > base["wall_ms"] * (1 + tolerance):
+            found.append(f"{name}: wall {base['wall_ms']:.0f}ms -> {cur['wall_ms']:.0f}ms")
+    return found
+
+
+def print_table(summary):
+    print(f"{'step':<16}{'wall ms':>10}{'queries':>9}{'db ms':>9}{'conns':>7}{'llm':>5}{'tokens':>8}{'errors':>8}")
+    for name, s in summary.items():
+        if "wall_ms" not in s:
+            print(f"{name:<16}{'-':>10}{'-':>9}{'-':>9}{'-':>7}{'-':>5}{'-':>8}{s['errors']:>8}  {s['error']}")
+            continue
+        print(f"{name:<16}{s['wall_ms']:>10.0f}{s['queries']:>9g}{s['db_ms']:>9.0f}{s['connections']:>7g}"
+              f"{s['llm_calls']:>5g}{s['llm_tokens']:>8g}{s['errors']:>8}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--journeys", type=int, default=3)
+    parser.add_argument("--llm-ttft-ms", type=float, default=150)
+    parser.add_argument("--llm-tokens-per-s", type=float, default=400)
+    parser.add_argument("--llm-response-tokens", type=int, default=250)
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--check", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=None,
+                        help="also gate wall time: allowed growth (1.0 = 100%%); off by default")
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args(argv)
+
+    secrets = harness.bench_secrets()
+    harness.prepare(secrets, args.llm_ttft_ms, args.llm_tokens_per_s, args.llm_response_tokens)
+    # The first journey pays for schema creation, seeding and imports; keep it out of the numbers
+    harness.run_journey(secrets)
+    summary = summarize([harness.run_journey(secrets) for _ in range(args.journeys)])
+    print_table(summary)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summary, f, indent=2)
+
+    if args.write_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({k: v for k, v in summary.items() if "wall_ms" in v}, f, indent=2, sort_keys=True)
+        print(f"baseline written to {args.baseline}")
+        return 0
+    if os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            found = regressions(summary, json.load(f), args.tolerance)
+        for line in found:
+            print(f"REGRESSION {line}")
+        if found and args.check:
+            return 1
+    elif args.check:
+        print(f"no baseline at {args.baseline}; run with --write-baseline first")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,109 @@
+"""Startup benchmark: how fast a fresh server process serves its first page.
+
+    python -m bench.startup                  # 3 cold starts, print medians
+    python -m bench.startup --repeat 5 --json startup.json
+
+Every sample runs in a new interpreter, so nothing is already imported or cached:
+- import: cold `import <module>` time for each heavy dependency, one process per module;
+- first render: the app's first AppTest run, which pays for imports, get_storage()
+  and init_db(). The warm rerun after it is the steady-state cost of a page;
+- loaded: which heavy modules the first render pulled in. Modules that load
+  on first use (Gemini, PIL, bcrypt) should not be in this list.
+
+The database comes from bench.harness (BENCH_DB_BACKEND=sqlite needs no server).
+The fake LLM is not installed, so a first render that imports Gemini shows up
+under "loaded".
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+HEAVY_MODULES = ("streamlit", "google.generativeai", "PIL.Image", "bcrypt", "mysql.connector", "requests",
+                 "streamlit.components.v1")
+
+
+def import_time(module):
+    """Seconds for `import module` in a fresh interpreter; None if it is not installed"""
+    code = f"import time; t = time.perf_counter(); import {module}; print(time.perf_counter() - t)"
+    proc = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+    return float(proc.stdout) if proc.returncode == 0 else None
+
+
+def _first_render():
+    """Child process: time the first and a warm AppTest run; prints one JSON line"""
+    from bench import harness
+    secrets = harness.bench_secrets()
+    harness.prepare(secrets, fake_llm=False)
+    start = time.perf_counter()
+    at = harness.new_app(secrets)
+    setup_s = time.perf_counter() - start
+    start = time.perf_counter()
+    at.run()
+    first_s = time.perf_counter() - start
+    loaded = [m for m in HEAVY_MODULES if m in sys.modules]
+    start = time.perf_counter()
+    at.run()
+    warm_s = time.perf_counter() - start
+    error = str(at.exception[0].value) if at.exception else None
+    print(json.dumps({"setup_s": setup_s, "first_render_s": first_s, "warm_render_s": warm_s,
+                      "loaded": loaded, "error": error}))
+
+
+def first_render():
+    proc = subprocess.run([sys.executable, "-m", "bench.startup", "--child"], capture_output=True, text=True)
+    if proc.returncode != 0:
+        return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else f"exit {proc.returncode}"}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def run(repeat):
+    imports = {}
+    for module in HEAVY_MODULES:
+        times = [import_time(module) for _ in range(repeat)]
+        imports[module] = statistics.median(times) * 1000 if None not in times else None
+    renders = [first_render() for _ in range(repeat)]
+    ok = [r for r in renders if not r.get("error")]
+    report = {"import_ms": imports, "errors": [r["error"] for r in renders if r.get("error")]}
+    if ok:
+        for field in ("setup_s", "first_render_s", "warm_render_s"):
+            report[field.replace("_s", "_ms")] = statistics.median(r[field] for r in ok) * 1000
+        report["loaded"] = sorted({m for r in ok for m in r["loaded"]})
+    return report
+
+
+def print_report(report):
+    print(f"{'module':<26}{'import ms':>10}")
+    for module, ms in report["import_ms"].items():
+        print(f"{module:<26}{'not installed' if ms is None else f'{ms:.0f}':>10}")
+    if "first_render_ms" in report:
+        print(f"\nAppTest setup     {report['setup_ms']:>8.0f} ms")
+        print(f"first render      {report['first_render_ms']:>8.0f} ms")
+        print(f"warm rerun        {report['warm_render_ms']:>8.0f} ms")
+        print(f"loaded at first render: {', '.join(report['loaded']) or '-'}")
+    for error in report["errors"]:
+        print(f"ERROR {error}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=3, help="cold starts per measurement")
+    parser.add_argument("--json", help="also write the report to this file")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        _first_render()
+        return 0
+
+    report = run(args.repeat)
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return 1 if report["errors"] and "first_render_ms" not in report else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
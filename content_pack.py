@@ -0,0 +1,274 @@
+"""Compiled curriculum: lesson sections and quizzes for the whole catalog, served from disk.
+
+    python content_pack.py build                        # generate what is missing or stale
+    python content_pack.py build --grades 9th 10th --difficulties Standard --jobs 8
+    python content_pack.py import lessons.jsonl         # bring in content authored elsewhere
+    python content_pack.py stats
+
+A pack lives in a directory (CONTENT_PACK_DIR, default ./content):
+- curriculum-<build>.pack holds one zlib-compressed JSON record per lesson, back to back;
+- curriculum.json is the index: {key: [offset, length, source]} plus format and build numbers.
+Keys are "course|lesson|grade|difficulty". `source` is curriculum.source_hash() of
+what the entry was generated from. A rebuild therefore regenerates only entries
+whose syllabus entry, grade, difficulty or prompt changed, and copies the rest
+byte for byte. Each build writes a new pack file and then swaps the index in
+with os.replace, so a server never reads a half-written pack.
+
+PackReader memory-maps the pack and keeps the index in a dict, so a lookup is one
+dict access, one slice and one decompress. Entries whose source no longer matches
+the catalog are misses, and the app generates those lessons live until the next build.
+
+Import lines are JSON objects with course, lesson (number), grade, difficulty,
+sections ([{"title", "content"}] x 5) and optionally quiz ({"questions": [{"q", "opts", "ans"}, ...]}).
+A malformed line stops the import with its line number.
+"""
+import argparse
+import glob
+import json
+import mmap
+import os
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import curriculum
+
+FORMAT = 1
+INDEX_NAME = "curriculum.json"
+DEFAULT_DIR = os.environ.get("CONTENT_PACK_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "content"))
+DEFAULT_MODEL = "gemini-2.0-flash"
+KEEP_BUILDS = 2     # the previous pack stays on disk for servers still reading it
+
+
+def entry_key(course, num, grade, difficulty):
+    return f"{course}|{num}|{grade}|{difficulty}"
+
+
+def load_index(pack_dir):
+    """The pack directory's index, or None if there is no (compatible) pack"""
+    try:
+        with open(os.path.join(pack_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return index if index.get("format") == FORMAT else None
+
+
+def current_source(key):
+    """source_hash() the catalog gives `key` today; None if its lesson is gone"""
+    course, num, grade, difficulty = key.split("|")
+    syllabus = curriculum.COURSE_SYLLABI.get(course, [])
+    if not num.isdigit() or not 1 <= int(num) <= len(syllabus):
+        return None
+    return curriculum.source_hash(course, syllabus[int(num) - 1], grade, difficulty)
+
+
+class PackReader:
+    """Read-only view of one build: memory-mapped records behind an in-memory index"""
+
+    def __init__(self, pack_dir, index):
+        self.build = index["build"]
+        self.entries = index["entries"]
+        self.path = os.path.join(pack_dir, index["pack"])
+        with open(self.path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b""
+
+    def __len__(self):
+        return len(self.entries)
+
+    def raw(self, key):
+        offset, length, _ = self.entries[key]
+        return self._map[offset:offset + length]
+
+    def get(self, course, num, grade, difficulty, entry):
+        """The compiled {"sections", "quiz"} for a lesson, or None if it is missing or stale"""
+        found = self.entries.get(entry_key(course, num, grade, difficulty))
+        if found is None or found[2] != curriculum.source_hash(course, entry, grade, difficulty):
+            return None
+        offset, length, _ = found
+        return json.loads(zlib.decompress(self._map[offset:offset + length]))
+
+    def close(self):
+        if isinstance(self._map, mmap.mmap):
+            self._map.close()
+
+
+def open_pack(pack_dir=DEFAULT_DIR):
+    """PackReader for the current build, or None if the directory has no pack"""
+    index = load_index(pack_dir)
+    if index is None:
+        return None
+    try:
+        return PackReader(pack_dir, index)
+    except OSError:
+        return None
+
+
+def targets(courses=None, grades=None, difficulties=None):
+    """[(key, course, num, entry, grade, difficulty)] for the selected part of the catalog"""
+    return [(entry_key(course, num, grade, difficulty), course, num, entry, grade, difficulty)
+            for course, num, entry in curriculum.lessons() if not courses or course in courses
+            for grade in grades or curriculum.GRADES
+            for difficulty in difficulties or curriculum.DIFFICULTIES]
+
+
+def compile_pack(pack_dir, todo, produce, jobs=1, log=print):
+    """Write a new build: the current build's fresh entries plus produce(target) for each target in `todo`.
+
+    A target whose produce() raises is reported and left out. The index is
+    written even if the run is interrupted, so finished entries are kept.
+    Returns (entries written, failures).
+    """
+    os.makedirs(pack_dir, exist_ok=True)
+    old = open_pack(pack_dir)
+    build = (old.build if old else 0) + 1
+    pack_name = f"curriculum-{build}.pack"
+    redo = {t[0] for t in todo}
+    entries, failures = {}, 0
+    with open(os.path.join(pack_dir, pack_name), "wb") as pack:
+        def append(key, blob, source):
+            entries[key] = [pack.tell(), len(blob), source]
+            pack.write(blob)
+
+        try:
+            if old is not None:
+                for key, (_, _, source) in old.entries.items():
+                    if key not in redo and source == current_source(key):
+                        append(key, old.raw(key), source)
+            with ThreadPoolExecutor(max_workers=max(jobs, 1)) as pool:
+                futures = {pool.submit(produce, t): t for t in todo}
+                for done, future in enumerate(as_completed(futures), 1):
+                    key, course, num, entry, grade, difficulty = futures[future]
+                    try:
+                        record = future.result()
+                    except Exception as e:
+                        failures += 1
+                        log(f"[{done}/{len(todo)}] {key}: FAILED {type(e).__name__}: {e}")
+                        continue
+                    append(key, zlib.compress(json.dumps(record).encode(), 9),
+                           curriculum.source_hash(course, entry, grade, difficulty))
+                    log(f"[{done}/{len(todo)}] {key}")
+        finally:
+            pack.flush()
+            os.fsync(pack.fileno())
+            index_path = os.path.join(pack_dir, INDEX_NAME)
+            with open(index_path + ".tmp", "w") as f:
+                json.dump({"format": FORMAT, "build": build, "pack": pack_name,
+                           "prompt_version": curriculum.PROMPT_VERSION, "entries": entries}, f)
+            os.replace(index_path + ".tmp", index_path)
+            if old is not None:
+                old.close()
+            prune(pack_dir, build)
+    return len(entries), failures
+
+
+def prune(pack_dir, build):
+    for path in glob.glob(os.path.join(pack_dir, "curriculum-*.pack")):
+        number = os.path.basename(path)[len("curriculum-"):-len(".pack")]
+        if number.isdigit() and int(number) <= build - KEEP_BUILDS:
+            os.remove(path)
+
+
+def stale(pack_dir, wanted):
+    """The wanted targets the current build lacks or has from an outdated source"""
+    index = load_index(pack_dir)
+    have = index["entries"] if index else {}
+    todo = []
+    for target in wanted:
+        key, course, _, entry, grade, difficulty = target
+        if key not in have or have[key][2] != curriculum.source_hash(course, entry, grade, difficulty):
+            todo.append(target)
+    return todo
+
+
+def gemini_generator(model_name):
+    """produce() for compile_pack that generates a lesson and its quiz with Gemini, over every configured key"""
+    import gemini_pool
+    import llm_metrics
+    from daily_rollover import load_secrets
+    secrets = load_secrets()
+    if os.environ.get("GEMINI_API_KEY"):
+        secrets["GEMINI_API_KEYS"] = [os.environ["GEMINI_API_KEY"]]
+    model = gemini_pool.from_config(secrets).model(model_name)
+
+    def produce(target):
+        _, course, num, entry, grade, difficulty = target
+        prompt = curriculum.lesson_prompt(course, entry["title"], entry["desc"], grade, difficulty)
+        resp = llm_metrics.generate(model, prompt, "compile_lesson", generation_config=curriculum.JSON_OUTPUT)
+        sections = curriculum.parse_sections(resp.text)
+        resp = llm_metrics.generate(model, curriculum.quiz_prompt(course, entry["title"], entry["desc"]), "compile_quiz")
+        quiz = curriculum.validate_quiz(curriculum.parse_json(resp.text))
+        return {"sections": sections, "quiz": quiz}
+    return produce
+
+
+def read_import(path):
+    """{key: (target, record)} from an import file, validated like generated content"""
+    by_key = {t[0]: t for t in targets()}
+    records = {}
+    with open(path) as f:
+        for line_no, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            key = entry_key(item["course"], item["lesson"], item["grade"], item["difficulty"])
+            if key not in by_key:
+                raise ValueError(f"{path}:{line_no}: {key} is not in the catalog")
+            try:
+                record = {"sections": curriculum.parse_sections(json.dumps({"sections": item["sections"]}))}
+                if item.get("quiz"):
+                    record["quiz"] = curriculum.validate_quiz(item["quiz"])
+            except ValueError as e:
+                raise ValueError(f"{path}:{line_no}: {key}: {e}") from None
+            records[key] = (by_key[key], record)
+    return records
+
+
+def print_stats(pack_dir):
+    index = load_index(pack_dir)
+    if index is None:
+        print(f"no content pack in {pack_dir}")
+        return
+    entries = index["entries"]
+    fresh = sum(source == current_source(key) for key, (_, _, source) in entries.items())
+    size = os.path.getsize(os.path.join(pack_dir, index["pack"]))
+    print(f"build {index['build']}: {len(entries)} entries ({fresh} fresh) of {len(targets())} in the catalog, "
+          f"{size / 1e6:.1f} MB")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dir", default=DEFAULT_DIR)
+    sub = parser.add_subparsers(dest="command", required=True)
+    build = sub.add_parser("build", help="generate missing and stale entries")
+    build.add_argument("--courses", nargs="+", choices=list(curriculum.COURSE_SYLLABI))
+    build.add_argument("--grades", nargs="+", choices=curriculum.GRADES)
+    build.add_argument("--difficulties", nargs="+", choices=curriculum.DIFFICULTIES)
+    build.add_argument("--jobs", type=int, default=4, help="concurrent Gemini requests")
+    build.add_argument("--model", default=DEFAULT_MODEL)
+    build.add_argument("--dry-run", action="store_true", help="only count what would be generated")
+    imp = sub.add_parser("import", help="add entries from a JSONL file")
+    imp.add_argument("path")
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    if args.command == "stats":
+        print_stats(args.dir)
+        return 0
+    if args.command == "import":
+        records = read_import(args.path)
+        written, failures = compile_pack(args.dir, [target for target, _ in records.values()],
+                                         lambda target: records[target[0]][1])
+    else:
+        todo = stale(args.dir, targets(args.courses, args.grades, args.difficulties))
+        print(f"{len(todo)} entries to generate")
+        if args.dry_run or not todo:
+            return 0
+        written, failures = compile_pack(args.dir, todo, gemini_generator(args.model), jobs=args.jobs)
+    print(f"wrote {written} entries, {failures} failed")
+    print_stats(args.dir)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
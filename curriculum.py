@@ -0,0 +1,221 @@
+"""Sorokin AI's course catalog and the prompts that turn it into lessons and quizzes.
+
+Shared by app.py (live generation) and content_pack.py (offline compilation),
+so both produce and parse lessons the same way. Bump PROMPT_VERSION when a
+prompt changes: compiled content built from the old prompt is then stale.
+"""
+import hashlib
+import json
+
+PROMPT_VERSION = 1
+GRADES = ["9th", "10th", "11th", "12th", "College"]
+DIFFICULTIES = ["Simple", "Standard", "Advanced"]
+LESSON_SECTIONS = ["Intro", "Examples", "Practice", "Common mistakes", "Summary"]
+DIFFICULTY_HINTS = {"Simple": "Explain like they're 10.", "Standard": "Grade-appropriate.", "Advanced": "Deep technical detail."}
+JSON_OUTPUT = {"response_mime_type": "application/json"}
+
+COURSE_SYLLABI = {
+    "Algebra I": [
+        {"title": "1. Variables & Expressions", "desc": "Understanding symbols, evaluating expressions."},
+        {"title": "2. Linear Equations", "desc": "Solving for X, multi-step equations."},
+        {"title": "3. Inequalities", "desc": "Graphing inequalities, compound inequalities."},
+        {"title": "4. Functions", "desc": "Domain, range, function notation."},
+        {"title": "5. Slope & Intercepts", "desc": "y=mx+b, graphing lines."},
+        {"title": "6. Systems of Equations", "desc": "Substitution, elimination."},
+        {"title": "7. Exponents", "desc": "Laws of exponents, scientific notation."},
+        {"title": "8. Polynomials", "desc": "Adding, subtracting, multiplying."},
+        {"title": "9. Factoring", "desc": "GCF, difference of squares."},
+        {"title": "10. Quadratics", "desc": "Quadratic formula, parabolas."},
+        {"title": "11. Statistics", "desc": "Mean, median, mode."},
+        {"title": "12. Final Review", "desc": "Comprehensive review."}
+    ],
+    "Geometry": [
+        {"title": "1. Points & Lines", "desc": "Foundations of geometry."},
+        {"title": "2. Proofs", "desc": "Two-column proofs."},
+        {"title": "3. Parallel Lines", "desc": "Transversals, angle pairs."},
+        {"title": "4. Triangles", "desc": "SSS, SAS, ASA postulates."},
+        {"title": "5. Triangle Properties", "desc": "Bisectors, medians."},
+        {"title": "6. Polygons", "desc": "Interior angles, parallelograms."},
+        {"title": "7. Similarity", "desc": "Ratios, similar triangles."},
+        {"title": "8. Right Triangles", "desc": "Pythagorean theorem."},
+        {"title": "9. Circles", "desc": "Tangents, arcs, chords."},
+        {"title": "10. Area", "desc": "Area of polygons."},
+        {"title": "11. Volume", "desc": "Prisms, cylinders, spheres."},
+        {"title": "12. Transformations", "desc": "Reflections, rotations."},
+        {"title": "13. Circle Equations", "desc": "Equation of a circle."},
+        {"title": "14. Final Review", "desc": "Comprehensive review."}
+    ],
+    "Algebra II": [
+        {"title": "1. Linear Review", "desc": "Absolute value, piecewise."},
+        {"title": "2. Quadratics", "desc": "Completing the square."},
+        {"title": "3. Complex Numbers", "desc": "Imaginary numbers."},
+        {"title": "4. Polynomials", "desc": "Synthetic division."},
+        {"title": "5. Radicals", "desc": "Rational exponents."},
+        {"title": "6. Exponentials", "desc": "Growth and decay."},
+        {"title": "7. Logarithms", "desc": "Log properties."},
+        {"title": "8. Rational Functions", "desc": "Asymptotes."},
+        {"title": "9. Sequences", "desc": "Arithmetic, geometric."},
+        {"title": "10. Conics", "desc": "Ellipses, hyperbolas."},
+        {"title": "11. Probability", "desc": "Combinations, permutations."},
+        {"title": "12. Trig Ratios", "desc": "SOH CAH TOA."},
+        {"title": "13. Trig Graphs", "desc": "Sine, cosine waves."},
+        {"title": "14. Identities", "desc": "Trig identities."},
+        {"title": "15. Final Review", "desc": "Comprehensive review."}
+    ],
+    "Pre-Calculus": [
+        {"title": "1. Functions", "desc": "Parent functions."},
+        {"title": "2. Polynomials", "desc": "Zeros, end behavior."},
+        {"title": "3. Exponentials", "desc": "Logistic models."},
+        {"title": "4. Trig Functions", "desc": "Unit circle."},
+        {"title": "5. Trig Equations", "desc": "Solving trig equations."},
+        {"title": "6. Law of Sines/Cosines", "desc": "Triangle applications."},
+        {"title": "7. Matrices", "desc": "Operations, inverses."},
+        {"title": "8. Conics", "desc": "Rotated conics."},
+        {"title": "9. Sequences", "desc": "Series, induction."},
+        {"title": "10. Limits", "desc": "Intro to limits."},
+        {"title": "11. Derivatives Intro", "desc": "Rates of change."},
+        {"title": "12. Vectors", "desc": "Dot product."},
+        {"title": "13. Polar Coords", "desc": "Polar graphing."},
+        {"title": "14. Parametrics", "desc": "Parametric equations."},
+        {"title": "15. 3D Space", "desc": "3D coordinates."},
+        {"title": "16. Final Review", "desc": "Calculus prep."}
+    ],
+    "Calculus I": [
+        {"title": "1. Limits", "desc": "Limit laws, continuity."},
+        {"title": "2. Continuity", "desc": "IVT, discontinuities."},
+        {"title": "3. Derivatives", "desc": "Definition as limit."},
+        {"title": "4. Diff Rules", "desc": "Power, product, quotient."},
+        {"title": "5. Chain Rule", "desc": "Composite functions."},
+        {"title": "6. Implicit Diff", "desc": "Implicit differentiation."},
+        {"title": "7. Applications", "desc": "Linear approximation."},
+        {"title": "8. Optimization", "desc": "Max/min problems."},
+        {"title": "9. Related Rates", "desc": "Rate problems."},
+        {"title": "10. Antiderivatives", "desc": "Indefinite integrals."},
+        {"title": "11. Riemann Sums", "desc": "Area estimation."},
+        {"title": "12. Definite Integrals", "desc": "Area accumulation."},
+        {"title": "13. FTC", "desc": "Fundamental theorem."},
+        {"title": "14. Substitution", "desc": "u-substitution."},
+        {"title": "15. Area", "desc": "Area between curves."},
+        {"title": "16. Volume", "desc": "Disk/washer methods."},
+        {"title": "17. Diff Equations", "desc": "Separation of variables."},
+        {"title": "18. Final Review", "desc": "Comprehensive review."}
+    ],
+    "Biology": [
+        {"title": "1. Scientific Method", "desc": "Characteristics of life."},
+        {"title": "2. Chemistry of Life", "desc": "Macromolecules."},
+        {"title": "3. Cells", "desc": "Prokaryotes, eukaryotes."},
+        {"title": "4. Photosynthesis", "desc": "Light reactions, Calvin cycle."},
+        {"title": "5. Respiration", "desc": "Glycolysis, Krebs, ETC."},
+        {"title": "6. Mitosis", "desc": "Cell cycle."},
+        {"title": "7. Meiosis", "desc": "Genetic variation."},
+        {"title": "8. Genetics", "desc": "Punnett squares."},
+        {"title": "9. DNA", "desc": "Replication, transcription."},
+        {"title": "10. Evolution", "desc": "Natural selection."},
+        {"title": "11. Ecology", "desc": "Ecosystems, food webs."},
+        {"title": "12. Classification", "desc": "Taxonomy."},
+        {"title": "13. Human Systems", "desc": "Organ systems."},
+        {"title": "14. Final Review", "desc": "Comprehensive review."}
+    ],
+    "Chemistry": [
+        {"title": "1. Matter", "desc": "States, changes."},
+        {"title": "2. Atoms", "desc": "Subatomic particles."},
+        {"title": "3. Periodic Table", "desc": "Trends."},
+        {"title": "4. Bonding", "desc": "Ionic, covalent."},
+        {"title": "5. Nomenclature", "desc": "Naming compounds."},
+        {"title": "6. The Mole", "desc": "Avogadro's number."},
+        {"title": "7. Reactions", "desc": "Balancing equations."},
+        {"title": "8. Stoichiometry", "desc": "Limiting reactants."},
+        {"title": "9. States of Matter", "desc": "IMF, phase diagrams."},
+        {"title": "10. Gases", "desc": "Ideal gas law."},
+        {"title": "11. Solutions", "desc": "Molarity, solubility."},
+        {"title": "12. Thermochemistry", "desc": "Enthalpy, entropy."},
+        {"title": "13. Kinetics", "desc": "Rate laws."},
+        {"title": "14. Acids/Bases", "desc": "pH, titrations."},
+        {"title": "15. Redox", "desc": "Oxidation-reduction."},
+        {"title": "16. Nuclear", "desc": "Radioactive decay."}
+    ],
+    "Physics": [
+        {"title": "1. Kinematics 1D", "desc": "Velocity, acceleration."},
+        {"title": "2. Vectors", "desc": "Components, addition."},
+        {"title": "3. Kinematics 2D", "desc": "Projectile motion."},
+        {"title": "4. Newton's Laws", "desc": "F=ma."},
+        {"title": "5. Friction", "desc": "Static, kinetic."},
+        {"title": "6. Work & Energy", "desc": "KE, PE, conservation."},
+        {"title": "7. Momentum", "desc": "Impulse, collisions."},
+        {"title": "8. Circular Motion", "desc": "Centripetal force."},
+        {"title": "9. Rotation", "desc": "Torque."},
+        {"title": "10. Equilibrium", "desc": "Statics."},
+        {"title": "11. Fluids", "desc": "Buoyancy, Bernoulli."},
+        {"title": "12. Thermodynamics", "desc": "Heat, laws."},
+        {"title": "13. Waves", "desc": "Frequency, wavelength."},
+        {"title": "14. Sound", "desc": "Resonance."},
+        {"title": "15. Light", "desc": "Optics."}
+    ],
+    "Intro to Python": [
+        {"title": "1. Variables", "desc": "Strings, integers, floats."},
+        {"title": "2. Data Types", "desc": "Type casting."},
+        {"title": "3. Conditionals", "desc": "If/else, booleans."},
+        {"title": "4. Loops", "desc": "For, while loops."},
+        {"title": "5. Functions", "desc": "Def, return."},
+        {"title": "6. Lists", "desc": "Indexing, slicing."},
+        {"title": "7. Dictionaries", "desc": "Key-value pairs."},
+        {"title": "8. File I/O", "desc": "Reading, writing files."},
+        {"title": "9. Libraries", "desc": "Importing modules."},
+        {"title": "10. Final Project", "desc": "Build something!"}
+    ]
+}
+
+
+def lessons():
+    """(course, lesson number, syllabus entry) for the whole catalog"""
+    for course, syllabus in COURSE_SYLLABI.items():
+        for num, entry in enumerate(syllabus, 1):
+            yield course, num, entry
+
+
+def lesson_prompt(course, title, desc, grade, difficulty):
+    outline = ", ".join(f"{i}-{name}" for i, name in enumerate(LESSON_SECTIONS, 1))
+    return f"""Teach {course} - {title} to a {grade} student.
+Topic: {desc}. Difficulty: {difficulty}. {DIFFICULTY_HINTS.get(difficulty, '')}
+Write the whole lesson as {len(LESSON_SECTIONS)} sections that build on each other: {outline}.
+Include worked examples and a practice problem. Use emojis!
+Return ONLY JSON: {{"sections":[{{"title":"section title","content":"markdown"}}]}} with the sections in that order."""
+
+
+def quiz_prompt(course, title, desc):
+    return f"""Generate 5 multiple choice questions for: {course} - {title} ({desc})
+Return ONLY JSON: {{"questions":[{{"q":"question","opts":["A)...","B)...","C)...","D)..."],"ans":0,"why":"explanation"}}]}}"""
+
+
+def parse_json(txt):
+    """JSON from a model reply, tolerating a ``` fence around it"""
+    txt = txt.strip()
+    if txt.startswith("```"):
+        txt = txt.split("```")[1].replace("json", "", 1).strip()
+    return json.loads(txt)
+
+
+def parse_sections(txt):
+    """[{"title", "content"}] x 5 from the lesson JSON; ValueError if it is malformed"""
+    sections = parse_json(txt).get("sections") or []
+    if len(sections) != len(LESSON_SECTIONS) or not all(isinstance(x, dict) and x.get("content") for x in sections):
+        raise ValueError(f"lesson has {len(sections)} usable sections, expected {len(LESSON_SECTIONS)}")
+    return [{"title": x.get("title") or name, "content": x["content"]} for x, name in zip(sections, LESSON_SECTIONS)]
+
+
+def validate_quiz(quiz):
+    """`quiz` if it is {"questions": [{"q", "opts", "ans"}, ...]} as render_quiz() expects; ValueError otherwise"""
+    questions = quiz.get("questions") if isinstance(quiz, dict) else None
+    if not isinstance(questions, list) or not questions:
+        raise ValueError("quiz has no questions")
+    for i, q in enumerate(questions, 1):
+        if not (isinstance(q, dict) and isinstance(q.get("q"), str) and isinstance(q.get("opts"), list) and q["opts"]
+                and isinstance(q.get("ans"), int) and not isinstance(q["ans"], bool) and 0 <= q["ans"] < len(q["opts"])):
+            raise ValueError(f"quiz question {i} needs q (text), opts (a non-empty list) and ans (an index into opts)")
+    return quiz
+
+
+def source_hash(course, entry, grade, difficulty):
+    """Fingerprint of everything a compiled lesson was generated from"""
+    key = json.dumps([PROMPT_VERSION, course, entry["title"], entry["desc"], grade, difficulty])
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
@@ -0,0 +1,60 @@
+"""Daily rollover for Sorokin AI's per-day counters.
+
+Zeroes flash/pro usage and daily lesson progress for every user whose day
+(last_active_date) is stale, in one set-based UPDATE. Run it once a day
+shortly after midnight, e.g. from cron:
+
+    5 0 * * *  cd /app && python daily_rollover.py
+
+The app resets a user lazily at login or on the first rerun after midnight,
+so a missed run only costs a few per-user writes, never wrong numbers.
+The same run deletes weekly leaderboards older than LEADERBOARD_KEEP_WEEKS;
+the app only shows the current week.
+Credentials (and DB_BACKEND) come from .streamlit/secrets.toml, overridable
+by environment variables of the same names.
+"""
+import os
+import sys
+import tomllib
+from datetime import date, datetime, timedelta
+
+import storage
+
+SECRETS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".streamlit", "secrets.toml")
+LEADERBOARD_KEEP_WEEKS = 4
+
+
+def load_secrets():
+    secrets = {}
+    if os.path.exists(SECRETS_PATH):
+        with open(SECRETS_PATH, "rb") as f:
+            secrets = tomllib.load(f)
+    for key in ("DB_BACKEND", "SQLITE_PATH", "DB_HOST", "DB_PORT", "DB_USER", "DB_PASSWORD", "DB_NAME"):
+        if os.environ.get(key):
+            secrets[key] = os.environ[key]
+    return secrets
+
+
+def rollover(store, today=None):
+    """Zero the daily counters of every user whose last active day is before `today`"""
+    return store.usage.rollover_all(today or datetime.now().strftime("%Y-%m-%d"))
+
+
+def prune_leaderboards(store, today=None):
+    """Delete the weekly boards before the last LEADERBOARD_KEEP_WEEKS weeks (the app's week_board() names)"""
+    day = date.fromisoformat(today) if today else date.today()
+    year, week, _ = (day - timedelta(weeks=LEADERBOARD_KEEP_WEEKS - 1)).isocalendar()
+    return store.leaderboard.prune_weeks(f"{year}-W{week:02d}")
+
+
+def main(argv):
+    today = argv[1] if len(argv) > 1 else None
+    store = storage.open_storage(load_secrets())
+    rows = rollover(store, today)
+    print(f"daily rollover: reset {rows} user(s)")
+    print(f"daily rollover: pruned {prune_leaderboards(store, today)} old weekly leaderboard row(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,250 @@
+"""Query instrumentation for Sorokin AI's database connections.
+
+get_storage() wraps every connection with instrument(), so each statement records its
+fingerprint (literals and placeholders folded to ?), duration, row count and the
+app function that issued it. Events are aggregated into three QueryStats:
+process-wide (REGISTRY), per session, and per Streamlit rerun. The app calls
+start_run() at the top of each rerun; the script thread then attributes its
+queries to that run and session. Statements slower than SLOW_QUERY_MS are logged
+and kept in a bounded slow-query log.
+"""
+import json
+import logging
+import re
+import sys
+import threading
+import time
+from collections import deque
+from functools import lru_cache
+
+log = logging.getLogger("sorokin.db")
+
+SLOW_QUERY_MS = 200
+SLOW_LOG_SIZE = 50
+RERUN_QUERY_BUDGET = 40
+
+_STRING = re.compile(r"'(?:[^'\\]|\\.)*'")
+_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_PLACEHOLDER = re.compile(r"%s|%\(\w+\)s")
+_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)(?:\s*,\s*\(\s*\?(?:\s*,\s*\?)*\s*\))*")
+_SPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=1024)
+def fingerprint(sql):
+    """Normalize a statement so calls differing only in values aggregate together"""
+    fp = _PLACEHOLDER.sub("?", _STRING.sub("?", sql))
+    fp = _NUMBER.sub("?", fp)
+    fp = _LIST.sub("(?+)", fp)
+    return _SPACE.sub(" ", fp).strip()
+
+
+class QueryStats:
+    """Thread-safe aggregate of query events keyed by fingerprint"""
+
+    def __init__(self, label=""):
+        self.label = label
+        self.started = time.time()
+        self.count = 0
+        self.total_ms = 0.0
+        self.by_fingerprint = {}
+        self._lock = threading.Lock()
+
+    def record(self, fp, caller, ms, rows):
+        with self._lock:
+            self.count += 1
+            self.total_ms += ms
+            entry = self.by_fingerprint.get(fp)
+            if entry is None:
+                entry = self.by_fingerprint[fp] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "rows": 0, "callers": {}}
+            entry["count"] += 1
+            entry["total_ms"] += ms
+            entry["max_ms"] = max(entry["max_ms"], ms)
+            entry["rows"] += rows
+            entry["callers"][caller] = entry["callers"].get(caller, 0) + 1
+
+    def top(self, n=20, key="total_ms"):
+        """[(fingerprint, entry)] sorted by `key`, heaviest first"""
+        with self._lock:
+            items = [(fp, dict(e, callers=dict(e["callers"]))) for fp, e in self.by_fingerprint.items()]
+        return sorted(items, key=lambda item: item[1][key], reverse=True)[:n]
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                "label": self.label, "started": self.started, "count": self.count,
+                "total_ms": round(self.total_ms, 3),
+                "queries": {fp: dict(e, callers=dict(e["callers"])) for fp, e in self.by_fingerprint.items()},
+            }
+
+
+REGISTRY = QueryStats("process")
+SLOW_LOG = deque(maxlen=SLOW_LOG_SIZE)
+_local = threading.local()
+
+
+def start_run(session_stats=None, label="", previous=None):
+    """Begin attributing this thread's queries to a new rerun (and the given session); returns the run's stats.
+
+    `previous` is the session's last run, checked against RERUN_QUERY_BUDGET now that it is complete.
+    """
+    if previous is not None and previous.count > RERUN_QUERY_BUDGET:
+        log.warning("rerun %s issued %d queries (budget %d)", previous.label, previous.count, RERUN_QUERY_BUDGET)
+    run = QueryStats(label)
+    _local.run, _local.session = run, session_stats
+    return run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def binding():
+    """This thread's (run, session) attribution, to hand to adopt() in a worker thread"""
+    return getattr(_local, "run", None), getattr(_local, "session", None)
+
+
+def adopt(bound):
+    """Attribute this thread's queries like the thread binding() was taken on"""
+    _local.run, _local.session = bound
+
+
+# Plumbing between the app and the cursor; a query is attributed to the first frame outside these
+_PLUMBING = (__name__, "storage", "parallel_io")
+
+
+def _is_plumbing(module):
+    return any(module == name or module.startswith(name + ".") for name in _PLUMBING)
+
+
+def _caller():
+    """Name of the first function outside the query plumbing, i.e. the app code that ran the query"""
+    frame = sys._getframe(2)
+    while frame is not None and _is_plumbing(frame.f_globals.get("__name__", "")):
+        frame = frame.f_back
+    return frame.f_code.co_name if frame is not None else "?"
+
+
+def _record(sql, ms, rows):
+    fp = fingerprint(sql if isinstance(sql, str) else sql.decode())
+    caller = _caller()
+    REGISTRY.record(fp, caller, ms, rows)
+    for stats in (getattr(_local, "run", None), getattr(_local, "session", None)):
+        if stats is not None:
+            stats.record(fp, caller, ms, rows)
+    if ms >= SLOW_QUERY_MS:
+        SLOW_LOG.append({"at": time.time(), "ms": round(ms, 3), "rows": rows, "caller": caller, "fingerprint": fp})
+        log.warning("slow query %.1fms in %s: %s", ms, caller, fp)
+
+
+class InstrumentedCursor:
+    """Cursor proxy that times execute()/executemany(); everything else is delegated"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, operation, params=None, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.execute(operation, params, *args, **kwargs)
+        finally:
+            _record(operation, (time.perf_counter() - start) * 1000, max(self._cursor.rowcount or 0, 0))
+
+    def executemany(self, operation, seq_params, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self._cursor.executemany(operation, seq_params, *args, **kwargs)
+        finally:
+            _record(operation, (time.perf_counter() - start) * 1000, max(self._cursor.rowcount or 0, 0))
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+_conn_lock = threading.Lock()
+OPEN_CONNECTIONS = 0
+PEAK_CONNECTIONS = 0
+OPENED_CONNECTIONS = 0
+
+
+def _track_connection(delta):
+    global OPEN_CONNECTIONS, PEAK_CONNECTIONS, OPENED_CONNECTIONS
+    with _conn_lock:
+        OPEN_CONNECTIONS += delta
+        PEAK_CONNECTIONS = max(PEAK_CONNECTIONS, OPEN_CONNECTIONS)
+        OPENED_CONNECTIONS += max(delta, 0)
+
+
+def connection_stats(reset_peak=False):
+    """{"open": n, "peak": high-water mark, "opened": total ever opened} of instrumented connections in this process"""
+    global PEAK_CONNECTIONS
+    with _conn_lock:
+        stats = {"open": OPEN_CONNECTIONS, "peak": PEAK_CONNECTIONS, "opened": OPENED_CONNECTIONS}
+        if reset_peak:
+            PEAK_CONNECTIONS = OPEN_CONNECTIONS
+    return stats
+
+
+class InstrumentedConnection:
+    """Connection proxy whose cursors are instrumented (buffered, so SELECT row counts are known)"""
+
+    def __init__(self, conn):
+        self._conn = conn
+        self._open = True
+        _track_connection(1)
+
+    def close(self):
+        if self._open:
+            self._open = False
+            _track_connection(-1)
+        return self._conn.close()
+
+    def __del__(self):
+        if getattr(self, "_open", False):
+            self._open = False
+            _track_connection(-1)
+
+    def cursor(self, *args, **kwargs):
+        kwargs.setdefault("buffered", True)
+        return InstrumentedCursor(self._conn.cursor(*args, **kwargs))
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def instrument(conn):
+    return InstrumentedConnection(conn)
+
+
+def to_json(*stats):
+    return json.dumps({"stats": [s.as_dict() for s in stats], "slow": list(SLOW_LOG)}, indent=2, default=str)
+
+
+def _label(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+
+def to_prometheus(stats=REGISTRY):
+    """Prometheus text exposition of an aggregate (process-wide by default)"""
+    lines = [
+        "# HELP sorokin_db_queries_total Statements executed, by fingerprint.",
+        "# TYPE sorokin_db_queries_total counter",
+    ]
+    top = stats.top(n=len(stats.by_fingerprint) or 1)
+    for fp, e in top:
+        lines.append(f'sorokin_db_queries_total{{fingerprint="{_label(fp)}"}} {e["count"]}')
+    lines += [
+        "# HELP sorokin_db_query_seconds_total Time spent in statements, by fingerprint.",
+        "# TYPE sorokin_db_query_seconds_total counter",
+    ]
+    for fp, e in top:
+        lines.append(f'sorokin_db_query_seconds_total{{fingerprint="{_label(fp)}"}} {e["total_ms"] / 1000:.6f}')
+    lines += [
+        "# HELP sorokin_db_slow_queries Slow statements currently in the log.",
+        "# TYPE sorokin_db_slow_queries gauge",
+        f"sorokin_db_slow_queries {len(SLOW_LOG)}",
+    ]
+    return "\n".join(lines) + "\n"
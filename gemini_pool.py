@@ -0,0 +1,246 @@
+"""Gemini API key pool: spread model calls over several keys and their rate limits.
+
+    pool = gemini_pool.from_config(st.secrets)
+    model = pool.model("gemini-2.0-flash")        # drop-in for genai.GenerativeModel(...)
+    llm_metrics.generate(model, prompt, "chat")
+
+Configure keys with GEMINI_API_KEYS, a list whose items are either key strings
+or tables with per-key settings:
+
+    GEMINI_API_KEYS = [
+        "AIza...first",
+        { key = "AIza...second", weight = 2, rpm = { "gemini-2.0-flash" = 30, "gemini-2.0-pro" = 2 } },
+    ]
+
+A single GEMINI_API_KEY still works: it becomes a pool of one.
+
+Each call leases a key for its model. The lease goes to the key with the fewest
+calls in the last minute relative to its weight (a weighted round robin), and
+ties go to the key that was throttled longest ago. Keys are skipped while either:
+- their `rpm` quota for the model is used up for the current minute, or
+- they are parked after a quota error.
+A quota error (HTTP 429 / ResourceExhausted) parks the key for that model with
+exponential backoff, from PARK_BASE_S up to PARK_MAX_S. The call is then retried
+on the next key. When every key is parked or out of quota, the call goes to the
+key that frees up first rather than failing outright.
+
+google.generativeai configures one global key, and a GenerativeModel keeps the
+client it was first called with. So each key's first call for a model runs with
+genai.configure(api_key=...) under a lock, and the model is kept on the key for
+later calls, which need no lock.
+
+A streamed call (stream=True) can raise its quota error while it is iterated,
+after generate_content() has returned. So the pool reads the first chunk itself:
+an error before it fails over to the next key like a failed call, and an error
+later in the stream still marks the key.
+"""
+import itertools
+import threading
+import time
+from collections import deque
+
+WINDOW_S = 60.0
+PARK_BASE_S = 5.0
+PARK_MAX_S = 300.0
+
+
+def is_quota_error(exc):
+    """True for rate-limit / quota exhaustion errors from the Gemini API"""
+    if type(exc).__name__ in ("ResourceExhausted", "TooManyRequests"):
+        return True
+    return getattr(exc, "code", None) == 429 or "429" in str(exc)[:40]
+
+
+def label(secret):
+    """A key's display name: never more than its last four characters"""
+    return f"…{secret[-4:]}" if len(secret) > 4 else "…"
+
+
+class ApiKey:
+    """One API key's settings, generative client and usage counters"""
+
+    def __init__(self, secret, weight=1.0, rpm=None):
+        self.secret = secret
+        self.label = label(secret)
+        self.weight = max(float(weight), 0.01)
+        self.rpm = dict(rpm or {})
+        self.models = {}            # (model, settings) -> GenerativeModel bound to this key
+        self.recent = {}            # model -> deque of call start times within WINDOW_S
+        self.parked_until = {}      # model -> monotonic time the key may be used again
+        self.strikes = {}           # model -> consecutive quota errors
+        self.last_throttled = float("-inf")
+        self.calls = self.errors = self.throttles = 0
+
+    def in_window(self, model, now):
+        window = self.recent.setdefault(model, deque())
+        while window and now - window[0] >= WINDOW_S:
+            window.popleft()
+        return len(window)
+
+    def free_at(self, model, now):
+        """Monotonic time this key can next take a call for `model` (now if it can already)"""
+        at = max(now, self.parked_until.get(model, 0.0))
+        limit = self.rpm.get(model)
+        if limit is not None and self.in_window(model, now) >= limit:
+            at = max(at, self.recent[model][-limit] + WINDOW_S)
+        return at
+
+
+class GeminiPool:
+    def __init__(self, keys):
+        if not keys:
+            raise ValueError("no Gemini API keys configured (GEMINI_API_KEYS or GEMINI_API_KEY)")
+        self.keys = keys
+        self._lock = threading.Lock()
+        self._configure_lock = threading.Lock()
+        self._genai = None
+
+    def _module(self):
+        """google.generativeai, imported on first use"""
+        with self._lock:
+            if self._genai is None:
+                import google.generativeai as genai
+                self._genai = genai
+        return self._genai
+
+    def warm(self):
+        """Import the client library now rather than on the first call"""
+        self._module()
+
+    def model(self, name, **kwargs):
+        """A GenerativeModel stand-in whose calls are spread over the pool"""
+        self._module()
+        return PooledModel(self, name, kwargs)
+
+    def acquire(self, model, exclude=()):
+        """Lease the best key for one call to `model` and count the call against it"""
+        now = time.monotonic()
+        with self._lock:
+            keys = [k for k in self.keys if k not in exclude] or self.keys
+            ready = [k for k in keys if k.free_at(model, now) <= now]
+            if ready:
+                key = min(ready, key=lambda k: (k.in_window(model, now) / k.weight, k.last_throttled))
+            else:
+                key = min(keys, key=lambda k: k.free_at(model, now))
+            key.recent.setdefault(model, deque()).append(now)
+            key.calls += 1
+        return key
+
+    def succeeded(self, key, model):
+        with self._lock:
+            key.strikes.pop(model, None)
+
+    def failed(self, key, model, exc):
+        """Record a failed call; quota errors park the key for `model` with backoff"""
+        with self._lock:
+            key.errors += 1
+            if not is_quota_error(exc):
+                return
+            key.throttles += 1
+            strikes = key.strikes[model] = key.strikes.get(model, 0) + 1
+            now = time.monotonic()
+            key.last_throttled = now
+            key.parked_until[model] = now + min(PARK_BASE_S * 2 ** (strikes - 1), PARK_MAX_S)
+
+    def report(self):
+        """Per-key utilization: calls, errors, throttles, and per model the last minute's calls, quota and parking"""
+        now = time.monotonic()
+        with self._lock:
+            rows = []
+            for key in self.keys:
+                models = {}
+                for model in sorted(set(key.recent) | set(key.rpm) | set(key.parked_until)):
+                    used, quota = key.in_window(model, now), key.rpm.get(model)
+                    models[model] = {
+                        "last_minute": used, "rpm": quota,
+                        "utilization": round(used / quota, 3) if quota else None,
+                        "parked_s": round(max(key.parked_until.get(model, now) - now, 0.0), 1),
+                    }
+                rows.append({"key": key.label, "weight": key.weight, "calls": key.calls, "errors": key.errors,
+                             "throttles": key.throttles, "models": models})
+        return rows
+
+
+class PooledModel:
+    """generate_content() on a leased key, retried on the next key after a quota error"""
+
+    def __init__(self, pool, name, kwargs):
+        self.pool = pool
+        self.name = name
+        self.model_name = f"models/{name}"
+        self._kwargs = kwargs
+        self._settings = (name, repr(sorted(kwargs.items())))
+
+    def _call(self, key, contents, kwargs):
+        """generate_content() with `key`'s model, binding one under the configure lock on first use"""
+        model = key.models.get(self._settings)
+        if model is not None:
+            return model.generate_content(contents, **kwargs)
+        genai = self.pool._module()
+        with self.pool._configure_lock:
+            genai.configure(api_key=key.secret)
+            model = genai.GenerativeModel(self.name, **self._kwargs)
+            resp = model.generate_content(contents, **kwargs)
+        key.models[self._settings] = model
+        return resp
+
+    def generate_content(self, contents, **kwargs):
+        tried = set()
+        while True:
+            key = self.pool.acquire(self.name, exclude=tried)
+            try:
+                resp = self._call(key, contents, kwargs)
+                if kwargs.get("stream"):
+                    resp = PooledStream(self.pool, key, self.name, resp)
+            except Exception as e:
+                self.pool.failed(key, self.name, e)
+                tried.add(key)
+                if is_quota_error(e) and len(tried) < len(self.pool.keys):
+                    continue
+                raise
+            self.pool.succeeded(key, self.name)
+            return resp
+
+
+class PooledStream:
+    """A streamed response whose first chunk is already read; later errors still mark the key.
+
+    Anything else (text, usage_metadata, ...) is read from the wrapped response.
+    """
+
+    def __init__(self, pool, key, model, resp):
+        self._pool, self._key, self._model, self._resp = pool, key, model, resp
+        self._chunks = iter(resp)
+        self._pending = list(itertools.islice(self._chunks, 1))
+        self._live = True
+
+    def __iter__(self):
+        if not self._live:
+            yield from self._resp
+            return
+        self._live = False
+        yield from self._pending
+        try:
+            yield from self._chunks
+        except Exception as e:
+            self._pool.failed(self._key, self._model, e)
+            raise
+
+    def __getattr__(self, name):
+        return getattr(self._resp, name)
+
+
+def from_config(config):
+    """Pool over config["GEMINI_API_KEYS"], falling back to the single GEMINI_API_KEY"""
+    entries = config.get("GEMINI_API_KEYS")
+    if isinstance(entries, str):
+        entries = [k.strip() for k in entries.split(",") if k.strip()]
+    if not entries and config.get("GEMINI_API_KEY"):
+        entries = [config["GEMINI_API_KEY"]]
+    keys = []
+    for entry in entries or []:
+        if isinstance(entry, str):
+            keys.append(ApiKey(entry))
+        else:
+            keys.append(ApiKey(entry["key"], entry.get("weight", 1.0), entry.get("rpm")))
+    return GeminiPool(keys)
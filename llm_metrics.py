@@ -0,0 +1,152 @@
+"""LLM call telemetry for Sorokin AI.
+
+Every Gemini call goes through generate(), which streams the response so it can
+record time-to-first-token and total latency. It also records prompt and response
+token counts from usage_metadata, the model, the call site, cache hit/miss and
+the error class. Calls are kept in a bounded process-wide window for rolling
+percentiles and folded into a per-user, per-day rollup with estimated cost. The
+rollup keeps the last ROLLUP_DAYS days; older days are dropped as a new one starts.
+"""
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+WINDOW_SIZE = 2000
+ROLLUP_DAYS = 7
+
+# USD per 1M (prompt, response) tokens - estimates for the cost column, keep in step with MODEL_CONFIG
+PRICING_PER_1M = {
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gemini-2.0-pro": (1.25, 10.00),
+}
+
+_lock = threading.Lock()
+CALLS = deque(maxlen=WINDOW_SIZE)
+ROLLUP = {}
+_rollup_days = set()
+
+
+def _model_name(model):
+    return getattr(model, "model_name", str(model)).removeprefix("models/")
+
+
+def estimate_cost(model_name, prompt_tokens, response_tokens):
+    in_rate, out_rate = PRICING_PER_1M.get(model_name, (0.0, 0.0))
+    return (prompt_tokens * in_rate + response_tokens * out_rate) / 1_000_000
+
+
+def record(call_site, model_name, user_id=None, ttft_ms=None, latency_ms=0.0,
+           prompt_tokens=0, response_tokens=0, cache=None, error=None):
+    """Add one call to the rolling window and the per-user/per-day rollup"""
+    cost = estimate_cost(model_name, prompt_tokens, response_tokens)
+    call = {
+        "at": time.time(), "call_site": call_site, "model": model_name, "user_id": user_id,
+        "ttft_ms": ttft_ms, "latency_ms": latency_ms, "prompt_tokens": prompt_tokens,
+        "response_tokens": response_tokens, "cost_usd": cost, "cache": cache, "error": error,
+    }
+    now = datetime.now()
+    key = (user_id or "anonymous", now.strftime("%Y-%m-%d"))
+    with _lock:
+        CALLS.append(call)
+        if key[1] not in _rollup_days:
+            _prune_rollup(now)
+            _rollup_days.add(key[1])
+        day = ROLLUP.setdefault(key, {"calls": 0, "errors": 0, "cache_hits": 0,
+                                      "prompt_tokens": 0, "response_tokens": 0, "cost_usd": 0.0})
+        day["calls"] += 1
+        day["errors"] += error is not None
+        day["cache_hits"] += cache == "hit"
+        day["prompt_tokens"] += prompt_tokens
+        day["response_tokens"] += response_tokens
+        day["cost_usd"] += cost
+    return call
+
+
+def _prune_rollup(now):
+    """Drop rollup days older than ROLLUP_DAYS (caller holds _lock)"""
+    oldest = (now - timedelta(days=ROLLUP_DAYS - 1)).strftime("%Y-%m-%d")
+    for key in [key for key in ROLLUP if key[1] < oldest]:
+        del ROLLUP[key]
+    _rollup_days.difference_update([day for day in _rollup_days if day < oldest])
+
+
+def record_cache_hit(call_site, model_name, user_id=None, latency_ms=0.0):
+    """A call site answered from its cache without calling the model"""
+    return record(call_site, model_name, user_id, ttft_ms=latency_ms, latency_ms=latency_ms, cache="hit")
+
+
+def generate(model, contents, call_site, user_id=None, cache=None, **kwargs):
+    """model.generate_content(contents) with telemetry; returns the fully resolved response.
+
+    The response is streamed so the first chunk's arrival gives time-to-first-token;
+    callers read resp.text as before. Exceptions are recorded and re-raised.
+    """
+    model_name = _model_name(model)
+    start = time.perf_counter()
+    ttft_ms = None
+    try:
+        resp = model.generate_content(contents, stream=True, **kwargs)
+        for _ in resp:
+            if ttft_ms is None:
+                ttft_ms = (time.perf_counter() - start) * 1000
+    except Exception as e:
+        record(call_site, model_name, user_id, ttft_ms, (time.perf_counter() - start) * 1000,
+               cache=cache, error=type(e).__name__)
+        raise
+    usage = getattr(resp, "usage_metadata", None)
+    record(call_site, model_name, user_id, ttft_ms, (time.perf_counter() - start) * 1000,
+           getattr(usage, "prompt_token_count", 0) or 0, getattr(usage, "candidates_token_count", 0) or 0,
+           cache=cache)
+    return resp
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    idx = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summary():
+    """Rolling p50/p95/p99 latency and TTFT, token totals and error/cache rates per call site"""
+    with _lock:
+        calls = list(CALLS)
+    sites = {}
+    for call in calls:
+        sites.setdefault(call["call_site"], []).append(call)
+    out = {}
+    for site, site_calls in sorted(sites.items()):
+        latency = sorted(c["latency_ms"] for c in site_calls if c["cache"] != "hit")
+        ttft = sorted(c["ttft_ms"] for c in site_calls if c["ttft_ms"] is not None and c["cache"] != "hit")
+        errors = {}
+        for c in site_calls:
+            if c["error"]:
+                errors[c["error"]] = errors.get(c["error"], 0) + 1
+        out[site] = {
+            "calls": len(site_calls),
+            "models": sorted({c["model"] for c in site_calls}),
+            "latency_ms": {f"p{p}": _percentile(latency, p) for p in (50, 95, 99)},
+            "ttft_ms": {f"p{p}": _percentile(ttft, p) for p in (50, 95, 99)},
+            "prompt_tokens": sum(c["prompt_tokens"] for c in site_calls),
+            "response_tokens": sum(c["response_tokens"] for c in site_calls),
+            "cost_usd": round(sum(c["cost_usd"] for c in site_calls), 6),
+            "cache_hit_rate": sum(c["cache"] == "hit" for c in site_calls) / len(site_calls),
+            "errors": errors,
+        }
+    return out
+
+
+def rollup():
+    """[{user_id, day, calls, ...}] from the per-user/per-day totals"""
+    with _lock:
+        items = list(ROLLUP.items())
+    return [{"user_id": user_id, "day": day, **dict(totals, cost_usd=round(totals["cost_usd"], 6))}
+            for (user_id, day), totals in sorted(items, key=lambda item: (item[0][1], item[0][0]), reverse=True)]
+
+
+def to_json():
+    with _lock:
+        recent = list(CALLS)[-100:]
+    return json.dumps({"by_call_site": summary(), "by_user_day": rollup(), "recent": recent}, indent=2, default=str)
@@ -0,0 +1,101 @@
+"""Run a rerun's independent blocking I/O concurrently.
+
+    badges, equipped = parallel_io.gather(lambda: store.badges.list(uid),
+                                          lambda: store.pets.equipped(uid))
+
+Calls run on a shared process-wide thread pool, and gather() returns their
+results in argument order once every call has finished. Wall time therefore
+tracks the slowest call rather than the sum. If any call raises, the first
+failure in argument order is re-raised after the rest complete.
+
+Only hand it plain I/O. Workers run outside the script thread, so tasks must
+not read or write st.session_state or render anything. They may call
+st.cache_data / st.cache_resource functions declared with show_spinner=False:
+those caches are process-wide and such a call never touches the page. Each
+worker carries the caller's db_metrics attribution, so its queries still count
+toward the rerun. It also carries the Streamlit script context, which the
+caches expect, and so a connection error can still st.error().
+
+submit() is the fire-and-forget variant for side effects nobody waits on. Its
+task gets the caller's script context under the same rules, but no db_metrics
+attribution: it outlives the rerun that started it.
+"""
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import db_metrics
+
+log = logging.getLogger("sorokin.io")
+
+MAX_WORKERS = 16
+
+_pool = None
+_pool_lock = threading.Lock()
+_local = threading.local()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="parallel-io")
+        return _pool
+
+
+def _script_context():
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        return get_script_run_ctx(suppress_warning=True)
+    except Exception:
+        return None
+
+
+def _attach(ctx):
+    if ctx is not None:
+        from streamlit.runtime.scriptrunner import add_script_run_ctx
+        add_script_run_ctx(threading.current_thread(), ctx)
+
+
+def _run(fn, bound, ctx):
+    _attach(ctx)
+    db_metrics.adopt(bound)
+    _local.in_worker = True
+    try:
+        return fn()
+    finally:
+        _local.in_worker = False
+        db_metrics.adopt((None, None))
+
+
+def gather(*calls):
+    """Run zero-argument callables concurrently; returns their results in order"""
+    # One call, or a nested gather on a worker (which could starve the pool): run inline
+    if len(calls) <= 1 or getattr(_local, "in_worker", False):
+        return [fn() for fn in calls]
+    bound, ctx = db_metrics.binding(), _script_context()
+    futures = [_get_pool().submit(_run, fn, bound, ctx) for fn in calls]
+    results, error = [], None
+    for future in futures:
+        try:
+            results.append(future.result())
+        except BaseException as e:
+            results.append(None)
+            error = error or e
+    if error is not None:
+        raise error
+    return results
+
+
+def _background(fn, ctx):
+    # Not marked in_worker: a long-lived background task may still gather() onto the pool
+    _attach(ctx)
+    try:
+        fn()
+    except Exception as e:
+        log.debug("background task %s failed: %s", getattr(fn, "__name__", fn), e)
+
+
+def submit(fn):
+    """Run a zero-argument callable in the background; its result and errors are dropped"""
+    _get_pool().submit(_background, fn, _script_context())
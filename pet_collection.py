@@ -0,0 +1,105 @@
+"""The pet catalog and egg odds, shared by app.py and the tests.
+
+    pets = pet_collection.open_eggs("premium", count=10)
+    pets = pet_collection.open_eggs("premium", rng=random.Random(7))   # reproducible
+
+Each egg type gets a Walker alias table built once at import, so a roll is one
+randrange and one random() however large the catalog grows. An egg's rarity
+odds are split evenly across the pets of that rarity; the New Year egg draws
+only limited pets and every other egg only regular ones.
+"""
+import random
+
+PET_COLUMNS = ("pet_id", "name", "emoji", "rarity", "xp_multiplier", "is_limited", "limited_until", "description")
+PET_CATALOG = [dict(zip(PET_COLUMNS, row)) for row in [
+    # Common Pets (1.05x)
+    ('whiskers', 'Whiskers', '🐱', 'Common', 1.050, False, None, 'A friendly cat companion'),
+    ('buddy', 'Buddy', '🐶', 'Common', 1.050, False, None, 'Loyal dog friend'),
+    ('nibbles', 'Nibbles', '🐹', 'Common', 1.050, False, None, 'Energetic hamster'),
+    ('hoppy', 'Hoppy', '🐰', 'Common', 1.050, False, None, 'Bouncy bunny'),
+    ('shelly', 'Shelly', '🐢', 'Common', 1.050, False, None, 'Wise turtle'),
+    ('bubbles', 'Bubbles', '🐟', 'Common', 1.050, False, None, 'Cheerful fish'),
+
+    # Uncommon Pets (1.10x)
+    ('ember', 'Ember', '🦊', 'Uncommon', 1.100, False, None, 'Clever fox with fiery spirit'),
+    ('hoot', 'Hoot', '🦉', 'Uncommon', 1.100, False, None, 'Wise night owl'),
+    ('scales', 'Scales', '🦎', 'Uncommon', 1.100, False, None, 'Agile lizard'),
+    ('bamboo', 'Bamboo', '🐼', 'Uncommon', 1.100, False, None, 'Peaceful panda'),
+    ('spike', 'Spike', '🦔', 'Uncommon', 1.100, False, None, 'Spiky hedgehog'),
+    ('eucaly', 'Eucaly', '🐨', 'Uncommon', 1.100, False, None, 'Sleepy koala'),
+
+    # Rare Pets (1.20x)
+    ('leo', 'Leo', '🦁', 'Rare', 1.200, False, None, 'Majestic lion'),
+    ('shadow', 'Shadow', '🐺', 'Rare', 1.200, False, None, 'Mysterious wolf'),
+    ('storm', 'Storm', '🦅', 'Rare', 1.200, False, None, 'Soaring eagle'),
+    ('wave', 'Wave', '🐬', 'Rare', 1.200, False, None, 'Playful dolphin'),
+    ('coral', 'Coral', '🦩', 'Rare', 1.200, False, None, 'Elegant flamingo'),
+    ('flutter', 'Flutter', '🦋', 'Rare', 1.200, False, None, 'Graceful butterfly'),
+
+    # Epic Pets (1.35x)
+    ('sparkle', 'Sparkle', '🦄', 'Epic', 1.350, False, None, 'Magical unicorn'),
+    ('blaze', 'Blaze', '🐉', 'Epic', 1.350, False, None, 'Fierce dragon'),
+    ('prism', 'Prism', '🦚', 'Epic', 1.350, False, None, 'Dazzling peacock'),
+    ('ink', 'Ink', '🐙', 'Epic', 1.350, False, None, 'Intelligent octopus'),
+    ('fang', 'Fang', '🦈', 'Epic', 1.350, False, None, 'Fearsome shark'),
+
+    # Legendary Pets (1.50x)
+    ('celeste', 'Celeste', '🌟', 'Legendary', 1.500, False, None, 'Celestial star spirit'),
+    ('phoenix', 'Phoenix', '🔥', 'Legendary', 1.500, False, None, 'Immortal fire bird'),
+    ('frost', 'Frost', '❄️', 'Legendary', 1.500, False, None, 'Eternal ice dragon'),
+    ('thunder', 'Thunder', '⚡', 'Legendary', 1.500, False, None, 'Storm beast'),
+    ('aurora', 'Aurora', '🌈', 'Legendary', 1.500, False, None, 'Rainbow serpent'),
+
+    # New Year Limited Pets
+    ('sparkler', 'Sparkler', '🎆', 'Rare', 1.200, True, '2025-01-05 00:00:00', 'New Year firework creature'),
+    ('confetti', 'Confetti', '🎊', 'Epic', 1.350, True, '2025-01-05 00:00:00', 'Party spirit'),
+    ('midnight', 'Midnight', '🎇', 'Legendary', 1.500, True, '2025-01-05 00:00:00', 'Clock guardian'),
+]]
+PETS_BY_ID = {p['pet_id']: p for p in PET_CATALOG}
+
+EGG_COSTS = {'common': 50, 'premium': 150, 'legendary': 500, 'newyear': 200}
+EGG_ODDS = {
+    'common': {'Common': 70, 'Uncommon': 25, 'Rare': 5},
+    'premium': {'Common': 40, 'Uncommon': 40, 'Rare': 15, 'Epic': 5},
+    'legendary': {'Uncommon': 30, 'Rare': 45, 'Epic': 20, 'Legendary': 5},
+    'newyear': {'Rare': 50, 'Epic': 35, 'Legendary': 15}
+}
+
+def build_alias_table(weighted):
+    """Walker alias table over [(item, weight), ...] for O(1) sampling"""
+    n = len(weighted)
+    total = sum(w for _, w in weighted)
+    scaled = [w * n / total for _, w in weighted]
+    prob, alias = [1.0] * n, list(range(n))
+    small = [i for i, p in enumerate(scaled) if p < 1.0]
+    large = [i for i, p in enumerate(scaled) if p >= 1.0]
+    while small and large:
+        s, l = small.pop(), large.pop()
+        prob[s], alias[s] = scaled[s], l
+        scaled[l] -= 1.0 - scaled[s]
+        (small if scaled[l] < 1.0 else large).append(l)
+    return [item for item, _ in weighted], prob, alias
+
+def build_egg_tables():
+    """One alias table per egg type over the static pet catalog (rarity odds split evenly per pet)"""
+    tables = {}
+    for egg_type, odds in EGG_ODDS.items():
+        limited = egg_type == 'newyear'
+        weighted = []
+        for rarity, chance in odds.items():
+            pool = [p for p in PET_CATALOG if p['rarity'] == rarity and p['is_limited'] == limited]
+            weighted += [(p, chance / len(pool)) for p in pool]
+        tables[egg_type] = build_alias_table(weighted)
+    return tables
+
+EGG_TABLES = build_egg_tables()
+
+def open_eggs(egg_type, count=1, rng=None):
+    """Roll `count` pets for an egg type; pass a seeded random.Random for reproducible rolls"""
+    rng = rng or random
+    items, prob, alias = EGG_TABLES.get(egg_type, EGG_TABLES['common'])
+    pets = []
+    for _ in range(count):
+        i = rng.randrange(len(items))
+        pets.append(items[i] if rng.random() < prob[i] else items[alias[i]])
+    return pets
@@ -0,0 +1,166 @@
+"""Lightweight per-rerun profiling for Sorokin AI.
+
+app.py is one flat script, so its top-level sections are timed with marks rather
+than with blocks: mark("5. DATABASE CONNECTION") closes the running section span
+and opens the next one, and end_run() closes the last. Key functions are wrapped
+with @timed. Span durations go into bounded process-wide windows for rolling
+p50/p95 reports. A run can also be profiled with cProfile, which is opt-in per
+session because it slows the run down several times.
+
+A rerun cut short by st.rerun() or st.stop() never reaches end_run(). Its open
+section span has no end time, so the next start_run() drops it and flags the run
+as interrupted.
+
+Only one run in the process is profiled at a time. From Python 3.12 cProfile
+sits on the process-global sys.monitoring, so a second profiler can't start
+(and the one running also sees every other thread's calls). A run that asks for
+a profile while another holds it records PROFILE_BUSY instead. A profiled run
+whose session never reran is released after PROFILE_MAX_S.
+"""
+import cProfile
+import io
+import pstats
+import threading
+import time
+from collections import deque
+from functools import wraps
+
+WINDOW_SIZE = 500
+PROFILE_LINES = 40
+PROFILE_MAX_S = 60.0
+PROFILE_BUSY = "profiler busy: another rerun is being profiled"
+
+_lock = threading.Lock()
+SPANS = {}
+_local = threading.local()
+_profiler_lock = threading.Lock()
+_profiling = None       # the Run holding the process's one profiler
+
+
+class Run:
+    """Spans of one rerun, in the order they finished"""
+
+    def __init__(self, profile=False):
+        self.started = time.perf_counter()
+        self.spans = []
+        self.section = None
+        self.section_start = None
+        self.ended = False
+        self.interrupted = False
+        self.total_ms = None
+        self.profile_text = None
+        self.profile_error = None
+        self._profiler = None
+        if profile:
+            self._start_profiler()
+
+    def _start_profiler(self):
+        global _profiling
+        holder = _profiling
+        if holder is not None and time.perf_counter() - holder.started > PROFILE_MAX_S:
+            holder.interrupted = holder.ended = True
+            holder._stop_profiler()
+        with _profiler_lock:
+            if _profiling is not None:
+                self.profile_error = PROFILE_BUSY
+                return
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError as e:     # another profiling tool (a debugger, coverage) holds sys.monitoring
+                self.profile_error = f"profiler busy: {e}"
+                return
+            self._profiler, _profiling = profiler, self
+
+    def _stop_profiler(self):
+        global _profiling
+        with _profiler_lock:
+            profiler, self._profiler = self._profiler, None
+            if _profiling is self:
+                _profiling = None
+            if profiler is None:
+                return
+            profiler.disable()
+        out = io.StringIO()
+        pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(PROFILE_LINES)
+        self.profile_text = out.getvalue()
+
+
+def _observe(name, ms):
+    with _lock:
+        window = SPANS.get(name)
+        if window is None:
+            window = SPANS[name] = deque(maxlen=WINDOW_SIZE)
+        window.append(ms)
+    run = getattr(_local, "run", None)
+    if run is not None and not run.ended:
+        run.spans.append((name, ms))
+
+
+def start_run(previous=None, profile=False):
+    """Begin timing a rerun; `previous` is the session's last Run, closed out if it was cut short"""
+    if previous is not None and not previous.ended:
+        previous.interrupted = previous.ended = True
+        previous._stop_profiler()
+    run = _local.run = Run(profile)
+    return run
+
+
+def current_run():
+    return getattr(_local, "run", None)
+
+
+def mark(section):
+    """End the running top-level section span and start `section`"""
+    run = current_run()
+    if run is None or run.ended:
+        return
+    now = time.perf_counter()
+    if run.section is not None:
+        _observe(run.section, (now - run.section_start) * 1000)
+    run.section, run.section_start = section, now
+
+
+def end_run():
+    """Close the last section, record the rerun total and stop the profiler (call before st.stop())"""
+    run = current_run()
+    if run is None or run.ended:
+        return run
+    mark(None)
+    run.total_ms = (time.perf_counter() - run.started) * 1000
+    _observe("rerun", run.total_ms)
+    run.ended = True
+    run._stop_profiler()
+    return run
+
+
+def timed(name=None):
+    """Decorator recording each call of a function as a span (default name: fn:<function name>)"""
+    def decorate(fn):
+        label = name or f"fn:{fn.__name__}"
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                _observe(label, (time.perf_counter() - start) * 1000)
+        return wrapper
+    return decorate
+
+
+def _percentile(sorted_values, pct):
+    idx = min(len(sorted_values) - 1, max(0, round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def report():
+    """[{span, count, mean_ms, p50_ms, p95_ms, max_ms}] over each span's rolling window, slowest p95 first"""
+    with _lock:
+        windows = {name: sorted(values) for name, values in SPANS.items() if values}
+    rows = [{
+        "span": name, "count": len(values), "mean_ms": sum(values) / len(values),
+        "p50_ms": _percentile(values, 50), "p95_ms": _percentile(values, 95), "max_ms": values[-1],
+    } for name, values in windows.items()]
+    return sorted(rows, key=lambda row: row["p95_ms"], reverse=True)
@@ -0,0 +1,221 @@
+"""Near-duplicate question cache for in-lesson Q&A.
+
+    index = qa_cache.for_lesson("algebra1", 5)
+    hit = index.lookup("whats the slope")      # Entry answered for "What is slope?", or None
+    entry = index.add(question, answer)        # after a model call
+    index.feedback(entry.id, helpful=False)    # a thumbs-down evicts it
+
+Questions are normalized before they are compared:
+- lowercased, with punctuation and apostrophes dropped;
+- function words removed and simple plurals stemmed.
+"What's the slope?" and "what is slope" both become "what slope". Only words
+that carry no meaning are dropped: question words, "mean", "explain" and
+negations stay. Identical normalized questions match through a dict. Otherwise
+MinHash signatures over character trigrams go through LSH buckets (BANDS x ROWS)
+to find candidates. A candidate matches when:
+- its numbers, question words and negations agree exactly, so "slope of y=2x+1"
+  never answers "slope of y=5x+3" and "why ..." never answers "how ...";
+- its character trigram Jaccard similarity reaches THRESHOLD;
+- its word bigram Jaccard similarity reaches ORDER_THRESHOLD. Trigrams ignore
+  word order, so "is mitosis faster than meiosis" would otherwise answer
+  "is meiosis faster than mitosis".
+Everything is local and in-process; no embedding service is involved.
+
+Each lesson keeps at most MAX_ENTRIES answers and evicts the least recently
+served. Feedback keeps a score per entry (helpful +1, unhelpful -1), and an
+entry whose score drops below zero is evicted, so one thumbs-down removes a
+fresh answer.
+"""
+import itertools
+import re
+import threading
+import zlib
+from collections import OrderedDict
+
+THRESHOLD = 0.75
+ORDER_THRESHOLD = 0.5           # word bigrams: one extra or changed word in a short question still passes
+NUM_PERM = 32
+BANDS, ROWS = 16, 2             # BANDS * ROWS == NUM_PERM; pairs above ~0.5 similarity become candidates
+MAX_ENTRIES = 300               # per lesson
+MAX_LESSONS = 2000
+
+_PRIME = (1 << 61) - 1
+_PERMS = [(1 + 2 * i * 0x9E3779B1 % _PRIME, i * 0x85EBCA77 % _PRIME) for i in range(1, NUM_PERM + 1)]
+_WORD = re.compile(r"[a-z0-9]+|[=+\-*/^<>%]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+STOPWORDS = frozenset("""a an the is are was were be been am do does did can could would should will shall may might
+i me my we you your it its this that these those of to in on for with about as at by from into and or so
+please just really""".split())
+CUES = frozenset("what how why which when where who whom not no never".split())
+
+
+def normalize(text):
+    """Singularized tokens of a question without function words, joined by spaces"""
+    words = []
+    for w in _WORD.findall(text.lower().replace("'", "").replace("’", "")):
+        if w in STOPWORDS:
+            continue
+        if len(w) > 3 and w.endswith("s") and not w.endswith("ss"):
+            w = w[:-1]
+        words.append(w)
+    return " ".join(words)
+
+
+def shingles(key):
+    """Character trigrams of a normalized question"""
+    padded = f" {key} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2)) or frozenset([padded])
+
+
+def word_pairs(key):
+    """Adjacent word pairs of a normalized question, including its first and last word, so order counts"""
+    words = ["^"] + key.split() + ["$"]
+    return frozenset(zip(words, words[1:]))
+
+
+def anchors(key):
+    """Tokens two questions must share exactly to be answered alike: numbers, question words, negations"""
+    return frozenset(_NUMBER.findall(key)) | CUES.intersection(key.split())
+
+
+def signature(grams):
+    hashes = [zlib.crc32(g.encode()) for g in grams]
+    return tuple(min((a * h + b) % _PRIME for h in hashes) for a, b in _PERMS)
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+class Entry:
+    __slots__ = ("id", "question", "answer", "key", "anchors", "grams", "pairs", "bands", "score", "hits")
+
+    def __init__(self, entry_id, question, answer, key):
+        self.id, self.question, self.answer, self.key = entry_id, question, answer, key
+        self.anchors = anchors(key)
+        self.grams = shingles(key)
+        self.pairs = word_pairs(key)
+        sig = signature(self.grams)
+        self.bands = [(band, sig[band * ROWS:(band + 1) * ROWS]) for band in range(BANDS)]
+        self.score = 0
+        self.hits = 0
+
+
+class LessonIndex:
+    """Answered questions of one lesson, searchable for near-duplicates"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()   # id -> Entry, least recently served first
+        self._by_key = {}               # normalized question -> id
+        self._buckets = {}              # (band, rows) -> {id}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, question):
+        """The cached Entry answering a near-duplicate of `question`, or None"""
+        key = normalize(question)
+        if not key:
+            return None
+        with _lock:
+            STATS["lookups"] += 1
+        with self._lock:
+            entry = self._entries.get(self._by_key.get(key))
+            if entry is None:
+                entry = self._nearest(key)
+            if entry is None:
+                return None
+            entry.hits += 1
+            self._entries.move_to_end(entry.id)
+        with _lock:
+            STATS["hits"] += 1
+        return entry
+
+    def _nearest(self, key):
+        probe = Entry(None, None, None, key)
+        candidates = set()
+        for band in probe.bands:
+            candidates |= self._buckets.get(band, set())
+        best, best_sim = None, THRESHOLD
+        for entry_id in candidates:
+            entry = self._entries[entry_id]
+            if entry.anchors != probe.anchors or jaccard(entry.pairs, probe.pairs) < ORDER_THRESHOLD:
+                continue
+            sim = jaccard(entry.grams, probe.grams)
+            if sim >= best_sim:
+                best, best_sim = entry, sim
+        return best
+
+    def add(self, question, answer):
+        """Cache a freshly generated answer; returns its Entry (None for an empty question)"""
+        key = normalize(question)
+        if not key:
+            return None
+        entry = Entry(next(_ids), question, answer, key)
+        with self._lock:
+            if key in self._by_key:
+                self._remove(self._by_key[key])
+            self._entries[entry.id] = entry
+            self._by_key[key] = entry.id
+            for band in entry.bands:
+                self._buckets.setdefault(band, set()).add(entry.id)
+            while len(self._entries) > MAX_ENTRIES:
+                self._remove(next(iter(self._entries)))
+        return entry
+
+    def feedback(self, entry_id, helpful):
+        """Score an answer; returns True if it was evicted"""
+        with self._lock:
+            entry = self._entries.get(entry_id)
+            if entry is None:
+                return False
+            entry.score += 1 if helpful else -1
+            if entry.score >= 0:
+                return False
+            self._remove(entry_id)
+        with _lock:
+            STATS["evicted"] += 1
+        return True
+
+    def _remove(self, entry_id):
+        entry = self._entries.pop(entry_id, None)
+        if entry is None:
+            return
+        if self._by_key.get(entry.key) == entry_id:
+            del self._by_key[entry.key]
+        for band in entry.bands:
+            bucket = self._buckets.get(band)
+            if bucket is not None:
+                bucket.discard(entry_id)
+                if not bucket:
+                    del self._buckets[band]
+
+
+_lock = threading.Lock()
+_ids = itertools.count(1)
+_lessons = OrderedDict()
+STATS = {"lookups": 0, "hits": 0, "evicted": 0}
+
+
+def for_lesson(course_id, lesson_num):
+    """The process-wide index for one lesson, created on first use"""
+    key = (course_id, lesson_num)
+    with _lock:
+        index = _lessons.get(key)
+        if index is None:
+            index = _lessons[key] = LessonIndex()
+            while len(_lessons) > MAX_LESSONS:
+                _lessons.popitem(last=False)
+        else:
+            _lessons.move_to_end(key)
+        return index
+
+
+def stats():
+    """{"lookups", "hits", "evicted", "lessons", "entries"} since the server started"""
+    with _lock:
+        indexes = list(_lessons.values())
+        out = dict(STATS, lessons=len(indexes))
+    out["entries"] = sum(len(i) for i in indexes)
+    return out
@@ -0,0 +1,41 @@
+"""Storage layer for Sorokin AI: repositories over a MySQL/TiDB or embedded SQLite backend.
+
+    store = open_storage(st.secrets)
+    store.users.by_username("ada")
+
+DB_BACKEND selects the backend:
+- "mysql" (default) reads DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME and DB_SSL.
+  Setting DB_REPLICA_HOST sends read-only repository calls to a read replica.
+  DB_REPLICA_PORT/USER/PASSWORD/SSL default to the primary's values.
+  DB_REPLICA_MAX_LAG_S and DB_REPLICA_STICKY_S tune the fallback (see storage.base).
+  A replica that can't report its lag counts as lagging. Set DB_REPLICA_FOLLOWER_READ=true
+  for a TiDB follower-read endpoint, which is consistent and is used without a lag check.
+  DB_POOL_SIZE caps the idle connections kept per endpoint (see storage.base).
+- "sqlite" keeps everything in the file at SQLITE_PATH (default sorokin.db), in WAL mode.
+SQLite suits a single server, local development and benchmarks.
+"""
+from storage.base import Backend, Rollback, Storage
+from storage.repositories import (BadgesRepo, ChatsRepo, LeaderboardRepo, PetsRepo, ProgressRepo, UsageRepo,
+                                  UsersRepo)
+
+BACKENDS = ("mysql", "sqlite")
+
+
+def open_storage(config, wrap=None, on_connect_error=None):
+    """Storage for the backend named by config["DB_BACKEND"].
+
+    `wrap` is applied to every new connection (e.g. db_metrics.instrument);
+    `on_connect_error(exc)` runs before a failed connect re-raises.
+    """
+    name = config.get("DB_BACKEND", "mysql")
+    if name == "mysql":
+        from storage.mysql import MySQLBackend as backend
+    elif name == "sqlite":
+        from storage.sqlite import SQLiteBackend as backend
+    else:
+        raise ValueError(f"unknown DB_BACKEND {name!r} (choose from {', '.join(BACKENDS)})")
+    return Storage(backend(config), wrap=wrap, on_connect_error=on_connect_error)
+
+
+__all__ = ["Backend", "Rollback", "Storage", "open_storage", "BACKENDS", "UsersRepo", "UsageRepo", "ProgressRepo",
+           "BadgesRepo", "PetsRepo", "LeaderboardRepo", "ChatsRepo"]
@@ -0,0 +1,273 @@
+"""Storage handle shared by the repositories: connections, transactions and small query helpers."""
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Read routing (backends with a read replica configured, see Storage.read)
+DEFAULT_MAX_LAG_S = 2.0     # DB_REPLICA_MAX_LAG_S: use the primary while the replica is further behind
+DEFAULT_STICKY_S = 5.0      # DB_REPLICA_STICKY_S: a user's reads stay on the primary this long after their write
+LAG_CHECK_S = 5.0           # re-probe replica lag at most this often
+REPLICA_RETRY_S = 30.0      # after a replica failure, send reads to the primary this long
+STICKY_MAX_USERS = 10000    # prune expired stickiness entries beyond this many users
+
+# Connection pool (see Storage.connect)
+DEFAULT_POOL_SIZE = 8       # DB_POOL_SIZE: idle connections kept per endpoint (primary, replica)
+POOL_PING_S = 30.0          # a connection idle longer than this is pinged before it is reused
+
+
+class Rollback(Exception):
+    """Raise inside Storage.transaction() to discard its writes without an error"""
+
+
+class Backend:
+    """What a database backend provides to the repositories.
+
+    Repository SQL is written once with %s placeholders; the few dialect
+    differences are spelled through these hooks.
+    """
+
+    name = "base"
+    IntegrityError = Exception
+    insert_ignore = "INSERT IGNORE"
+    has_replica = False
+
+    def __init__(self, config):
+        self.config = config
+
+    def connect(self, replica=False):
+        raise NotImplementedError
+
+    def replica_lag(self, conn):
+        """Seconds the replica behind `conn` trails the primary; None if it can't tell"""
+        return None
+
+    def ping(self, conn):
+        """Raise if an idle connection is no longer usable"""
+
+    def create_schema(self, conn):
+        raise NotImplementedError
+
+    def on_conflict(self, *key_columns):
+        """Clause that turns an INSERT into an upsert on the given unique key"""
+        raise NotImplementedError
+
+    def new(self, column):
+        """Reference to the value an upsert tried to insert into `column`"""
+        raise NotImplementedError
+
+
+class Storage:
+    """One configured backend plus its repositories (see storage.open_storage).
+
+    Writes always go to the primary. Repository methods that only read pass
+    replica=True; with a replica configured those reads go to it unless:
+    - the user wrote within the sticky window (read-your-writes);
+    - the replica lags more than max_lag_s;
+    - the replica failed recently.
+    Stickiness is kept per process. That is enough because Streamlit pins a
+    browser session to one server process.
+
+    Connections are pooled per endpoint. A finished call hands its connection
+    back, and up to pool_size idle ones are kept. A read ends its transaction
+    first, so the next user never sees an old snapshot. A connection that
+    failed mid-call is closed rather than reused, and one idle for more than
+    POOL_PING_S is pinged before reuse. prefill() opens connections ahead of
+    traffic, so the first requests skip the connect and TLS handshake.
+    """
+
+    def __init__(self, backend, wrap=None, on_connect_error=None):
+        self.backend = backend
+        self.wrap = wrap
+        self.on_connect_error = on_connect_error
+        self.max_lag_s = float(backend.config.get("DB_REPLICA_MAX_LAG_S", DEFAULT_MAX_LAG_S))
+        self.sticky_s = float(backend.config.get("DB_REPLICA_STICKY_S", DEFAULT_STICKY_S))
+        self.read_stats = Counter()   # replica / sticky / fallback: where routed reads went
+        self.pool_size = int(backend.config.get("DB_POOL_SIZE", DEFAULT_POOL_SIZE))
+        self.pool_stats = Counter()   # opened / reused connections
+        self._idle = {False: [], True: []}  # replica? -> [(connection, monotonic time it went idle)]
+        self._lock = threading.Lock()
+        self._last_write = {}         # user_id -> monotonic time of their last committed write
+        self._replica_down_until = 0.0
+        self._lag_checked_at = float("-inf")
+
+        from storage import repositories
+        self.users = repositories.UsersRepo(self)
+        self.usage = repositories.UsageRepo(self)
+        self.progress = repositories.ProgressRepo(self)
+        self.badges = repositories.BadgesRepo(self)
+        self.pets = repositories.PetsRepo(self)
+        self.leaderboard = repositories.LeaderboardRepo(self)
+        self.chats = repositories.ChatsRepo(self)
+
+    def connect(self, replica=False):
+        """An idle pooled connection to the primary (or replica), else a new one; hand it back with release()"""
+        while True:
+            with self._lock:
+                conn, idle_since = self._idle[replica].pop() if self._idle[replica] else (None, None)
+            if conn is None:
+                break
+            if time.monotonic() - idle_since > POOL_PING_S:
+                try:
+                    self.backend.ping(conn)
+                except Exception:
+                    self.discard(conn)
+                    continue
+            with self._lock:
+                self.pool_stats["reused"] += 1
+            return conn
+        try:
+            conn = self.backend.connect(replica=replica)
+        except Exception as e:
+            if self.on_connect_error and not replica:
+                self.on_connect_error(e)
+            raise
+        with self._lock:
+            self.pool_stats["opened"] += 1
+        return self.wrap(conn) if self.wrap else conn
+
+    def release(self, conn, replica=False):
+        """Return a healthy connection to the pool, or close it if the pool is full"""
+        with self._lock:
+            if len(self._idle[replica]) < self.pool_size:
+                self._idle[replica].append((conn, time.monotonic()))
+                return
+        conn.close()
+
+    @staticmethod
+    def discard(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def prefill(self, count=None):
+        """Open connections until each endpoint's pool holds `count` (default pool_size) idle ones"""
+        count = self.pool_size if count is None else min(count, self.pool_size)
+        for replica in (False, True) if self.backend.has_replica else (False,):
+            with self._lock:
+                missing = count - len(self._idle[replica])
+            conns = [self.connect(replica=replica) for _ in range(missing)]
+            for conn in conns:
+                self.release(conn, replica)
+
+    def create_schema(self):
+        conn = self.connect()
+        try:
+            self.backend.create_schema(conn)
+            conn.commit()
+        except BaseException:
+            self.discard(conn)
+            raise
+        self.release(conn)
+
+    def wrote(self, user_id):
+        """Pin the user's reads to the primary for the sticky window"""
+        if user_id is None:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._last_write[user_id] = now
+            if len(self._last_write) > STICKY_MAX_USERS:
+                self._last_write = {u: t for u, t in self._last_write.items() if now - t < self.sticky_s}
+
+    def _route(self, stat, until=None):
+        with self._lock:
+            self.read_stats[stat] += 1
+            if until is not None:
+                self._replica_down_until = max(self._replica_down_until, until)
+
+    def _read_connection(self, user_id=None):
+        """(connection, on_replica) for a read-only query"""
+        if not self.backend.has_replica:
+            return self.connect(), False
+        now = time.monotonic()
+        if user_id is not None and now - self._last_write.get(user_id, float("-inf")) < self.sticky_s:
+            self._route("sticky")
+            return self.connect(), False
+        if now < self._replica_down_until:
+            self._route("fallback")
+            return self.connect(), False
+        try:
+            conn = self.connect(replica=True)
+        except Exception:
+            self._route("fallback", now + REPLICA_RETRY_S)
+            return self.connect(), False
+        if now - self._lag_checked_at >= LAG_CHECK_S:
+            self._lag_checked_at = now
+            lag = self.backend.replica_lag(conn)
+            if lag is not None and lag > self.max_lag_s:
+                self.release(conn, replica=True)
+                self._route("fallback", now + LAG_CHECK_S)
+                return self.connect(), False
+        self._route("replica")
+        return conn, True
+
+    def _run(self, conn, fn, dictionary, replica=False):
+        cur = conn.cursor(dictionary=dictionary)
+        try:
+            result = fn(cur)
+            cur.close()
+            conn.rollback()     # end the read's snapshot before the connection is reused
+        except BaseException:
+            self.discard(conn)
+            raise
+        self.release(conn, replica)
+        return result
+
+    def read(self, fn, user_id=None, dictionary=True):
+        """fn(cursor) for read-only queries, on the replica when routing allows.
+
+        If the replica errors, fn is retried once on the primary and the replica
+        sits out REPLICA_RETRY_S. Pass the reading user's id for read-your-writes.
+        """
+        conn, on_replica = self._read_connection(user_id)
+        if not on_replica:
+            return self._run(conn, fn, dictionary)
+        try:
+            return self._run(conn, fn, dictionary, replica=True)
+        except Exception:
+            self._route("fallback", time.monotonic() + REPLICA_RETRY_S)
+        return self._run(self.connect(), fn, dictionary)
+
+    @contextmanager
+    def transaction(self, dictionary=False, user_id=None):
+        """Cursor on a pooled primary connection; commits on success, rolls back on error"""
+        conn = self.connect()
+        cur = conn.cursor(dictionary=dictionary)
+        healthy = False
+        try:
+            yield cur
+            conn.commit()
+            healthy = True
+            self.wrote(user_id)
+        except Rollback:
+            conn.rollback()
+            healthy = True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            cur.close()
+            if healthy:
+                self.release(conn)
+            else:
+                self.discard(conn)
+
+    def fetchall(self, sql, params=(), dictionary=True, replica=False, user_id=None):
+        def query(cur):
+            cur.execute(sql, params)
+            return cur.fetchall()
+        if replica:
+            return self.read(query, user_id, dictionary)
+        return self._run(self.connect(), query, dictionary)
+
+    def fetchone(self, sql, params=(), dictionary=True, replica=False, user_id=None):
+        rows = self.fetchall(sql, params, dictionary, replica, user_id)
+        return rows[0] if rows else None
+
+    def execute(self, sql, params=(), user_id=None):
+        """Run one write statement in its own transaction; returns the affected row count"""
+        with self.transaction(user_id=user_id) as cur:
+            cur.execute(sql, params)
+            return cur.rowcount
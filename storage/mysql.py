@@ -0,0 +1,292 @@
+"""MySQL / TiDB backend (the hosted deployment: TiDB Cloud on port 4000 over TLS)."""
+import os
+
+import mysql.connector
+
+from storage.base import Backend
+from storage.repositories import bucket_counts
+
+# Bump when create_schema() gains a table, column or migration
+SCHEMA_VERSION = 3
+
+
+class MySQLBackend(Backend):
+    name = "mysql"
+    IntegrityError = mysql.connector.IntegrityError
+    insert_ignore = "INSERT IGNORE"
+
+    @property
+    def has_replica(self):
+        return bool(self.config.get("DB_REPLICA_HOST"))
+
+    def connect(self, replica=False):
+        """Primary connection, or the read replica's (DB_REPLICA_* settings, defaulting to the primary's)"""
+        c = self.config
+
+        def opt(key, default=None):
+            if replica and f"DB_REPLICA_{key}" in c:
+                return c[f"DB_REPLICA_{key}"]
+            return c.get(f"DB_{key}", default)
+
+        # DB_PORT / DB_SSL let benchmarks and local setups point at a plain MySQL-compatible server
+        ssl = {}
+        if opt("SSL", True):
+            ssl = {"ssl_verify_cert": True}
+            if os.path.exists("/etc/ssl/certs/ca-certificates.crt"):
+                ssl["ssl_ca"] = "/etc/ssl/certs/ca-certificates.crt"
+        return mysql.connector.connect(
+            host=opt("HOST"), port=int(opt("PORT", 4000)),
+            user=opt("USER"), password=opt("PASSWORD"),
+            database=c["DB_NAME"], connection_timeout=10, **ssl
+        )
+
+    @property
+    def follower_read(self):
+        return str(self.config.get("DB_REPLICA_FOLLOWER_READ", "")).lower() in ("1", "true", "yes")
+
+    def replica_lag(self, conn):
+        """Seconds_Behind_Source from SHOW REPLICA STATUS.
+
+        inf when replication is stopped or the endpoint can't report its lag, so
+        the read falls back to the primary. A TiDB follower-read endpoint serves
+        consistent reads and has no replica status: DB_REPLICA_FOLLOWER_READ=true
+        trusts it without a probe (None).
+        """
+        if self.follower_read:
+            return None
+        cur = conn.cursor(dictionary=True)
+        try:
+            cur.execute("SHOW REPLICA STATUS")
+            row = cur.fetchone()
+        except mysql.connector.Error:
+            return float("inf")
+        finally:
+            cur.close()
+        if not row:
+            return float("inf")
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return float("inf") if lag is None else float(lag)
+
+    def ping(self, conn):
+        conn.ping(reconnect=False)
+
+    def on_conflict(self, *key_columns):
+        return "ON DUPLICATE KEY UPDATE"
+
+    def new(self, column):
+        return f"VALUES({column})"
+
+    def create_schema(self, conn):
+        """Create/migrate the schema, including one-time folds of legacy layouts.
+
+        A database already at SCHEMA_VERSION is left alone, so a new server
+        process spends two statements here instead of ~40 DDL round trips.
+        """
+        cur = conn.cursor()
+        cur.execute("CREATE TABLE IF NOT EXISTS SchemaVersion (version INT NOT NULL PRIMARY KEY)")
+        cur.execute("SELECT MAX(version) FROM SchemaVersion")
+        (current,) = cur.fetchone()
+        if current is not None and current >= SCHEMA_VERSION:
+            cur.close()
+            return
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS Users (
+            id INT AUTO_INCREMENT PRIMARY KEY, username VARCHAR(255) UNIQUE NOT NULL,
+            hashed_password VARCHAR(255) NOT NULL, grade VARCHAR(50), subject VARCHAR(50) DEFAULT 'Gen',
+            flash_usage INT DEFAULT 0, pro_usage INT DEFAULT 0, user_id VARCHAR(255) UNIQUE NOT NULL,
+            session_id VARCHAR(255), last_active_date VARCHAR(20), ai_level VARCHAR(50) DEFAULT 'Grade-Level',
+            theme VARCHAR(50) DEFAULT 'Dark Ocean', total_xp INT DEFAULT 0, level INT DEFAULT 1
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS ChatLogs (
+            id INT AUTO_INCREMENT PRIMARY KEY, session_id VARCHAR(255) NOT NULL,
+            user_id VARCHAR(255) NOT NULL, title VARCHAR(255), messages JSON,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserBadges (
+            id INT AUTO_INCREMENT PRIMARY KEY, user_id VARCHAR(255) NOT NULL,
+            badge_id VARCHAR(50) NOT NULL, earned_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(user_id, badge_id)
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserLessonProgress (
+            id INT AUTO_INCREMENT PRIMARY KEY, user_id VARCHAR(255) NOT NULL,
+            lesson_key VARCHAR(100) NOT NULL, status VARCHAR(20) DEFAULT 'available',
+            completed_date TIMESTAMP NULL, quiz_score INT DEFAULT 0,
+            UNIQUE(user_id, lesson_key)
+        );""")
+
+        # One packed row per user-course: bit (n-1) of completed_mask = lesson n completed
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserCourseProgress (
+            user_id VARCHAR(255) NOT NULL,
+            course_id VARCHAR(50) NOT NULL,
+            completed_mask BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            updated_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, course_id)
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS SeasonalEvents (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            event_name VARCHAR(100),
+            start_date DATE,
+            end_date DATE,
+            badge_id VARCHAR(50),
+            is_active BOOLEAN DEFAULT FALSE
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS Pets (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            pet_id VARCHAR(50) UNIQUE NOT NULL,
+            name VARCHAR(100) NOT NULL,
+            emoji VARCHAR(10) NOT NULL,
+            rarity VARCHAR(20) NOT NULL,
+            xp_multiplier DECIMAL(4,3) NOT NULL,
+            is_limited BOOLEAN DEFAULT FALSE,
+            limited_until DATETIME NULL,
+            description TEXT
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserPets (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            pet_id VARCHAR(50) NOT NULL,
+            acquired_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            quantity INT NOT NULL DEFAULT 1,
+            last_acquired TIMESTAMP NULL,
+            INDEX idx_user_pets (user_id),
+            UNIQUE INDEX uq_user_pet (user_id, pet_id)
+        );""")
+
+        # Equipped pets keyed by (user, slot): equip/swap/unequip are single primary-key writes
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserEquippedPets (
+            user_id VARCHAR(255) NOT NULL,
+            slot TINYINT NOT NULL,
+            pet_id VARCHAR(50) NOT NULL,
+            PRIMARY KEY (user_id, slot)
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS UserEggPurchases (
+            id INT AUTO_INCREMENT PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            egg_type VARCHAR(50) NOT NULL,
+            purchased_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            pet_received VARCHAR(50) NOT NULL,
+            spend_key VARCHAR(64) NULL,
+            INDEX idx_user_purchases (user_id),
+            INDEX idx_spend_key (spend_key)
+        );""")
+
+        cur.execute("""CREATE TABLE IF NOT EXISTS Leaderboard (
+            board VARCHAR(16) NOT NULL,
+            user_id VARCHAR(255) NOT NULL,
+            username VARCHAR(255),
+            grade VARCHAR(50),
+            xp INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (board, user_id),
+            INDEX idx_board_xp (board, xp),
+            INDEX idx_board_grade_xp (board, grade, xp)
+        );""")
+
+        # Users per (board, grade, XP bucket) for O(buckets) ranks; grade '' is the whole board
+        cur.execute("""CREATE TABLE IF NOT EXISTS LeaderboardBuckets (
+            board VARCHAR(16) NOT NULL,
+            grade VARCHAR(50) NOT NULL,
+            bucket INT NOT NULL,
+            users INT NOT NULL DEFAULT 0,
+            PRIMARY KEY (board, grade, bucket)
+        );""")
+
+        # One row per XP spend, keyed by the client's idempotency key
+        cur.execute("""CREATE TABLE IF NOT EXISTS XpSpends (
+            idempotency_key VARCHAR(64) PRIMARY KEY,
+            user_id VARCHAR(255) NOT NULL,
+            amount INT NOT NULL,
+            reason VARCHAR(50),
+            spent_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            INDEX idx_user_spends (user_id)
+        );""")
+
+        # Add columns if missing
+        columns_to_add = [
+            ("theme", "VARCHAR(50) DEFAULT 'Auto'"),
+            ("total_xp", "INT DEFAULT 0"),
+            ("level", "INT DEFAULT 1"),
+            ("streak_count", "INT DEFAULT 0"),
+            ("last_study_date", "DATE"),
+            ("daily_goal", "INT DEFAULT 3"),
+            ("daily_lessons_completed", "INT DEFAULT 0"),
+            ("last_spin_date", "DATE"),
+            ("streak_freezes", "INT DEFAULT 0"),
+            ("pet_stage", "VARCHAR(20) DEFAULT 'egg'"),
+            ("pet_mood", "VARCHAR(20) DEFAULT 'neutral'"),
+            ("sounds_enabled", "BOOLEAN DEFAULT TRUE"),
+            ("pomodoros_completed", "INT DEFAULT 0")
+        ]
+        for col_name, col_def in columns_to_add:
+            try: cur.execute(f"ALTER TABLE Users ADD COLUMN {col_name} {col_def};")
+            except: pass
+        # Lets daily_rollover.py find stale days without a full scan
+        try: cur.execute("ALTER TABLE Users ADD INDEX idx_last_active (last_active_date)")
+        except: pass
+
+        for stmt in ["ALTER TABLE UserEggPurchases ADD COLUMN spend_key VARCHAR(64) NULL",
+                     "ALTER TABLE UserEggPurchases ADD INDEX idx_spend_key (spend_key)"]:
+            try: cur.execute(stmt)
+            except: pass
+
+        # One row per owned pet: collapse legacy duplicate UserPets rows into a quantity
+        for col_name, col_def in [("quantity", "INT NOT NULL DEFAULT 1"), ("last_acquired", "TIMESTAMP NULL")]:
+            try: cur.execute(f"ALTER TABLE UserPets ADD COLUMN {col_name} {col_def};")
+            except: pass
+        cur.execute("SHOW INDEX FROM UserPets WHERE Key_name='uq_user_pet'")
+        if not cur.fetchall():
+            cur.execute("""UPDATE UserPets up JOIN (
+                    SELECT MIN(id) AS keep_id, COUNT(*) AS n, MIN(acquired_date) AS first_at,
+                           MAX(acquired_date) AS last_at, MAX(equip_slot) AS slot
+                    FROM UserPets GROUP BY user_id, pet_id
+                ) d ON up.id = d.keep_id
+                SET up.quantity = d.n, up.acquired_date = d.first_at, up.last_acquired = d.last_at,
+                    up.equip_slot = d.slot, up.is_equipped = (d.slot IS NOT NULL)""")
+            cur.execute("""DELETE up FROM UserPets up JOIN (
+                    SELECT user_id, pet_id, MIN(id) AS keep_id FROM UserPets GROUP BY user_id, pet_id
+                ) k ON up.user_id = k.user_id AND up.pet_id = k.pet_id AND up.id <> k.keep_id""")
+            cur.execute("ALTER TABLE UserPets ADD UNIQUE INDEX uq_user_pet (user_id, pet_id)")
+
+        # Move legacy is_equipped/equip_slot flags into UserEquippedPets (tables created before the split)
+        try:
+            cur.execute("""INSERT IGNORE INTO UserEquippedPets (user_id, slot, pet_id)
+                SELECT user_id, equip_slot, pet_id FROM UserPets WHERE is_equipped = TRUE AND equip_slot BETWEEN 1 AND 3""")
+            cur.execute("UPDATE UserPets SET is_equipped = FALSE, equip_slot = NULL WHERE is_equipped = TRUE")
+        except: pass
+
+        # One-time fold of legacy per-lesson rows into course bitmasks
+        cur.execute("SELECT 1 FROM UserCourseProgress LIMIT 1")
+        if not cur.fetchall():
+            cur.execute("""INSERT INTO UserCourseProgress (user_id, course_id, completed_mask)
+                SELECT user_id, SUBSTRING_INDEX(lesson_key, '_L', 1),
+                       BIT_OR(1 << (CAST(SUBSTRING_INDEX(lesson_key, '_L', -1) AS UNSIGNED) - 1))
+                FROM UserLessonProgress WHERE status='completed'
+                GROUP BY user_id, SUBSTRING_INDEX(lesson_key, '_L', 1)""")
+
+        # Seed the all-time board with earned XP: the spendable balance plus every recorded spend.
+        # Egg purchases from before XpSpends existed (UserEggPurchases rows without a spend_key)
+        # are not counted, so those students start below their true lifetime total.
+        # GREATEST keeps rows the board has already credited past this.
+        cur.execute("""INSERT INTO Leaderboard (board, user_id, username, grade, xp)
+            SELECT 'all', u.user_id, u.username, u.grade, u.total_xp + COALESCE(s.spent, 0)
+            FROM Users u LEFT JOIN (SELECT user_id, SUM(amount) AS spent FROM XpSpends GROUP BY user_id) s
+                ON s.user_id = u.user_id
+            WHERE u.total_xp + COALESCE(s.spent, 0) > 0
+            ON DUPLICATE KEY UPDATE xp = GREATEST(xp, VALUES(xp))""")
+
+        # Recount the rank buckets from the boards (credits keep them current from here on)
+        cur.execute("DELETE FROM LeaderboardBuckets")
+        cur.execute("SELECT board, grade, xp FROM Leaderboard")
+        counts = bucket_counts(cur.fetchall())
+        if counts:
+            cur.executemany("INSERT INTO LeaderboardBuckets (board, grade, bucket, users) VALUES (%s, %s, %s, %s)",
+                            [(*key, n) for key, n in counts.items()])
+
+        cur.execute("INSERT IGNORE INTO SchemaVersion (version) VALUES (%s)", (SCHEMA_VERSION,))
+        cur.close()
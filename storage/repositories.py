@@ -0,0 +1,360 @@
+"""Repositories: every query the app runs, grouped by what it touches.
+
+Each public method opens its own short transaction through the Storage
+handle, except the ones that take a `cur`, which join the caller's.
+Pure reads pass replica=True and may be served by a read replica; writes
+pass the acting user_id so that user's next reads stay on the primary.
+Dates are passed as ISO strings so both backends compare them the same way.
+"""
+import math
+from collections import Counter
+
+from storage.base import Rollback
+
+RARITY_ORDER = ("Common", "Uncommon", "Rare", "Epic", "Legendary")
+BUCKETS_PER_DOUBLING = 8    # leaderboard rank buckets, each ~9% of an XP total wide
+
+
+def _iso(day):
+    return day if day is None or isinstance(day, str) else day.isoformat()
+
+
+class Repository:
+    def __init__(self, storage):
+        self.storage = storage
+        self.db = storage.backend
+
+
+class UsersRepo(Repository):
+    SETTINGS = ("grade", "theme", "daily_goal")
+
+    def by_username(self, username):
+        return self.storage.fetchone("SELECT * FROM Users WHERE username=%s", (username,))
+
+    def create(self, username, hashed_password, grade, user_id, session_id, today):
+        """Insert a new account; False if the username is taken"""
+        try:
+            self.storage.execute("""INSERT INTO Users (username,hashed_password,grade,user_id,session_id,last_active_date,total_xp,level,theme)
+                                    VALUES (%s,%s,%s,%s,%s,%s,0,1,'Auto')""",
+                                 (username, hashed_password, grade, user_id, session_id, _iso(today)), user_id=user_id)
+        except self.db.IntegrityError:
+            return False
+        return True
+
+    def total_xp(self, user_id):
+        row = self.storage.fetchone("SELECT total_xp FROM Users WHERE user_id=%s", (user_id,), dictionary=False,
+                                    replica=True, user_id=user_id)
+        return row[0] if row else 0
+
+    def add_xp(self, user_id, amount, level_for, boards=(), username=None, grade=None):
+        """Credit XP, store the level it reaches and bump the leaderboard rows; returns (total_xp, level)"""
+        with self.storage.transaction(user_id=user_id) as cur:
+            cur.execute("UPDATE Users SET total_xp = total_xp + %s WHERE user_id = %s", (amount, user_id))
+            cur.execute("SELECT total_xp FROM Users WHERE user_id = %s", (user_id,))
+            new_xp = cur.fetchone()[0]
+            level = level_for(new_xp)
+            cur.execute("UPDATE Users SET level = %s WHERE user_id = %s", (level, user_id))
+            self.storage.leaderboard.credit(cur, user_id, amount, boards, username, grade)
+        return new_xp, level
+
+    def update_settings(self, user_id, **fields):
+        """Write profile settings (grade, theme, daily_goal) in one statement"""
+        unknown = set(fields) - set(self.SETTINGS)
+        if unknown:
+            raise ValueError(f"not a user setting: {', '.join(sorted(unknown))}")
+        cols = ", ".join(f"{c}=%s" for c in fields)
+        self.storage.execute(f"UPDATE Users SET {cols} WHERE user_id=%s", (*fields.values(), user_id), user_id=user_id)
+
+    def add_pomodoro(self, user_id):
+        self.storage.execute("UPDATE Users SET pomodoros_completed = pomodoros_completed + 1 WHERE user_id=%s", (user_id,),
+                             user_id=user_id)
+
+    def record_study(self, user_id, today, yesterday):
+        """Advance or restart the streak for a first study today; False if today was already recorded"""
+        # Computed in SQL from the stored row, so another tab's study today can't double count
+        return self.storage.execute("""UPDATE Users SET streak_count = CASE WHEN last_study_date = %s THEN streak_count + 1 ELSE 1 END,
+                                          last_study_date = %s
+                                       WHERE user_id=%s AND (last_study_date IS NULL OR last_study_date < %s)""",
+                                    (_iso(yesterday), _iso(today), user_id, _iso(today)), user_id=user_id) > 0
+
+    def spend_xp(self, cur, user_id, cost, idempotency_key, reason):
+        """Check and debit XP in one conditional statement on the caller's open transaction.
+
+        Returns (new_balance, replayed). new_balance is None when the balance is too low.
+        A key that was already spent is not charged again: it returns the current balance
+        with replayed=True. Expects a plain (tuple) cursor; the caller commits or rolls back.
+        """
+        cur.execute(f"{self.db.insert_ignore} INTO XpSpends (idempotency_key, user_id, amount, reason) VALUES (%s, %s, %s, %s)",
+                    (idempotency_key, user_id, cost, reason))
+        replayed = cur.rowcount == 0
+        if not replayed:
+            cur.execute("UPDATE Users SET total_xp = total_xp - %s WHERE user_id=%s AND total_xp >= %s", (cost, user_id, cost))
+            if cur.rowcount == 0:
+                return None, False
+        # Our own write holds the row lock, so this read is the authoritative balance
+        cur.execute("SELECT total_xp FROM Users WHERE user_id=%s", (user_id,))
+        return cur.fetchone()[0], replayed
+
+
+class UsageRepo(Repository):
+    def save(self, user_id, flash_usage, pro_usage):
+        self.storage.execute("UPDATE Users SET flash_usage=%s, pro_usage=%s WHERE user_id=%s",
+                             (flash_usage, pro_usage, user_id), user_id=user_id)
+
+    def roll_day(self, user_id, today, cur=None):
+        """Start a new day for one user; matches nothing if their day is already current"""
+        sql = """UPDATE Users SET flash_usage=0, pro_usage=0, daily_lessons_completed=0, last_active_date=%s
+                 WHERE user_id=%s AND (last_active_date IS NULL OR last_active_date <> %s)"""
+        params = (_iso(today), user_id, _iso(today))
+        if cur is not None:
+            cur.execute(sql, params)
+            return cur.rowcount
+        return self.storage.execute(sql, params, user_id=user_id)
+
+    def add_daily_lesson(self, user_id):
+        self.storage.execute("UPDATE Users SET daily_lessons_completed = daily_lessons_completed + 1 WHERE user_id=%s",
+                             (user_id,), user_id=user_id)
+
+    def rollover_all(self, today):
+        """Zero the daily counters of every user whose last active day is before `today`"""
+        return self.storage.execute("""UPDATE Users SET flash_usage=0, pro_usage=0, daily_lessons_completed=0
+                                       WHERE (last_active_date IS NULL OR last_active_date < %s)
+                                         AND (flash_usage <> 0 OR pro_usage <> 0 OR daily_lessons_completed <> 0)""",
+                                    (_iso(today),))
+
+
+class ProgressRepo(Repository):
+    def masks(self, user_id):
+        """{course_id: completed_mask} for every course the user has started"""
+        rows = self.storage.fetchall("SELECT course_id, completed_mask FROM UserCourseProgress WHERE user_id=%s", (user_id,),
+                                     replica=True, user_id=user_id)
+        return {r['course_id']: int(r['completed_mask']) for r in rows}
+
+    def complete(self, user_id, course_id, bit):
+        """OR a lesson bit into the course mask, creating the row on first completion"""
+        self.storage.execute(f"""INSERT INTO UserCourseProgress (user_id, course_id, completed_mask) VALUES (%s, %s, %s)
+                                 {self.db.on_conflict('user_id', 'course_id')} completed_mask = completed_mask | {self.db.new('completed_mask')},
+                                     updated_date = CURRENT_TIMESTAMP""",
+                             (user_id, course_id, bit), user_id=user_id)
+
+    def recent(self, since):
+        """Course masks (with the student's grade) updated on or after `since`, for warm-up"""
+        return self.storage.fetchall("""SELECT p.course_id, p.completed_mask, u.grade FROM UserCourseProgress p
+                                        JOIN Users u ON u.user_id = p.user_id WHERE p.updated_date >= %s""",
+                                     (since,), replica=True)
+
+
+class BadgesRepo(Repository):
+    def list(self, user_id):
+        rows = self.storage.fetchall("SELECT badge_id FROM UserBadges WHERE user_id = %s", (user_id,), dictionary=False,
+                                     replica=True, user_id=user_id)
+        return [r[0] for r in rows]
+
+    def award(self, user_id, badge_id):
+        """Insert the badge; False if the user already had it"""
+        return self.storage.execute(f"{self.db.insert_ignore} INTO UserBadges (user_id, badge_id) VALUES (%s, %s)",
+                                    (user_id, badge_id), user_id=user_id) > 0
+
+
+class PetsRepo(Repository):
+    def seed_catalog(self, catalog, columns):
+        """Insert the static catalog into an empty Pets table"""
+        with self.storage.transaction() as cur:
+            cur.execute("SELECT COUNT(*) FROM Pets")
+            if cur.fetchone()[0] > 0:
+                return
+            cur.executemany(f"INSERT INTO Pets ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))})",
+                            [tuple(p[c] for c in columns) for p in catalog])
+
+    def catalog(self):
+        """Every pet, Common to Legendary, then by name"""
+        order = " ".join(f"WHEN '{r}' THEN {i}" for i, r in enumerate(RARITY_ORDER))
+        return self.storage.fetchall(f"SELECT * FROM Pets ORDER BY CASE rarity {order} ELSE {len(RARITY_ORDER)} END, name",
+                                     replica=True)
+
+    def owned(self, user_id):
+        """The distinct pets owned by a user, with how many of each"""
+        return self.storage.fetchall("""SELECT p.*, up.quantity, up.acquired_date,
+                                               COALESCE(up.last_acquired, up.acquired_date) AS last_acquired
+                                        FROM UserPets up
+                                        JOIN Pets p ON up.pet_id = p.pet_id
+                                        WHERE up.user_id = %s
+                                        ORDER BY p.rarity DESC, p.name""", (user_id,), replica=True, user_id=user_id)
+
+    def equipped(self, user_id):
+        """[(slot, pet_id)] in slot order"""
+        return self.storage.fetchall("SELECT slot, pet_id FROM UserEquippedPets WHERE user_id = %s ORDER BY slot",
+                                     (user_id,), dictionary=False, replica=True, user_id=user_id)
+
+    def equip(self, user_id, slots):
+        """Put pets in slots ({slot: pet_id}), replacing whatever was there"""
+        self.storage.execute(f"""INSERT INTO UserEquippedPets (user_id, slot, pet_id) VALUES {', '.join(['(%s, %s, %s)'] * len(slots))}
+                                 {self.db.on_conflict('user_id', 'slot')} pet_id = {self.db.new('pet_id')}""",
+                             [v for slot, pet_id in slots.items() for v in (user_id, slot, pet_id)], user_id=user_id)
+
+    def move(self, user_id, src_slot, dst_slot):
+        self.storage.execute("UPDATE UserEquippedPets SET slot = %s WHERE user_id = %s AND slot = %s",
+                             (dst_slot, user_id, src_slot), user_id=user_id)
+
+    def unequip(self, user_id, slot):
+        self.storage.execute("DELETE FROM UserEquippedPets WHERE user_id = %s AND slot = %s", (user_id, slot),
+                             user_id=user_id)
+
+    def buy(self, user_id, egg_type, hatched, pet_ids, cost, spend_key):
+        """Charge for eggs and record what hatched in one transaction.
+
+        `hatched` is {pet_id: count}; `pet_ids` lists each egg's pet in order.
+        Returns (balance, pet_ids): balance is None when the XP doesn't cover the
+        cost, and a replayed spend_key returns the pets of the first purchase.
+        """
+        balance = None
+        with self.storage.transaction(user_id=user_id) as cur:
+            # Deduct XP only if the balance covers it (no read-then-write)
+            balance, replayed = self.storage.users.spend_xp(cur, user_id, cost, spend_key, f"egg:{egg_type}")
+            if balance is None:
+                raise Rollback
+            if replayed:
+                cur.execute("SELECT pet_received FROM UserEggPurchases WHERE spend_key=%s", (spend_key,))
+                return balance, [r[0] for r in cur.fetchall()]
+
+            # Add pets to user's collection (one row per distinct pet)
+            cur.execute("INSERT INTO UserPets (user_id, pet_id, quantity, last_acquired) VALUES "
+                        + ",".join(["(%s, %s, %s, CURRENT_TIMESTAMP)"] * len(hatched))
+                        + f" {self.db.on_conflict('user_id', 'pet_id')} quantity = quantity + {self.db.new('quantity')},"
+                          " last_acquired = CURRENT_TIMESTAMP",
+                        [v for pet_id, n in hatched.items() for v in (user_id, pet_id, n)])
+
+            # Record purchases
+            cur.execute("INSERT INTO UserEggPurchases (user_id, egg_type, pet_received, spend_key) VALUES "
+                        + ",".join(["(%s, %s, %s, %s)"] * len(pet_ids)),
+                        [v for pet_id in pet_ids for v in (user_id, egg_type, pet_id, spend_key)])
+        return balance, (pet_ids if balance is not None else [])
+
+
+def xp_bucket(xp):
+    """Rank bucket of an XP total: BUCKETS_PER_DOUBLING per doubling, so a board has a few hundred at most"""
+    return int(BUCKETS_PER_DOUBLING * math.log2(max(xp, 0) + 1))
+
+
+def bucket_start(bucket):
+    """Smallest XP total that falls in `bucket`"""
+    xp = max(math.ceil(2 ** (bucket / BUCKETS_PER_DOUBLING)) - 2, 0)
+    while xp_bucket(xp) < bucket:
+        xp += 1
+    return xp
+
+
+def _bucket_keys(board, xp, grade):
+    """LeaderboardBuckets rows a board row counts in: the whole board ('') and its grade"""
+    bucket = xp_bucket(xp)
+    return [(board, "", bucket)] + ([(board, grade, bucket)] if grade else [])
+
+
+def bucket_counts(rows):
+    """{(board, grade, bucket): users} for (board, grade, xp) Leaderboard rows"""
+    return Counter(key for board, grade, xp in rows for key in _bucket_keys(board, xp, grade))
+
+
+class LeaderboardRepo(Repository):
+    """Leaderboard rows plus LeaderboardBuckets, the number of users per (board, grade, XP bucket).
+
+    A rank is the users in the buckets above the user's plus those above them in
+    their own bucket: a sum over at most a few hundred bucket rows and a count
+    bounded by one bucket, whatever the rank. grade '' is the whole board.
+    """
+
+    def credit(self, cur, user_id, amount, boards, username, grade):
+        """Add earned XP to each board's row for the user and move them between buckets, on the caller's transaction.
+
+        add_xp's Users update runs first and locks the user's row, so a user's credits never interleave.
+        """
+        if not boards:
+            return
+        cur.execute(f"SELECT board, xp, grade FROM Leaderboard WHERE user_id = %s AND board IN ({', '.join(['%s'] * len(boards))})",
+                    (user_id, *boards))
+        before = {board: (xp, old_grade) for board, xp, old_grade in cur.fetchall()}
+        cur.execute(f"""INSERT INTO Leaderboard (board, user_id, username, grade, xp) VALUES {', '.join(['(%s, %s, %s, %s, %s)'] * len(boards))}
+                        {self.db.on_conflict('board', 'user_id')} xp = xp + {self.db.new('xp')},
+                            username = {self.db.new('username')}, grade = {self.db.new('grade')}""",
+                    [v for board in boards for v in (board, user_id, username, grade, amount)])
+        moves = Counter()
+        for board in boards:
+            old_xp, old_grade = before.get(board, (None, None))
+            if old_xp is not None:
+                moves.subtract(_bucket_keys(board, old_xp, old_grade))
+            moves.update(_bucket_keys(board, (old_xp or 0) + amount, grade))
+        moves = [(key, n) for key, n in moves.items() if n]
+        if moves:
+            cur.execute(f"""INSERT INTO LeaderboardBuckets (board, grade, bucket, users) VALUES {', '.join(['(%s, %s, %s, %s)'] * len(moves))}
+                            {self.db.on_conflict('board', 'grade', 'bucket')} users = users + {self.db.new('users')}""",
+                        [v for key, n in moves for v in (*key, n)])
+
+    def top(self, board, grade=None, limit=10):
+        """Top-N rows of a board, optionally within one grade"""
+        if grade:
+            return self.storage.fetchall("""SELECT user_id, username, grade, xp FROM Leaderboard
+                                            WHERE board = %s AND grade = %s ORDER BY xp DESC LIMIT %s""", (board, grade, limit),
+                                         replica=True)
+        return self.storage.fetchall("SELECT user_id, username, grade, xp FROM Leaderboard WHERE board = %s ORDER BY xp DESC LIMIT %s",
+                                     (board, limit), replica=True)
+
+    def rank(self, board, user_id, grade=None):
+        """(rank, xp) of a user on a board, or (None, 0) if they have no XP there.
+
+        A primary-key lookup, a sum over the buckets above the user's, and an
+        index range count within their own bucket.
+        """
+        def query(cur):
+            cur.execute("SELECT xp FROM Leaderboard WHERE board = %s AND user_id = %s", (board, user_id))
+            row = cur.fetchone()
+            if not row:
+                return None, 0
+            xp, bucket = row[0], xp_bucket(row[0])
+            cur.execute("SELECT COALESCE(SUM(users), 0) FROM LeaderboardBuckets WHERE board = %s AND grade = %s AND bucket > %s",
+                        (board, grade or "", bucket))
+            above = int(cur.fetchone()[0])
+            if grade:
+                cur.execute("SELECT COUNT(*) FROM Leaderboard WHERE board = %s AND grade = %s AND xp > %s AND xp < %s",
+                            (board, grade, xp, bucket_start(bucket + 1)))
+            else:
+                cur.execute("SELECT COUNT(*) FROM Leaderboard WHERE board = %s AND xp > %s AND xp < %s",
+                            (board, xp, bucket_start(bucket + 1)))
+            return above + cur.fetchone()[0] + 1, xp
+        return self.storage.read(query, user_id, dictionary=False)
+
+    def prune_weeks(self, oldest_kept):
+        """Delete weekly boards ('YYYY-Www') before `oldest_kept` and their buckets; returns rows deleted"""
+        with self.storage.transaction() as cur:
+            cur.execute("DELETE FROM Leaderboard WHERE board <> 'all' AND board < %s", (oldest_kept,))
+            deleted = cur.rowcount
+            cur.execute("DELETE FROM LeaderboardBuckets WHERE board <> 'all' AND board < %s", (oldest_kept,))
+        return deleted
+
+
+class ChatsRepo(Repository):
+    def start(self, user_id, session_id, cur=None):
+        """Make session_id the user's current chat and create its empty log"""
+        if cur is None:
+            with self.storage.transaction(user_id=user_id) as cur:
+                return self.start(user_id, session_id, cur)
+        cur.execute("UPDATE Users SET session_id=%s WHERE user_id=%s", (session_id, user_id))
+        cur.execute("INSERT INTO ChatLogs (session_id,user_id,title,messages) VALUES (%s,%s,'New','[]')", (session_id, user_id))
+
+    def set_title(self, session_id, title, user_id=None):
+        self.storage.execute("UPDATE ChatLogs SET title=%s WHERE session_id=%s", (title, session_id), user_id=user_id)
+
+    def delete_empty(self, user_id, session_id=None, cur=None):
+        """Delete the user's empty chats (title 'New', no messages), or just session_id if it is one"""
+        sql = """DELETE FROM ChatLogs WHERE user_id=%s AND title='New'
+                 AND (messages='[]' OR messages IS NULL OR messages='')"""
+        params = (user_id,)
+        if session_id:
+            sql, params = sql + " AND session_id=%s", (user_id, session_id)
+        if cur is not None:
+            cur.execute(sql, params)
+            return cur.rowcount
+        return self.storage.execute(sql, params, user_id=user_id)
+
+    def recent(self, user_id, limit=20):
+        return self.storage.fetchall("SELECT * FROM ChatLogs WHERE user_id=%s ORDER BY timestamp DESC LIMIT %s",
+                                     (user_id, limit), replica=True, user_id=user_id)
@@ -0,0 +1,177 @@
+"""Embedded SQLite backend for single-node deployments, local development and benchmarks.
+
+The database file runs in WAL mode, so reruns keep reading while another
+session writes. Connections are adapted to the small mysql.connector surface
+the repositories and db_metrics use:
+- %s placeholders;
+- cursor(dictionary=...) returning dict rows;
+- rowcount on SELECTs.
+"""
+import sqlite3
+
+from storage.base import Backend
+
+BUSY_TIMEOUT_S = 5.0
+
+SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS Users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, username TEXT UNIQUE NOT NULL,
+        hashed_password TEXT NOT NULL, grade TEXT, subject TEXT DEFAULT 'Gen',
+        flash_usage INTEGER DEFAULT 0, pro_usage INTEGER DEFAULT 0, user_id TEXT UNIQUE NOT NULL,
+        session_id TEXT, last_active_date TEXT, ai_level TEXT DEFAULT 'Grade-Level',
+        theme TEXT DEFAULT 'Auto', total_xp INTEGER DEFAULT 0, level INTEGER DEFAULT 1,
+        streak_count INTEGER DEFAULT 0, last_study_date TEXT, daily_goal INTEGER DEFAULT 3,
+        daily_lessons_completed INTEGER DEFAULT 0, last_spin_date TEXT, streak_freezes INTEGER DEFAULT 0,
+        sounds_enabled INTEGER DEFAULT 1, pomodoros_completed INTEGER DEFAULT 0
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_last_active ON Users (last_active_date)",
+    """CREATE TABLE IF NOT EXISTS ChatLogs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL,
+        user_id TEXT NOT NULL, title TEXT, messages TEXT,
+        timestamp TEXT DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_chat_user_time ON ChatLogs (user_id, timestamp)",
+    """CREATE TABLE IF NOT EXISTS UserBadges (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL,
+        badge_id TEXT NOT NULL, earned_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (user_id, badge_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS UserCourseProgress (
+        user_id TEXT NOT NULL, course_id TEXT NOT NULL,
+        completed_mask INTEGER NOT NULL DEFAULT 0,
+        updated_date TEXT DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (user_id, course_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS Pets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, pet_id TEXT UNIQUE NOT NULL,
+        name TEXT NOT NULL, emoji TEXT NOT NULL, rarity TEXT NOT NULL,
+        xp_multiplier REAL NOT NULL, is_limited INTEGER DEFAULT 0,
+        limited_until TEXT, description TEXT
+    )""",
+    """CREATE TABLE IF NOT EXISTS UserPets (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, pet_id TEXT NOT NULL,
+        acquired_date TEXT DEFAULT CURRENT_TIMESTAMP, quantity INTEGER NOT NULL DEFAULT 1,
+        last_acquired TEXT, UNIQUE (user_id, pet_id)
+    )""",
+    """CREATE TABLE IF NOT EXISTS UserEquippedPets (
+        user_id TEXT NOT NULL, slot INTEGER NOT NULL, pet_id TEXT NOT NULL,
+        PRIMARY KEY (user_id, slot)
+    )""",
+    """CREATE TABLE IF NOT EXISTS UserEggPurchases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, egg_type TEXT NOT NULL,
+        purchased_date TEXT DEFAULT CURRENT_TIMESTAMP, pet_received TEXT NOT NULL, spend_key TEXT
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_user_purchases ON UserEggPurchases (user_id)",
+    "CREATE INDEX IF NOT EXISTS idx_spend_key ON UserEggPurchases (spend_key)",
+    """CREATE TABLE IF NOT EXISTS Leaderboard (
+        board TEXT NOT NULL, user_id TEXT NOT NULL, username TEXT, grade TEXT,
+        xp INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (board, user_id)
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_board_xp ON Leaderboard (board, xp)",
+    "CREATE INDEX IF NOT EXISTS idx_board_grade_xp ON Leaderboard (board, grade, xp)",
+    """CREATE TABLE IF NOT EXISTS LeaderboardBuckets (
+        board TEXT NOT NULL, grade TEXT NOT NULL, bucket INTEGER NOT NULL,
+        users INTEGER NOT NULL DEFAULT 0, PRIMARY KEY (board, grade, bucket)
+    )""",
+    """CREATE TABLE IF NOT EXISTS XpSpends (
+        idempotency_key TEXT PRIMARY KEY, user_id TEXT NOT NULL, amount INTEGER NOT NULL,
+        reason TEXT, spent_date TEXT DEFAULT CURRENT_TIMESTAMP
+    )""",
+    "CREATE INDEX IF NOT EXISTS idx_user_spends ON XpSpends (user_id)",
+]
+
+
+class SQLiteCursor:
+    """mysql.connector-style cursor over sqlite3: %s params, dict rows, buffered results"""
+
+    def __init__(self, cursor, dictionary=False):
+        self._cursor = cursor
+        self._dictionary = dictionary
+        self._rows = []
+        self.rowcount = -1
+
+    def execute(self, sql, params=()):
+        self._cursor.execute(sql.replace("%s", "?"), tuple(params or ()))
+        if self._cursor.description is None:
+            self._rows = []
+            self.rowcount = self._cursor.rowcount
+            return
+        rows = self._cursor.fetchall()
+        if self._dictionary:
+            cols = [d[0] for d in self._cursor.description]
+            rows = [dict(zip(cols, r)) for r in rows]
+        self._rows = rows
+        self.rowcount = len(rows)
+
+    def executemany(self, sql, seq_params):
+        self._cursor.executemany(sql.replace("%s", "?"), [tuple(p) for p in seq_params])
+        self._rows = []
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchall(self):
+        rows, self._rows = self._rows, []
+        return rows
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def lastrowid(self):
+        return self._cursor.lastrowid
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    def __init__(self, conn):
+        self._conn = conn
+
+    def cursor(self, dictionary=False, buffered=None):
+        return SQLiteCursor(self._conn.cursor(), dictionary)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class SQLiteBackend(Backend):
+    name = "sqlite"
+    IntegrityError = sqlite3.IntegrityError
+    insert_ignore = "INSERT OR IGNORE"
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.path = config.get("SQLITE_PATH", "sorokin.db")
+
+    def connect(self, replica=False):
+        # No replicas: WAL readers don't block the writer, so reads share the one file
+        conn = sqlite3.connect(self.path, timeout=BUSY_TIMEOUT_S, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return SQLiteConnection(conn)
+
+    def on_conflict(self, *key_columns):
+        return f"ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET"
+
+    def new(self, column):
+        return f"excluded.{column}"
+
+    def create_schema(self, conn):
+        """Create the current schema; a fresh file has no legacy layouts to migrate"""
+        cur = conn.cursor()
+        for stmt in SCHEMA:
+            cur.execute(stmt)
+        cur.close()
@@ -0,0 +1,54 @@
+import random
+from collections import Counter
+
+import pytest
+
+import pet_collection
+
+DRAWS = 200_000
+
+
+def expected_weights(weighted):
+    total = sum(w for _, w in weighted)
+    return {item: w / total for item, w in weighted}
+
+
+def sample(table, draws, rng):
+    items, prob, alias = table
+    counts = Counter()
+    for _ in range(draws):
+        i = rng.randrange(len(items))
+        counts[items[i] if rng.random() < prob[i] else items[alias[i]]] += 1
+    return counts
+
+
+def test_alias_table_reproduces_weights():
+    weighted = [("a", 1), ("b", 2), ("c", 3), ("d", 14)]
+    counts = sample(pet_collection.build_alias_table(weighted), DRAWS, random.Random(1))
+    # chi-square with 3 degrees of freedom; 16.27 is the p=0.001 critical value
+    chi2 = sum((counts[item] - DRAWS * p) ** 2 / (DRAWS * p) for item, p in expected_weights(weighted).items())
+    assert chi2 < 16.27
+
+
+@pytest.mark.parametrize("egg_type", sorted(pet_collection.EGG_ODDS))
+def test_open_eggs_matches_rarity_odds(egg_type):
+    pets = pet_collection.open_eggs(egg_type, count=DRAWS, rng=random.Random(2))
+    rarities = Counter(p["rarity"] for p in pets)
+    odds = pet_collection.EGG_ODDS[egg_type]
+    assert set(rarities) == set(odds)
+    for rarity, chance in odds.items():
+        assert rarities[rarity] / DRAWS == pytest.approx(chance / 100, abs=0.005)
+    assert all(p["is_limited"] == (egg_type == "newyear") for p in pets)
+
+
+def test_fixed_seed_gives_fixed_sequence():
+    first = [p["pet_id"] for p in pet_collection.open_eggs("legendary", count=50, rng=random.Random(42))]
+    again = [p["pet_id"] for p in pet_collection.open_eggs("legendary", count=50, rng=random.Random(42))]
+    other = [p["pet_id"] for p in pet_collection.open_eggs("legendary", count=50, rng=random.Random(43))]
+    assert first == again
+    assert first != other
+
+
+def test_unknown_egg_type_rolls_common():
+    assert (pet_collection.open_eggs("mystery", count=20, rng=random.Random(3))
+            == pet_collection.open_eggs("common", count=20, rng=random.Random(3)))
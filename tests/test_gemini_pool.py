@@ -0,0 +1,75 @@
+import pytest
+
+import gemini_pool
+
+
+class ResourceExhausted(Exception):
+    pass
+
+
+class FakeGenai:
+    """Stand-in for google.generativeai: the configured key is global and a model binds it on its first call"""
+
+    def __init__(self, exhausted=(), fail_mid_stream=()):
+        self.exhausted = set(exhausted)
+        self.fail_mid_stream = set(fail_mid_stream)
+        self.configured = None
+        self.calls = []
+        genai = self
+
+        class GenerativeModel:
+            def __init__(self, name, **kwargs):
+                self.key = None
+
+            def generate_content(self, contents, stream=False, **kwargs):
+                self.key = self.key or genai.configured
+                genai.calls.append(self.key)
+                return genai.response(self.key)
+
+        self.GenerativeModel = GenerativeModel
+
+    def configure(self, api_key=None, **kwargs):
+        self.configured = api_key
+
+    def response(self, key):
+        def chunks():
+            if key in self.exhausted:
+                raise ResourceExhausted("429 quota exceeded")
+            yield f"{key}:1"
+            if key in self.fail_mid_stream:
+                raise ResourceExhausted("429 quota exceeded")
+            yield f"{key}:2"
+        return chunks()
+
+
+def pool_with(genai, *secrets):
+    pool = gemini_pool.GeminiPool([gemini_pool.ApiKey(s) for s in secrets])
+    pool._genai = genai
+    return pool
+
+
+def test_quota_error_while_streaming_fails_over_before_first_chunk():
+    genai = FakeGenai(exhausted={"key-a"})
+    pool = pool_with(genai, "key-a", "key-b")
+    assert list(pool.model("m").generate_content("hi", stream=True)) == ["key-b:1", "key-b:2"]
+    a, b = pool.keys
+    assert (a.throttles, a.parked_until.get("m", 0) > 0) == (1, True)
+    assert b.throttles == 0
+
+
+def test_quota_error_mid_stream_marks_the_key():
+    genai = FakeGenai(fail_mid_stream={"key-a"})
+    pool = pool_with(genai, "key-a")
+    resp = pool.model("m").generate_content("hi", stream=True)
+    with pytest.raises(ResourceExhausted):
+        list(resp)
+    assert pool.keys[0].throttles == 1
+
+
+def test_each_key_keeps_its_own_model():
+    genai = FakeGenai()
+    pool = pool_with(genai, "key-a", "key-b")
+    for _ in range(4):
+        list(pool.model("m").generate_content("hi", stream=True))
+    assert sorted(genai.calls) == ["key-a", "key-a", "key-b", "key-b"]
+    assert all(model.key == key.secret for key in pool.keys for model in key.models.values())
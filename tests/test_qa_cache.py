@@ -0,0 +1,36 @@
+import pytest
+
+import qa_cache
+
+
+def cached(question):
+    index = qa_cache.LessonIndex()
+    index.add(question, "answer")
+    return index
+
+
+@pytest.mark.parametrize("asked, probe", [
+    ("whats the slope", "What is slope?"),
+    ("How do I find the slope of a line?", "how do i find the slope of any line"),
+    ("Can you explain photosynthesis?", "explain photosynthesis please"),
+])
+def test_near_duplicates_match(asked, probe):
+    assert cached(asked).lookup(probe) is not None
+
+
+@pytest.mark.parametrize("asked, probe", [
+    ("What is the difference between mean and median?", "What is the difference between median and mode?"),
+    ("Is mitosis faster than meiosis?", "Is meiosis faster than mitosis?"),
+    ("How do I factor x^2-4?", "Why do I factor x^2-4?"),
+    ("Why is 1 not a prime number?", "Why is 1 a prime number?"),
+    ("slope of y=2x+1", "slope of y=5x+3"),
+])
+def test_different_questions_do_not_match(asked, probe):
+    assert cached(asked).lookup(probe) is None
+
+
+def test_thumbs_down_evicts_fresh_answer():
+    index = qa_cache.LessonIndex()
+    entry = index.add("What is slope?", "answer")
+    assert index.feedback(entry.id, helpful=False)
+    assert index.lookup("what is slope") is None
@@ -0,0 +1,59 @@
+from datetime import date
+
+import pytest
+
+import pet_collection
+import storage
+
+USER = "u1"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = storage.open_storage({"DB_BACKEND": "sqlite", "SQLITE_PATH": str(tmp_path / "test.db")})
+    store.create_schema()
+    store.pets.seed_catalog(pet_collection.PET_CATALOG, pet_collection.PET_COLUMNS)
+    assert store.users.create("alice", "hash", "9th", USER, "s1", date(2026, 1, 1))
+    store.execute("UPDATE Users SET total_xp=%s WHERE user_id=%s", (500, USER))
+    return store
+
+
+def count(store, sql, params=()):
+    return store.fetchone(sql, params, dictionary=False)[0]
+
+
+def quantities(store):
+    return {r["pet_id"]: r["quantity"] for r in store.fetchall("SELECT pet_id, quantity FROM UserPets WHERE user_id=%s", (USER,))}
+
+
+def test_replayed_key_charges_once(store):
+    first = store.pets.buy(USER, "common", {"whiskers": 1}, ["whiskers"], 50, "key-1")
+    again = store.pets.buy(USER, "common", {"buddy": 1}, ["buddy"], 50, "key-1")
+    assert first == (450, ["whiskers"])
+    assert again == (450, ["whiskers"])
+    assert count(store, "SELECT COUNT(*) FROM XpSpends WHERE idempotency_key=%s", ("key-1",)) == 1
+    assert store.users.total_xp(USER) == 450
+    assert quantities(store) == {"whiskers": 1}
+
+
+def test_spend_xp_replay_on_one_cursor(store):
+    with store.transaction() as cur:
+        assert store.users.spend_xp(cur, USER, 100, "key-2", "test") == (400, False)
+        assert store.users.spend_xp(cur, USER, 100, "key-2", "test") == (400, True)
+    assert count(store, "SELECT COUNT(*) FROM XpSpends WHERE user_id=%s", (USER,)) == 1
+
+
+def test_insufficient_balance_writes_nothing(store):
+    assert store.pets.buy(USER, "legendary", {"leo": 2}, ["leo", "leo"], 1000, "key-3") == (None, [])
+    assert store.users.total_xp(USER) == 500
+    assert count(store, "SELECT COUNT(*) FROM UserPets WHERE user_id=%s", (USER,)) == 0
+    assert count(store, "SELECT COUNT(*) FROM XpSpends WHERE user_id=%s", (USER,)) == 0
+    assert count(store, "SELECT COUNT(*) FROM UserEggPurchases WHERE user_id=%s", (USER,)) == 0
+
+
+def test_upsert_increments_quantity(store):
+    store.pets.buy(USER, "common", {"whiskers": 2, "buddy": 1}, ["whiskers", "buddy", "whiskers"], 150, "key-4")
+    store.pets.buy(USER, "common", {"whiskers": 1, "hoot": 1}, ["hoot", "whiskers"], 100, "key-5")
+    assert quantities(store) == {"whiskers": 3, "buddy": 1, "hoot": 1}
+    assert store.users.total_xp(USER) == 250
+    assert count(store, "SELECT COUNT(*) FROM UserEggPurchases WHERE user_id=%s", (USER,)) == 5
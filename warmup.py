@@ -0,0 +1,174 @@
+"""Pre-traffic warm-up and readiness for a new Sorokin AI server process.
+
+The app hands start() its warm-up steps on every script run; the first call
+runs them once, in the background, so the first page isn't held up:
+- database: fill the connection pool for the primary (and replica);
+- catalogs: load the pet catalog, theme assets and content pack into the process caches;
+- llm: import and configure the Gemini client;
+- lessons: pre-generate the most popular lessons.
+A failing required step leaves the process not ready, and the next start()
+retries the steps. Optional steps (the lesson pre-fill) never block readiness.
+Once the required steps pass, READY_FILE records the process id, its start time
+and the step timings. The first start() in a process deletes any READY_FILE left
+behind. A record also only counts while its pid belongs to the same process that
+wrote it. Streamlit runs as PID 1 in the container, so after `docker restart`
+the old file names a live pid.
+
+Streamlit can't mount a custom HTTP route, and it runs no app code until a
+session connects. So the deep health check is this script, used as the
+container HEALTHCHECK:
+
+    python warmup.py --url http://localhost:8501
+
+It exits 0 only when the server answers /_stcore/health and READY_FILE names
+the live process that wrote it. While the server is up but not ready, it opens one headless
+session with ?warmup=1, and that session starts the warm-up before any
+student arrives.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+log = logging.getLogger("sorokin.warmup")
+
+READY_FILE = os.environ.get("SOROKIN_READY_FILE", os.path.join(tempfile.gettempdir(), "sorokin-ready.json"))
+TRIGGER_TIMEOUT_S = 15.0
+
+_lock = threading.Lock()
+STATE = {"status": "idle", "started": None, "steps": {}, "errors": {}}
+
+
+def run(steps):
+    """Run (name, fn, required) steps in order; marks the process ready if every required step passed"""
+    ok = True
+    for name, fn, required in steps:
+        start = time.perf_counter()
+        try:
+            fn()
+        except Exception as e:
+            STATE["errors"][name] = f"{type(e).__name__}: {e}"
+            log.warning("warm-up step %s failed: %s", name, e)
+            ok = ok and not required
+        STATE["steps"][name] = round((time.perf_counter() - start) * 1000, 1)
+    with _lock:
+        STATE["status"] = "ready" if ok else "failed"
+    if ok:
+        mark_ready()
+
+
+def start(steps):
+    """Start the warm-up in the background unless it is running or done; True if this call started it"""
+    import parallel_io
+    with _lock:
+        if STATE["status"] in ("running", "ready"):
+            return False
+        if STATE["started"] is None:
+            _remove_ready_file()
+        STATE.update(status="running", started=time.time(), steps={}, errors={})
+    parallel_io.submit(lambda: run(steps))
+    return True
+
+
+def process_started(pid):
+    """When `pid` started, in clock ticks since boot (Linux); tells a reused pid apart. None elsewhere"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return int(f.read().rsplit(")", 1)[1].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _remove_ready_file():
+    try:
+        os.remove(READY_FILE)
+    except FileNotFoundError:
+        pass
+
+
+def mark_ready():
+    pid = os.getpid()
+    tmp = f"{READY_FILE}.{pid}"
+    with open(tmp, "w") as f:
+        json.dump({"pid": pid, "process_started": process_started(pid), "at": time.time(),
+                   "steps": STATE["steps"], "errors": STATE["errors"]}, f)
+    os.replace(tmp, READY_FILE)
+
+
+def read_ready_file():
+    """The ready record if the process that wrote it is still running, else None"""
+    try:
+        with open(READY_FILE) as f:
+            ready = json.load(f)
+        os.kill(ready["pid"], 0)
+        started = ready["process_started"]
+    except (OSError, ValueError, KeyError):
+        return None
+    return ready if started == process_started(ready["pid"]) else None
+
+
+def trigger(url, timeout=TRIGGER_TIMEOUT_S):
+    """Open one headless session with ?warmup=1 so the server runs the app script once"""
+    import asyncio
+
+    from streamlit.proto.BackMsg_pb2 import BackMsg
+    from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+    from tornado.websocket import websocket_connect
+
+    async def session():
+        ws = await websocket_connect(url.replace("http", "ws", 1) + "/_stcore/stream", connect_timeout=timeout)
+        msg = BackMsg()
+        msg.rerun_script.query_string = "warmup=1"
+        ws.write_message(msg.SerializeToString(), binary=True)
+        # The script stops right after starting the warm-up; hang up once it finishes
+        while True:
+            data = await ws.read_message()
+            if data is None:
+                break
+            reply = ForwardMsg()
+            reply.ParseFromString(data)
+            if reply.WhichOneof("type") == "script_finished":
+                break
+        ws.close()
+
+    async def bounded():
+        await asyncio.wait_for(session(), timeout)
+
+    asyncio.run(bounded())
+
+
+def check(url):
+    """Deep health: 0 when the server is up and warmed, 1 otherwise (starting the warm-up if needed)"""
+    try:
+        with urllib.request.urlopen(url + "/_stcore/health", timeout=5) as resp:
+            if resp.status != 200:
+                return 1
+    except OSError as e:
+        print(f"not serving: {e}")
+        return 1
+    ready = read_ready_file()
+    if ready is not None:
+        print(f"ready: {json.dumps(ready['steps'])}")
+        return 0
+    print("serving, warming up")
+    try:
+        trigger(url)
+    except Exception as e:
+        print(f"warm-up trigger failed: {type(e).__name__}: {e}")
+    return 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8501")
+    args = parser.parse_args(argv)
+    return check(args.url.rstrip("/"))
+
+
+if __name__ == "__main__":
+    sys.exit(main())